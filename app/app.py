@@ -1,17 +1,16 @@
 import sys
 from pathlib import Path
 
-# Add project root to path for imports
-sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+# Add project root to path for imports (once: the script re-runs on every interaction)
+ROOT = str(Path(__file__).resolve().parent.parent)
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
 
 import streamlit as st
-import pandas as pd
-from src.sqlite_io import init_db, run_query
-from src.generate_data import run_data_generation
-from src.build_facts_kpis import run_pipeline
-from src.quality_checks import run_quality_gates
+from src.query_cache import cached_query
+# Only the rebuild controls; the pipeline modules are imported by the rebuild worker when it starts
+from src.rebuild import start_rebuild, rebuild_status
 from src.config import DB_PATH
-import os
 
 st.set_page_config(
     page_title="Clinical Quality & Safety OPS",
@@ -28,24 +27,37 @@ col1, col2 = st.columns([1, 2])
 
 with col1:
     st.info("System Control Panel")
-    if st.button("🏗️ Build / Refresh DB", type="primary"):
-        with st.status("Executing Pipeline...", expanded=True) as status:
-            st.write("Initializing Schema...")
-            init_db()
-            st.write("Generating Synthetic Data (Patients, Encounters)...")
-            run_data_generation()
-            st.write("Building Derived Facts & KPIs...")
-            run_pipeline()
-            st.write("Running Quality Gates...")
-            run_quality_gates()
-            status.update(label="Pipeline Completed via SQLite!", state="complete", expanded=False)
-        st.success("Database rebuilt successfully.")
+    running = (rebuild_status() or {}).get("state") == "running"
+    if st.button("🏗️ Build / Refresh DB", type="primary", disabled=running):
+        # Builds into a scratch DB in the background; viewers keep the current data until the swap
+        if not start_rebuild():
+            st.warning("A rebuild is already running.")
+        running = True
+
+    # Polls once a second only while a rebuild runs
+    @st.fragment(run_every=1 if running else None)
+    def rebuild_progress():
+        job = rebuild_status()
+        if job is None:
+            return
+        if job["state"] == "running":
+            st.progress(job["progress"], text=f"{job['step']}... ({job['elapsed_s']:.0f}s)")
+            return
+        if running:
+            # Finished since the last full run: rerun the app, which stops the polling and shows the new data
+            st.rerun()
+        if job["state"] == "succeeded":
+            st.success(f"{job['message']} ({job['elapsed_s']:.0f}s)")
+        else:
+            st.error(f"Rebuild failed: {job['message']}")
+
+    rebuild_progress()
 
 with col2:
-    if os.path.exists(DB_PATH):
+    if DB_PATH.exists():
         st.success(f"Connected to DB: `{DB_PATH}`")
         try:
-            counts = run_query("SELECT (SELECT Count(*) FROM patients) as p, (SELECT Count(*) FROM encounters) as e")
+            counts = cached_query("SELECT (SELECT Count(*) FROM patients) as p, (SELECT Count(*) FROM encounters) as e")
             st.metric("Total Patients", counts['p'].iloc[0])
             st.metric("Total Encounters", counts['e'].iloc[0])
         except Exception as e:
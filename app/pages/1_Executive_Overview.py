@@ -1,11 +1,19 @@
 import sys
 from pathlib import Path
-sys.path.insert(0, str(Path(__file__).resolve().parent.parent.parent))
+# Project root on the path once (pages re-run on every interaction)
+ROOT = str(Path(__file__).resolve().parent.parent.parent)
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
 
 import streamlit as st
-import pandas as pd
 import plotly.express as px
-from src.sqlite_io import run_query
+import plotly.graph_objects as go
+from src.config import KPI_DEFINITIONS, ROLLING_WINDOWS, SPC_SIGMA
+from src.dashboard_queries import (
+    DRILL_DIMENSIONS, list_months, list_service_lines, list_cube_values, kpi_totals, kpi_trend, kpi_snapshot,
+    list_facilities, facility_kpis, sketch_summary, kpi_control_chart, timings_summary
+)
+from src.sqlite_io import run_concurrently
 
 st.set_page_config(page_title="Executive Overview", layout="wide")
 
@@ -14,10 +22,11 @@ st.markdown("High-level operational KPIs tracking timeliness, compliance, and sa
 
 # Check for data
 try:
-    df_service = run_query("SELECT * FROM kpi_monthly_service")
-    df_overall = run_query("SELECT * FROM kpi_monthly_overall")
-    df_latest = run_query("SELECT MAX(month) as last_month FROM kpi_monthly_overall")
-    last_month = df_latest['last_month'].iloc[0]
+    month_list = list_months()
+    services = list_service_lines()
+    if not month_list:
+        # KPI tables are declared in the schema, so an unbuilt DB has them empty
+        raise ValueError("KPI tables are empty")
 except:
     st.error("Database not ready or empty. Go to Home and click 'Build/Refresh DB'.")
     st.stop()
@@ -25,59 +34,66 @@ except:
 # --- Filters ---
 with st.sidebar:
     st.header("Filters")
-    month_list = sorted(df_service['month'].unique(), reverse=True)
     selected_month = st.selectbox("Select Month", month_list, index=0)
-    
-    services = sorted(df_service['service_line'].unique())
     selected_services = st.multiselect("Service Lines", services, default=services)
 
-# --- Filter Data ---
-# For tiles: specific month
-df_month_filtered = df_service[
-    (df_service['month'] == selected_month) & 
-    (df_service['service_line'].isin(selected_services))
-]
-
-# For trends: all months, filtered services
-df_trend_filtered = df_service[df_service['service_line'].isin(selected_services)]
-
-# Aggregations for Tiles (Weighted Averages based on totals)
-total_enc = df_month_filtered['total_encounters'].sum()
-
-def safe_rate(num, den):
-    return (num / den) if den > 0 else 0
-
-# Calc aggregate metrics for the selection
-# We need to re-sum counts because rates aren't additive
-enc_with_event = df_month_filtered['encounters_with_event'].sum()
-enc_reported = df_month_filtered['encounters_reported'].sum()
-enc_ontime = df_month_filtered['on_time_encounters'].sum()
-
-compliance_rate = safe_rate(enc_reported, enc_with_event)
-timeliness_rate = safe_rate(enc_ontime, enc_reported)
-
-adr_count = df_month_filtered['adr_count'].sum()
-severe_count = df_month_filtered['severe_count'].sum()
-high_risk_count = df_month_filtered['high_risk_exposure_count'].sum()
-
-adr_rate_1000 = safe_rate(adr_count, total_enc) * 1000
-severe_rate_1000 = safe_rate(severe_count, total_enc) * 1000
-high_risk_rate = safe_rate(high_risk_count, total_enc)
+    # Drill-down: each dimension reads its precomputed subtotal unless narrowed
+    st.header("Drill-down")
+    drill = {}
+    for dim in DRILL_DIMENSIONS:
+        choice = st.selectbox(dim.replace('_', ' ').title(), ["All", *list_cube_values(dim)])
+        if choice != "All":
+            drill[dim] = choice
+    if 'event_type' in drill or 'severity' in drill:
+        st.caption("With an event filter, encounter counts cover encounters having such an event.")
+
+# --- Query Data ---
+# Measures are summed and every registered KPI re-derived in SQL for the selection (rates aren't additive).
+# The page's queries are independent, so they run concurrently on the read pool.
+loads = {
+    "kpi_totals": lambda: kpi_totals(selected_month, selected_services, drill),
+    "kpi_trend": lambda: kpi_trend(selected_services, drill),
+    "kpi_snapshot": lambda: kpi_snapshot(selected_month, selected_services, drill),
+    "sketch_summary": lambda: sketch_summary(selected_services, [selected_month]),
+}
+if selected_services and not drill:
+    # Control limits are kept per service line, so they aren't shown for drill-down slices (or no selection)
+    loads["kpi_control_chart"] = lambda: kpi_control_chart(selected_services)
+if list_facilities():
+    loads["facility_kpis"] = lambda: facility_kpis(selected_month)
+data, timings = run_concurrently(loads)
+totals, df_trend, df_month_filtered = data["kpi_totals"], data["kpi_trend"], data["kpi_snapshot"]
 
 # --- GUI Layout ---
 
-# Row 1: Tiles
-c1, c2, c3, c4 = st.columns(4)
-c1.metric("Total Encounters", f"{int(total_enc):,}", help="Total discharges/visits in period")
-c2.metric("Compliance Rate", f"{compliance_rate:.1%}", help="Events Reported / Total Events Detected")
-c3.metric("Timeliness Rate", f"{timeliness_rate:.1%}", help="Reported within 7 days")
-c4.metric("High Risk Exposure", f"{high_risk_rate:.1%}", help="% Encounters with High Risk Meds")
-
-c5, c6, c7, c8 = st.columns(4)
-c5.metric("ADR Rate / 1k", f"{adr_rate_1000:.1f}")
-c6.metric("Severe Events / 1k", f"{severe_rate_1000:.1f}")
-c7.metric("ADR Raw Count", int(adr_count))
-c8.metric("Severe Raw Count", int(severe_count))
+def add_control_band(fig, kpi, color, band_color):
+    """Shades a KPI's SPC control limits on a trend figure, with its trailing-window rates and out-of-control months."""
+    if "kpi_control_chart" not in data:
+        return
+    spc = data["kpi_control_chart"]
+    series = spc[spc['kpi'] == kpi]
+    label = KPI_DEFINITIONS[kpi]['label']
+    fig.add_trace(go.Scatter(x=series['month'], y=series['lcl'], mode='lines', line=dict(width=0),
+                             showlegend=False, hoverinfo='skip'))
+    fig.add_trace(go.Scatter(x=series['month'], y=series['ucl'], mode='lines', line=dict(width=0), fill='tonexty',
+                             fillcolor=band_color, name=f"{label} control limits"))
+    for window, dash in zip(ROLLING_WINDOWS, ['dot', 'dash']):
+        fig.add_trace(go.Scatter(x=series['month'], y=series[f'rate_{window}m'], mode='lines',
+                                 line=dict(color=color, dash=dash, width=1), name=f"{label} trailing {window}m"))
+    signals = series[(series['rate'] > series['ucl']) | (series['rate'] < series['lcl'])]
+    fig.add_trace(go.Scatter(x=signals['month'], y=signals['rate'], mode='markers',
+                             marker=dict(color='red', symbol='x', size=10), name=f"{label} out of control"))
+
+# Tiles: total encounters, every registered KPI, then the raw event counts
+tiles = [("Total Encounters", f"{int(totals['total_encounters']):,}", "Total discharges/visits in period"),
+         ("Distinct Patients (≈)", f"{data['sketch_summary']['distinct_patients']:,}",
+          "HyperLogLog estimate merged across the selected service lines; not narrowed by the drill-down")]
+tiles += [(kpi['label'], kpi['format'].format(totals[name]), kpi.get('help')) for name, kpi in KPI_DEFINITIONS.items()]
+tiles += [("ADR Raw Count", f"{int(totals['adr_count']):,}", None),
+          ("Severe Raw Count", f"{int(totals['severe_count']):,}", None)]
+for start in range(0, len(tiles), 4):
+    for col, (label, value, help_text) in zip(st.columns(4), tiles[start:start + 4]):
+        col.metric(label, value, help=help_text)
 
 st.divider()
 
@@ -86,50 +102,67 @@ col_trend1, col_trend2 = st.columns(2)
 
 with col_trend1:
     st.subheader("Severe Events per 1000 (Trend)")
-    # Agg by month for trend line
-    trend_agg = df_trend_filtered.groupby('month').agg({
-        'severe_count': 'sum',
-        'total_encounters': 'sum'
-    }).reset_index()
-    trend_agg['rate'] = (trend_agg['severe_count'] / trend_agg['total_encounters']) * 1000
-    
-    fig_sev = px.line(trend_agg, x='month', y='rate', markers=True, title="Severe Rate Trend")
+    fig_sev = px.line(df_trend, x='month', y='severe_per_1000', markers=True, title="Severe Rate Trend",
+                      labels={'severe_per_1000': 'rate'})
+    add_control_band(fig_sev, 'severe_per_1000', '#636efa', 'rgba(99, 110, 250, 0.15)')
     st.plotly_chart(fig_sev, use_container_width=True)
 
 with col_trend2:
     st.subheader("Compliance & Timeliness Trend")
-    trend_comp = df_trend_filtered.groupby('month').agg({
-        'encounters_with_event': 'sum',
-        'encounters_reported': 'sum',
-        'on_time_encounters': 'sum'
-    }).reset_index()
-    trend_comp['Compliance'] = trend_comp['encounters_reported'] / trend_comp['encounters_with_event']
-    trend_comp['Timeliness'] = trend_comp['on_time_encounters'] / trend_comp['encounters_reported']
-    
+    trend_comp = df_trend.rename(columns={'compliance_rate': 'Compliance', 'timeliness_rate': 'Timeliness'})
     fig_comp = px.line(trend_comp, x='month', y=['Compliance', 'Timeliness'], markers=True, 
                        color_discrete_map={'Compliance': 'blue', 'Timeliness': 'green'})
+    add_control_band(fig_comp, 'compliance_rate', 'blue', 'rgba(0, 0, 255, 0.08)')
+    add_control_band(fig_comp, 'timeliness_rate', 'green', 'rgba(0, 128, 0, 0.08)')
     fig_comp.update_yaxes(range=[0, 1.1])
     st.plotly_chart(fig_comp, use_container_width=True)
 
+if "kpi_control_chart" in data and not data["kpi_control_chart"].empty:
+    st.caption(f"Bands: {SPC_SIGMA:g}σ p-/u-chart limits around the rate to date; dotted/dashed: trailing "
+               f"{' and '.join(f'{w}-month' for w in ROLLING_WINDOWS)} rates. Not shown with a drill-down filter.")
+
+    # Control chart of any KPI with one (ADR and severe events use u-charts, the rates p-charts)
+    spc_kpis = [name for name in KPI_DEFINITIONS if name in set(data["kpi_control_chart"]['kpi'])]
+    chart_kpi = st.selectbox("Control Chart", spc_kpis, format_func=lambda name: KPI_DEFINITIONS[name]['label'])
+    series = data["kpi_control_chart"][data["kpi_control_chart"]['kpi'] == chart_kpi]
+    fig_spc = go.Figure(go.Scatter(x=series['month'], y=series['rate'], mode='lines+markers', name="Monthly rate",
+                                   line=dict(color='#636efa')))
+    fig_spc.add_trace(go.Scatter(x=series['month'], y=series['center_line'], mode='lines', name="Center line",
+                                 line=dict(color='gray', dash='dash')))
+    add_control_band(fig_spc, chart_kpi, '#636efa', 'rgba(99, 110, 250, 0.15)')
+    fig_spc.update_layout(title=f"{KPI_DEFINITIONS[chart_kpi]['label']} ({series['chart'].iloc[0]}-chart)")
+    st.plotly_chart(fig_spc, use_container_width=True)
+
 # Row 3: Snapshot Table
 st.subheader(f"Service Line Snapshot ({selected_month})")
 st.dataframe(
-    df_month_filtered.set_index('service_line')[
-        ['total_encounters', 'compliance_rate', 'timeliness_rate', 'adr_per_1000', 'severe_per_1000']
-    ].style.format({
-        'compliance_rate': '{:.1%}',
-        'timeliness_rate': '{:.1%}',
-        'adr_per_1000': '{:.2f}',
-        'severe_per_1000': '{:.2f}'
-    }),
+    df_month_filtered.set_index('service_line')[['total_encounters', *KPI_DEFINITIONS]].style.format(
+        {name: kpi['format'] for name, kpi in KPI_DEFINITIONS.items()}
+    ),
     use_container_width=True
 )
 
-# Export
-csv_data = df_month_filtered.to_csv(index=False).encode('utf-8')
+# Row 4: Facilities (each facility shard's KPI table, unioned through ATTACH; 'ALL' = system-wide)
+if "facility_kpis" in data:
+    st.subheader(f"Facility Comparison ({selected_month})")
+    df_facilities = data["facility_kpis"]
+    if df_facilities.empty:
+        st.info("No facility shard has data for this month.")
+    else:
+        st.dataframe(
+            df_facilities.set_index('facility')[['total_encounters', *KPI_DEFINITIONS]].style.format(
+                {name: kpi['format'] for name, kpi in KPI_DEFINITIONS.items()}
+            ),
+            use_container_width=True
+        )
+
+# Export (the CSV is built only when the button is clicked)
 st.download_button(
     "📥 Download Monthly Data (CSV)",
-    csv_data,
+    lambda: df_month_filtered.to_csv(index=False),
     f"kpi_service_{selected_month}.csv",
-    "text/csv"
+    "text/csv",
+    on_click="ignore",
 )
+
+st.caption(timings_summary(timings))
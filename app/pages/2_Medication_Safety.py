@@ -1,38 +1,42 @@
 import sys
 from pathlib import Path
-sys.path.insert(0, str(Path(__file__).resolve().parent.parent.parent))
+# Project root on the path once (pages re-run on every interaction)
+ROOT = str(Path(__file__).resolve().parent.parent.parent)
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
 
 import streamlit as st
-import pandas as pd
 import plotly.express as px
-from src.sqlite_io import run_query
+from src.dashboard_queries import (
+    list_service_lines, list_event_types, event_counts_by_type, event_heatmap, event_metrics, event_metrics_csv,
+    high_risk_trend, timings_summary,
+)
+from src.sqlite_io import run_concurrently
 
 st.set_page_config(page_title="Medication Safety", layout="wide")
 st.title("💊 Medication Safety Deep Dive")
 
 try:
-    df_metrics = run_query("SELECT * FROM event_metrics_monthly")
-    # We also need context for high risk exposure which is in kpi_service
-    df_kpi = run_query("SELECT * FROM kpi_monthly_service")
+    all_services = list_service_lines("event_metrics_monthly")
+    all_types = list_event_types()
+    if not all_services:
+        raise ValueError("KPI tables are empty")
 except:
     st.error("Data missing. Build DB first.")
     st.stop()
 
 # --- Filters ---
 with st.sidebar:
-    all_services = sorted(df_metrics['service_line'].unique())
     selected_service = st.multiselect("Service Line", all_services, default=all_services)
-    
-    all_types = sorted(df_metrics['event_type'].unique())
     selected_types = st.multiselect("Event Type", all_types, default=all_types)
 
-# Filter
-df_m_filt = df_metrics[
-    (df_metrics['service_line'].isin(selected_service)) &
-    (df_metrics['event_type'].isin(selected_types))
-]
-
-df_kpi_filt = df_kpi[df_kpi['service_line'].isin(selected_service)]
+# The page's queries are independent, so they run concurrently on the read pool
+data, timings = run_concurrently({
+    "event_counts_by_type": lambda: event_counts_by_type(selected_service, selected_types),
+    "high_risk_trend": lambda: high_risk_trend(selected_service),
+    "event_heatmap": lambda: event_heatmap(selected_service, selected_types),
+    "event_metrics": lambda: event_metrics(selected_service, selected_types),
+})
 
 # Layout
 
@@ -40,7 +44,7 @@ col1, col2 = st.columns(2)
 
 with col1:
     st.subheader("Event Count by Type (Aggregated)")
-    group_type = df_m_filt.groupby('event_type')['event_count'].sum().reset_index()
+    group_type = data["event_counts_by_type"]
     fig_bar = px.bar(group_type, x='event_type', y='event_count', color='event_type')
     st.plotly_chart(fig_bar, use_container_width=True)
 
@@ -48,18 +52,22 @@ with col2:
     st.subheader("High Risk Exposure Rate Trend")
     # Trend over time (avg of selected services weighted? Or just boxplot? Let's do line chart by service)
     # kpi table has high_risk_exposure_rate
-    fig_line = px.line(df_kpi_filt, x='month', y='high_risk_exposure_rate', color='service_line')
+    fig_line = px.line(data["high_risk_trend"], x='month', y='high_risk_exposure_rate', color='service_line')
     st.plotly_chart(fig_line, use_container_width=True)
 
 st.divider()
 
 st.subheader("Event Heatmap (Month vs Service)")
 # Aggregate counts
-heatmap_data = df_m_filt.groupby(['month', 'service_line'])['event_count'].sum().reset_index()
+heatmap_data = data["event_heatmap"]
 fig_heat = px.density_heatmap(heatmap_data, x='month', y='service_line', z='event_count', color_continuous_scale="Reds")
 st.plotly_chart(fig_heat, use_container_width=True)
 
 with st.expander("Raw Metrics Data"):
+    df_m_filt = data["event_metrics"]
     st.dataframe(df_m_filt)
-    csv = df_m_filt.to_csv(index=False).encode('utf-8')
-    st.download_button("Download Event Metrics", csv, "event_metrics.csv", "text/csv")
+    # Streamed from SQLite when clicked, not rebuilt on every rerun
+    st.download_button("Download Event Metrics", lambda: event_metrics_csv(selected_service, selected_types),
+                       "event_metrics.csv", "text/csv", on_click="ignore")
+
+st.caption(timings_summary(timings))
@@ -1,41 +1,64 @@
 import sys
 from pathlib import Path
-sys.path.insert(0, str(Path(__file__).resolve().parent.parent.parent))
+# Project root on the path once (pages re-run on every interaction)
+ROOT = str(Path(__file__).resolve().parent.parent.parent)
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
 
 import streamlit as st
 import pandas as pd
 import plotly.express as px
-from src.sqlite_io import run_query
+from src.query_cache import get_query_cache, current_build_version
+from src.dashboard_queries import (
+    list_service_lines, delay_bin_totals, data_quality_report, pipeline_runs, pipeline_stage_history,
+    AUDIT_SORT_COLUMNS, audit_date_range, audit_count, audit_page, audit_export_csv, sketch_summary, timings_summary,
+)
+from src.config import AUDIT_PAGE_SIZE, DELAY_PERCENTILES
+from src.sqlite_io import run_concurrently
 
 st.set_page_config(page_title="Compliance & Data Quality", layout="wide")
 st.title("🛡️ Compliance & Data Quality")
 
-# Load Data
+# Load Data: every query that doesn't depend on a widget, concurrently on the read pool
 try:
-    df_bins = run_query("SELECT * FROM reporting_delay_bins")
-    df_audit = run_query("SELECT * FROM audit_view")
-    df_dq = run_query("SELECT * FROM data_quality_report")
+    data, timings = run_concurrently({
+        "bin_services": lambda: list_service_lines("reporting_delay_bins"),
+        "audit_services": lambda: list_service_lines("audit_view"),
+        "audit_date_range": audit_date_range,
+        "data_quality_report": data_quality_report,
+        "pipeline_runs": pipeline_runs,
+        "pipeline_stage_history": pipeline_stage_history,
+    })
+    bin_services = data["bin_services"]
+    audit_first, audit_last = data["audit_date_range"]
+    df_dq = data["data_quality_report"]
 except:
     st.error("Build DB first.")
     st.stop()
 
 # --- Tabs ---
-tab1, tab2, tab3 = st.tabs(["Reporting Timeliness", "Audit Worklist", "Data Quality"])
+tab1, tab2, tab3, tab4 = st.tabs(["Reporting Timeliness", "Audit Worklist", "Data Quality", "Pipeline Health"])
 
 with tab1:
     st.subheader("Reporting Delay Distribution")
     # Filter by service?
-    services = st.multiselect("Filter Service Line", sorted(df_bins['service_line'].unique()), default=sorted(df_bins['service_line'].unique()))
-    
-    df_bins_filt = df_bins[df_bins['service_line'].isin(services)]
-    
-    # Agg
-    bin_agg = df_bins_filt.groupby('delay_bin')['count'].sum().reset_index()
-    # Ensure order
-    order_map = {"0-1":1, "2-3":2, "4-7":3, "8-14":4, "15-30":5, "31+":6}
-    bin_agg['order'] = bin_agg['delay_bin'].map(order_map)
-    bin_agg.sort_values('order', inplace=True)
+    services = st.multiselect("Filter Service Line", bin_services, default=bin_services)
     
+    # Agg (summed and ordered by bin in SQL); percentiles merged from the per-service KLL sketches
+    delay, delay_timings = run_concurrently({
+        "delay_bin_totals": lambda: delay_bin_totals(services),
+        "sketch_summary": lambda: sketch_summary(services),
+    })
+    timings.update(delay_timings)
+    bin_agg, delay_summary = delay["delay_bin_totals"], delay["sketch_summary"]
+
+    metric_cols = st.columns(len(DELAY_PERCENTILES) + 1)
+    metric_cols[0].metric("Events", f"{delay_summary['delay_events']:,}")
+    for col, q in zip(metric_cols[1:], DELAY_PERCENTILES):
+        value = delay_summary[f"delay_p{q * 100:g}"]
+        col.metric(f"P{q * 100:g} Delay (≈ days)", "—" if pd.isna(value) else f"{value:.0f}",
+                   help="Approximate percentile (KLL sketch) of report_delay_days")
+
     fig = px.bar(bin_agg, x='delay_bin', y='count', title="Events by Reporting Delay (Days)", text_auto=True)
     fig.add_vrect(x0=-0.5, x1=2.5, annotation_text="On Time (<=7)", annotation_position="top left", fillcolor="green", opacity=0.1, line_width=0)
     st.plotly_chart(fig, use_container_width=True)
@@ -44,21 +67,112 @@ with tab2:
     st.subheader("⚠️ Audit Worklist: High Risk + Adverse Event + Late Reporting")
     st.markdown("Encounters requiring immediate operational review.")
     
-    if not df_audit.empty:
-        st.dataframe(
-            df_audit[['encounter_id', 'service_line', 'admit_date', 'med_orders_count', 'length_of_stay_days']],
-            use_container_width=True
+    if audit_first is not None:
+        # Search and sort run in SQLite; only the current page is loaded
+        audit_services = data["audit_services"]
+        f1, f2, f3, f4 = st.columns([3, 2, 2, 1])
+        search_services = f1.multiselect("Service Lines", audit_services, default=audit_services, key="audit_services")
+        first, last = pd.Timestamp(audit_first).date(), pd.Timestamp(audit_last).date()
+        date_range = f2.date_input("Admit Date", (first, last), min_value=first, max_value=last, key="audit_dates")
+        sort = f3.selectbox("Sort By", AUDIT_SORT_COLUMNS, format_func=lambda c: c.replace('_', ' ').title(),
+                            key="audit_sort")
+        descending = f4.toggle("Desc", key="audit_desc")
+
+        # A range picker yields one date while the second is being chosen
+        date_from, date_to = (date_range[0], date_range[-1]) if date_range else (None, None)
+        search = dict(
+            services=None if set(search_services) >= set(audit_services) else search_services,
+            date_from=date_from, date_to=date_to,
+        )
+        # Cursor stack of the pages visited; reset when the search, sort or build changes
+        search_key = (tuple(search_services), date_from, date_to, sort, descending, current_build_version())
+        if st.session_state.get("audit_search_key") != search_key:
+            st.session_state["audit_search_key"] = search_key
+            st.session_state["audit_cursors"] = [None]
+        cursors = st.session_state["audit_cursors"]
+
+        audit, audit_timings = run_concurrently({
+            "audit_count": lambda: audit_count(**search),
+            "audit_page": lambda: audit_page(**search, sort=sort, descending=descending, after=cursors[-1]),
+        })
+        timings.update(audit_timings)
+        n_matches = audit["audit_count"]
+        page, next_cursor = audit["audit_page"]
+        st.dataframe(page, use_container_width=True, hide_index=True)
+
+        n_pages = max(1, -(-n_matches // AUDIT_PAGE_SIZE))
+        p1, p2, p3, p4 = st.columns([1, 1, 3, 2])
+        p1.button("◀ Prev", disabled=len(cursors) == 1, on_click=lambda: cursors.pop())
+        p2.button("Next ▶", disabled=next_cursor is None, on_click=lambda: cursors.append(next_cursor))
+        p3.caption(f"Page {len(cursors)} of {n_pages} · {n_matches:,} matching encounters")
+        # Built only on click, streamed chunk by chunk (from the build's snapshot when it has one)
+        p4.download_button(
+            "Download Audit List (CSV)",
+            lambda: audit_export_csv(**search, sort=sort, descending=descending),
+            "audit_worklist.csv", "text/csv", on_click="ignore",
         )
-        csv_audit = df_audit.to_csv(index=False).encode('utf-8')
-        st.download_button("Download Audit List (CSV)", csv_audit, "audit_worklist.csv", "text/csv")
     else:
         st.success("No encounters match the critical audit criteria! (Clean dashboard)")
 
 with tab3:
     st.subheader("Pipeline Health & Logic Checks")
     
-    for _, row in df_dq.iterrows():
-        status_color = "green" if row['status'] == 'PASS' else "red"
-        st.markdown(f"**{row['check']}**: :{status_color}[{row['status']}] (Count: {row['count']})")
+    status_colors = {'PASS': 'green', 'WARN': 'orange', 'FAIL': 'red'}
+    for table, rules in df_dq.groupby('table_name', sort=False):
+        # Summarised by the sampled pass; uniqueness is checked on every row even then
+        first = rules.loc[rules['sample_rate'].idxmin()]
+        sampled = first['sample_rate'] < 1
+        note = f", {first['sample_rate']:.0%} sample" if sampled else ""
+        st.markdown(f"**{table}** — {first['rows_checked']:,} rows checked in {first['elapsed_ms']:.0f} ms{note}")
+        for _, row in rules.iterrows():
+            status_color = status_colors.get(row['status'], 'red')
+            full = f", all {row['rows_checked']:,} rows" if sampled and row['sample_rate'] == 1 else ""
+            st.markdown(f"- {row['check']}: :{status_color}[{row['status']}] (Count: {row['count']}{full})")
     
     st.info("System timestamp: " + pd.Timestamp.now().strftime("%Y-%m-%d %H:%M:%S"))
+
+    cache = get_query_cache().stats()
+    st.caption(
+        f"Query cache: {cache['entries']} entries ({cache['bytes'] / 1e6:.1f} MB), "
+        f"{cache['hits']} hits / {cache['misses']} misses ({cache['hit_rate']:.0%} hit rate), "
+        f"{cache['evictions']} evictions"
+    )
+    st.caption(timings_summary(timings))
+
+with tab4:
+    st.subheader("Pipeline Health")
+    st.markdown("Per-stage wall time, memory and throughput of recent pipeline runs.")
+
+    runs = data["pipeline_runs"]
+    stages = data["pipeline_stage_history"]
+    if runs.empty:
+        st.info("No pipeline runs recorded yet.")
+    else:
+        last = runs.iloc[-1]
+        m1, m2, m3, m4 = st.columns(4)
+        m1.metric("Last Run", f"{last['label']} ({last['status']})")
+        m2.metric("Wall Time", f"{last['wall_s']:.1f} s")
+        m3.metric("Peak RSS", f"{last['peak_rss_mb']:.0f} MB")
+        written = last['db_bytes_written']
+        m4.metric("Bytes Written", "n/a" if pd.isna(written) else f"{written / 1e6:.1f} MB",
+                  help="Bytes the pipeline process sent to storage during the run (Linux only)")
+
+        # Top-level stages only, so nested stages aren't counted twice
+        top = stages[stages['parent_stage'].isna()]
+        fig_wall = px.bar(top, x='run_started_at', y='wall_s', color='stage', title="Wall Time per Run (s)",
+                          labels={'run_started_at': 'run', 'wall_s': 'seconds'})
+        st.plotly_chart(fig_wall, use_container_width=True)
+
+        col_a, col_b = st.columns(2)
+        with col_a:
+            fig_rss = px.line(stages, x='run_started_at', y='peak_rss_mb', color='stage', markers=True,
+                              title="Peak RSS by Stage (MB)", labels={'run_started_at': 'run'})
+            st.plotly_chart(fig_rss, use_container_width=True)
+        with col_b:
+            fig_rate = px.line(stages.dropna(subset=['rows_per_s']), x='run_started_at', y='rows_per_s',
+                               color='stage', markers=True, title="Throughput by Stage (rows/s)",
+                               labels={'run_started_at': 'run'})
+            st.plotly_chart(fig_rate, use_container_width=True)
+
+        with st.expander("Stage metrics"):
+            st.dataframe(stages.drop(columns=['run_id']), use_container_width=True)
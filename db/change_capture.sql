@@ -0,0 +1,37 @@
+-- Change capture triggers on the raw tables.
+-- Installed after a full build (not during bulk loads) and dropped before regeneration.
+-- Every touched encounter is logged with its patient when known; med_orders and
+-- safety_events rows are resolved to patients when the log is processed.
+
+CREATE TRIGGER IF NOT EXISTS cc_encounters_insert AFTER INSERT ON encounters BEGIN
+    INSERT INTO change_log (table_name, encounter_id, patient_id) VALUES ('encounters', NEW.encounter_id, NEW.patient_id);
+END;
+CREATE TRIGGER IF NOT EXISTS cc_encounters_update AFTER UPDATE ON encounters BEGIN
+    INSERT INTO change_log (table_name, encounter_id, patient_id) VALUES ('encounters', OLD.encounter_id, OLD.patient_id);
+    INSERT INTO change_log (table_name, encounter_id, patient_id) VALUES ('encounters', NEW.encounter_id, NEW.patient_id);
+END;
+CREATE TRIGGER IF NOT EXISTS cc_encounters_delete AFTER DELETE ON encounters BEGIN
+    INSERT INTO change_log (table_name, encounter_id, patient_id) VALUES ('encounters', OLD.encounter_id, OLD.patient_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS cc_med_orders_insert AFTER INSERT ON med_orders BEGIN
+    INSERT INTO change_log (table_name, encounter_id) VALUES ('med_orders', NEW.encounter_id);
+END;
+CREATE TRIGGER IF NOT EXISTS cc_med_orders_update AFTER UPDATE ON med_orders BEGIN
+    INSERT INTO change_log (table_name, encounter_id) VALUES ('med_orders', OLD.encounter_id);
+    INSERT INTO change_log (table_name, encounter_id) VALUES ('med_orders', NEW.encounter_id);
+END;
+CREATE TRIGGER IF NOT EXISTS cc_med_orders_delete AFTER DELETE ON med_orders BEGIN
+    INSERT INTO change_log (table_name, encounter_id) VALUES ('med_orders', OLD.encounter_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS cc_safety_events_insert AFTER INSERT ON safety_events BEGIN
+    INSERT INTO change_log (table_name, encounter_id) VALUES ('safety_events', NEW.encounter_id);
+END;
+CREATE TRIGGER IF NOT EXISTS cc_safety_events_update AFTER UPDATE ON safety_events BEGIN
+    INSERT INTO change_log (table_name, encounter_id) VALUES ('safety_events', OLD.encounter_id);
+    INSERT INTO change_log (table_name, encounter_id) VALUES ('safety_events', NEW.encounter_id);
+END;
+CREATE TRIGGER IF NOT EXISTS cc_safety_events_delete AFTER DELETE ON safety_events BEGIN
+    INSERT INTO change_log (table_name, encounter_id) VALUES ('safety_events', OLD.encounter_id);
+END;
@@ -0,0 +1,32 @@
+-- Pipeline run metrics (src/instrumentation.py).
+-- Kept across rebuilds: init_db applies this after schema.sql without dropping anything.
+CREATE TABLE IF NOT EXISTS pipeline_runs (
+    run_id TEXT PRIMARY KEY,
+    label TEXT,
+    started_at TEXT,
+    finished_at TEXT,
+    status TEXT,
+    wall_s REAL,
+    cpu_s REAL,
+    peak_rss_mb REAL,
+    db_bytes_written INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_pipeline_runs_started ON pipeline_runs(started_at);
+
+CREATE TABLE IF NOT EXISTS pipeline_stage_metrics (
+    run_id TEXT,
+    seq INTEGER,
+    stage TEXT,
+    parent_stage TEXT,
+    started_at TEXT,
+    status TEXT,
+    wall_s REAL,
+    cpu_s REAL,
+    peak_rss_mb REAL,
+    rows_in INTEGER,
+    rows_out INTEGER,
+    db_bytes_written INTEGER,
+    profile_path TEXT,
+    PRIMARY KEY (run_id, seq)
+);
+CREATE INDEX IF NOT EXISTS idx_pipeline_stage_metrics_stage ON pipeline_stage_metrics(stage, started_at);
@@ -1,51 +1,283 @@
+-- Dimension tables: integer surrogate keys for the categorical columns, seeded by init_db
+-- from config.DIMENSIONS (key = list position). Raw tables and encounter_facts store the keys.
+DROP TABLE IF EXISTS dim_service_line;
+CREATE TABLE dim_service_line (
+    service_line_key INTEGER PRIMARY KEY,
+    service_line TEXT UNIQUE
+);
+
+DROP TABLE IF EXISTS dim_admission_type;
+CREATE TABLE dim_admission_type (
+    admission_type_key INTEGER PRIMARY KEY,
+    admission_type TEXT UNIQUE
+);
+
+DROP TABLE IF EXISTS dim_med_class;
+CREATE TABLE dim_med_class (
+    med_class_key INTEGER PRIMARY KEY,
+    med_class TEXT UNIQUE
+);
+
+DROP TABLE IF EXISTS dim_event_type;
+CREATE TABLE dim_event_type (
+    event_type_key INTEGER PRIMARY KEY,
+    event_type TEXT UNIQUE
+);
+
+DROP TABLE IF EXISTS dim_severity;
+CREATE TABLE dim_severity (
+    severity_key INTEGER PRIMARY KEY,
+    severity TEXT UNIQUE
+);
+
+DROP TABLE IF EXISTS dim_age_band;
+CREATE TABLE dim_age_band (
+    age_band_key INTEGER PRIMARY KEY,
+    age_band TEXT UNIQUE
+);
+
+DROP TABLE IF EXISTS dim_sex;
+CREATE TABLE dim_sex (
+    sex_key INTEGER PRIMARY KEY,
+    sex TEXT UNIQUE
+);
+
+-- Facilities: DEFAULT_FACILITY then CQM_FACILITIES; each shard's encounters carry its own key
+DROP TABLE IF EXISTS dim_facility;
+CREATE TABLE dim_facility (
+    facility_key INTEGER PRIMARY KEY,
+    facility TEXT UNIQUE
+);
+
 -- Core Tables
+-- IDs are integer surrogate keys (INTEGER PRIMARY KEY aliases the rowid, so no separate key index)
 DROP TABLE IF EXISTS patients;
 CREATE TABLE patients (
-    patient_id TEXT PRIMARY KEY,
-    age_band TEXT,
-    sex TEXT
+    patient_id INTEGER PRIMARY KEY,
+    age_band_key INTEGER REFERENCES dim_age_band(age_band_key),
+    sex_key INTEGER REFERENCES dim_sex(sex_key)
 );
 
 DROP TABLE IF EXISTS encounters;
 CREATE TABLE encounters (
-    encounter_id TEXT PRIMARY KEY,
-    patient_id TEXT,
-    service_line TEXT,
-    admission_type TEXT,
+    encounter_id INTEGER PRIMARY KEY,
+    patient_id INTEGER,
+    service_line_key INTEGER REFERENCES dim_service_line(service_line_key),
+    admission_type_key INTEGER REFERENCES dim_admission_type(admission_type_key),
     admit_date DATE,
     discharge_date DATE,
+    facility_key INTEGER REFERENCES dim_facility(facility_key),
     FOREIGN KEY(patient_id) REFERENCES patients(patient_id)
 );
+CREATE INDEX idx_encounters_patient ON encounters(patient_id, admit_date);
 
 DROP TABLE IF EXISTS med_orders;
 CREATE TABLE med_orders (
-    med_order_id TEXT PRIMARY KEY,
-    encounter_id TEXT,
-    med_class TEXT,
+    med_order_id INTEGER PRIMARY KEY,
+    encounter_id INTEGER,
+    med_class_key INTEGER REFERENCES dim_med_class(med_class_key),
     high_risk_flag INTEGER,
     order_date DATE,
     FOREIGN KEY(encounter_id) REFERENCES encounters(encounter_id)
 );
+CREATE INDEX idx_med_orders_encounter ON med_orders(encounter_id);
 
 DROP TABLE IF EXISTS safety_events;
 CREATE TABLE safety_events (
-    event_id TEXT PRIMARY KEY,
-    encounter_id TEXT,
-    event_type TEXT,
-    severity TEXT,
+    event_id INTEGER PRIMARY KEY,
+    encounter_id INTEGER,
+    event_type_key INTEGER REFERENCES dim_event_type(event_type_key),
+    severity_key INTEGER REFERENCES dim_severity(severity_key),
     report_delay_days INTEGER,
     reported_flag INTEGER,
     event_date DATE,
     FOREIGN KEY(encounter_id) REFERENCES encounters(encounter_id)
 );
+CREATE INDEX idx_safety_events_encounter ON safety_events(encounter_id);
 
 -- Derived Tables (Schema Definitions for Consistency)
 DROP TABLE IF EXISTS encounter_facts;
 CREATE TABLE encounter_facts (
-    encounter_id TEXT PRIMARY KEY,
-    patient_id TEXT,
+    encounter_id INTEGER PRIMARY KEY,
+    patient_id INTEGER,
+    service_line_key INTEGER,
+    admission_type_key INTEGER,
+    facility_key INTEGER,
+    admit_date DATE,
+    discharge_date DATE,
+    length_of_stay_days INTEGER,
+    med_orders_count INTEGER,
+    high_risk_exposure_flag INTEGER,
+    adr_flag INTEGER,
+    med_error_flag INTEGER,
+    severe_event_flag INTEGER,
+    reported_flag_any INTEGER,
+    on_time_flag_any INTEGER,
+    late_reporting_flag_any INTEGER,
+    readmission_30d_flag INTEGER,
+    ed_revisit_7d_flag INTEGER
+);
+CREATE INDEX idx_encounter_facts_patient ON encounter_facts(patient_id, admit_date);
+CREATE INDEX idx_encounter_facts_admit ON encounter_facts(admit_date);
+CREATE INDEX idx_encounter_facts_service ON encounter_facts(service_line_key, admit_date);
+
+-- Change capture: raw-table triggers (db/change_capture.sql) log touched encounters here
+-- so run_pipeline(incremental=True) can refresh only the affected patients and KPI rows.
+DROP TABLE IF EXISTS change_log;
+CREATE TABLE change_log (
+    change_id INTEGER PRIMARY KEY,
+    table_name TEXT,
+    encounter_id INTEGER,
+    patient_id INTEGER
+);
+
+-- Returns after each encounter for every configured window (src/readmissions.py).
+-- Sparse: only windows with at least one return have a row.
+DROP TABLE IF EXISTS encounter_returns;
+CREATE TABLE encounter_returns (
+    encounter_id INTEGER,
+    patient_id INTEGER,
+    return_window TEXT,
+    horizon_days INTEGER,
+    return_count INTEGER,
+    days_to_first_return INTEGER,
+    PRIMARY KEY (encounter_id, return_window)
+);
+CREATE INDEX idx_encounter_returns_patient ON encounter_returns(patient_id);
+CREATE INDEX idx_encounter_returns_window ON encounter_returns(return_window);
+
+-- Build stamp: run_pipeline appends a row when a build (full or incremental) completes.
+-- The dashboard query cache keys results on the latest build_id, so a rebuild invalidates it.
+DROP TABLE IF EXISTS build_info;
+CREATE TABLE build_info (
+    build_id TEXT PRIMARY KEY,
+    built_at TEXT,
+    mode TEXT
+);
+
+-- KPI Tables (outputs of build_kpis, refilled in place by sqlite_io.bulk_load)
+DROP TABLE IF EXISTS kpi_monthly_service;
+CREATE TABLE kpi_monthly_service (
+    month TEXT,
+    service_line TEXT,
+    total_encounters INTEGER,
+    encounters_with_event INTEGER,
+    encounters_reported INTEGER,
+    on_time_encounters INTEGER,
+    compliance_rate REAL,
+    timeliness_rate REAL,
+    adr_count INTEGER,
+    severe_count INTEGER,
+    high_risk_exposure_count INTEGER,
+    adr_per_1000 REAL,
+    severe_per_1000 REAL,
+    high_risk_exposure_rate REAL,
+    PRIMARY KEY (month, service_line)
+);
+CREATE INDEX idx_kpi_monthly_service_service ON kpi_monthly_service(service_line, month);
+
+-- Trailing-window rates and SPC control limits (src/spc.py) per month x service line
+-- ('ALL' = system) x KPI with a control_chart. cum_* are running sums over the series
+-- on a gap-free month calendar; rows depend only on their month and earlier ones.
+DROP TABLE IF EXISTS kpi_spc_monthly;
+CREATE TABLE kpi_spc_monthly (
+    month TEXT,
+    service_line TEXT,
+    kpi TEXT,
+    chart TEXT,          -- 'p' (proportion) or 'u' (count per encounter)
+    numerator INTEGER,
+    denominator INTEGER,
+    cum_numerator INTEGER,
+    cum_denominator INTEGER,
+    rate REAL,
+    rate_3m REAL,        -- trailing windows of ROLLING_WINDOWS
+    rate_12m REAL,
+    center_line REAL,    -- series rate to date
+    lcl REAL,
+    ucl REAL,
+    PRIMARY KEY (month, service_line, kpi)
+);
+CREATE INDEX idx_kpi_spc_monthly_series ON kpi_spc_monthly(service_line, kpi, month);
+
+DROP TABLE IF EXISTS kpi_monthly_overall;
+CREATE TABLE kpi_monthly_overall (
+    month TEXT PRIMARY KEY,
+    total_encounters INTEGER,
+    encounters_with_event INTEGER,
+    encounters_reported INTEGER,
+    on_time_encounters INTEGER,
+    compliance_rate REAL,
+    timeliness_rate REAL,
+    adr_count INTEGER,
+    severe_count INTEGER,
+    high_risk_exposure_count INTEGER,
+    adr_per_1000 REAL,
+    severe_per_1000 REAL,
+    high_risk_exposure_rate REAL
+);
+
+-- Additive KPI cube: numerators/denominators for every grouping set of
+-- month x service_line x admission_type x age_band x event_type x severity.
+-- 'ALL' marks a rolled-up dimension, so any drill-down is one primary-key lookup.
+DROP TABLE IF EXISTS kpi_cube;
+CREATE TABLE kpi_cube (
+    month TEXT,
     service_line TEXT,
     admission_type TEXT,
+    age_band TEXT,
+    event_type TEXT,
+    severity TEXT,
+    total_encounters INTEGER,
+    encounters_with_event INTEGER,
+    encounters_reported INTEGER,
+    on_time_encounters INTEGER,
+    adr_count INTEGER,
+    severe_count INTEGER,
+    high_risk_exposure_count INTEGER,
+    event_count INTEGER,
+    PRIMARY KEY (month, service_line, admission_type, age_band, event_type, severity)
+);
+CREATE INDEX idx_kpi_cube_slice ON kpi_cube(service_line, admission_type, age_band, event_type, severity, month);
+
+DROP TABLE IF EXISTS event_metrics_monthly;
+CREATE TABLE event_metrics_monthly (
+    month TEXT,
+    service_line TEXT,
+    event_type TEXT,
+    event_count INTEGER,
+    PRIMARY KEY (month, service_line, event_type)
+);
+CREATE INDEX idx_event_metrics_monthly_service ON event_metrics_monthly(service_line, event_type);
+
+DROP TABLE IF EXISTS reporting_delay_bins;
+CREATE TABLE reporting_delay_bins (
+    month TEXT,
+    service_line TEXT,
+    delay_bin TEXT,
+    count INTEGER,
+    PRIMARY KEY (month, service_line, delay_bin)
+);
+CREATE INDEX idx_reporting_delay_bins_service ON reporting_delay_bins(service_line);
+
+-- Mergeable sketches (src/sketches.py) of the non-additive measures: distinct patients
+-- (HyperLogLog) and report_delay_days quantiles (KLL); selections merge the rows' sketches
+DROP TABLE IF EXISTS kpi_sketches;
+CREATE TABLE kpi_sketches (
+    month TEXT,
+    service_line TEXT,
+    patients_hll BLOB,
+    delay_kll BLOB,
+    PRIMARY KEY (month, service_line)
+);
+CREATE INDEX idx_kpi_sketches_service ON kpi_sketches(service_line);
+
+DROP TABLE IF EXISTS audit_view;
+CREATE TABLE audit_view (
+    encounter_id INTEGER PRIMARY KEY,
+    patient_id INTEGER,
+    service_line TEXT,
+    admission_type TEXT,
+    facility TEXT,
     admit_date DATE,
     discharge_date DATE,
     length_of_stay_days INTEGER,
@@ -58,8 +290,25 @@ CREATE TABLE encounter_facts (
     on_time_flag_any INTEGER,
     late_reporting_flag_any INTEGER,
     readmission_30d_flag INTEGER,
-    ed_revisit_7d_flag INTEGER
+    ed_revisit_7d_flag INTEGER,
+    month TEXT,
+    has_any_event INTEGER
 );
+CREATE INDEX idx_audit_view_month ON audit_view(month, service_line);
+CREATE INDEX idx_audit_view_service ON audit_view(service_line, admit_date);
+-- Keyset pagination: each sortable column is indexed (the rowid, encounter_id, breaks ties)
+CREATE INDEX idx_audit_view_admit ON audit_view(admit_date);
+CREATE INDEX idx_audit_view_los ON audit_view(length_of_stay_days);
+CREATE INDEX idx_audit_view_meds ON audit_view(med_orders_count);
 
--- KPI Tables will be created dynamically via pandas to_sql to allow for flexible metrics aggregation,
--- but we ensure the core analytic table (encounter_facts) is strictly defined.
+DROP TABLE IF EXISTS data_quality_report;
+CREATE TABLE data_quality_report (
+    "check" TEXT PRIMARY KEY,
+    table_name TEXT,
+    severity TEXT,
+    status TEXT,
+    count INTEGER,       -- violations (scaled up when the table was sampled)
+    rows_checked INTEGER,
+    sample_rate REAL,    -- 1.0 = full pass
+    elapsed_ms REAL      -- time of the table's batched pass (shared by its rules)
+);
@@ -0,0 +1,156 @@
+"""Analytic backends: the engine that runs the pipeline's scans and the dashboard's reads.
+
+SQLite stays the storage of record: every table lives in the DB file and
+every write goes through sqlite_io's single writer connection. A backend
+decides how reads execute:
+
+- "sqlite" (default): pooled read-only sqlite3 connections.
+- "duckdb": an in-process columnar engine that ATTACHes the same SQLite
+  file read-only (DuckDB's sqlite extension) and scans it with vectorized,
+  multi-threaded operators, handing back DataFrames without building a
+  Python object per value. duckdb is optional; selecting it without the
+  package, or before its sqlite extension was installed once with
+  `python -m src.backends --install-duckdb-extension`, fails loudly.
+
+Both expose connect(), read(), execute() and write(); execute and write go
+to SQLite on either backend, so there is still exactly one writer (and the
+DuckDB copy of the SQLite library never writes to the file).
+"""
+import argparse
+import threading
+from contextlib import contextmanager
+import pandas as pd
+from src.config import ANALYTIC_BACKEND
+from src.sqlite_io import get_manager, bulk_load
+
+try:
+    import duckdb
+except ImportError:  # optional dependency
+    duckdb = None
+
+BACKENDS = ["sqlite", "duckdb"]
+DUCKDB_EXTENSION = "sqlite"
+
+def _require_duckdb():
+    if duckdb is None:
+        raise RuntimeError("The duckdb backend needs the duckdb package (pip install duckdb)")
+
+def install_duckdb_extension():
+    """Downloads DuckDB's sqlite extension into the user's extension directory (once per DuckDB version)."""
+    _require_duckdb()
+    conn = duckdb.connect()
+    try:
+        conn.execute(f"INSTALL {DUCKDB_EXTENSION}")
+    finally:
+        conn.close()
+    print(f"Installed the DuckDB {DUCKDB_EXTENSION} extension (duckdb {duckdb.__version__}).")
+
+class SQLiteBackend:
+    """Reads on pooled sqlite3 readers, writes on the single writer."""
+
+    name = "sqlite"
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+
+    @property
+    def manager(self):
+        # Looked up per call: release_db() retires a file's manager after a build
+        return get_manager(self.db_path)
+
+    @contextmanager
+    def connect(self):
+        """A read connection of this backend (borrowed for the block)."""
+        with self.manager.reader() as conn:
+            yield conn
+
+    def read(self, query, params=None):
+        """Runs a read query and returns a DataFrame."""
+        with self.connect() as conn:
+            return pd.read_sql(query, conn, params=params)
+
+    def execute(self, statement, params=None):
+        """Runs a write statement in its own transaction on the SQLite writer."""
+        with self.manager.transaction() as conn:
+            conn.execute(statement, params or ())
+
+    def write(self, frames):
+        """Truncates and refills declared tables from {table: DataFrame} (sqlite_io.bulk_load)."""
+        with self.manager.writer() as conn:
+            return bulk_load(conn, frames)
+
+class DuckDBBackend(SQLiteBackend):
+    """Reads through DuckDB over the SQLite file; writes as SQLiteBackend.
+
+    Each thread gets its own DuckDB connection with the file attached as
+    the default catalog, so unqualified table names and positional `?`
+    params work as they do in SQLite. A connection is re-attached when the
+    file is swapped for a new build (its inode changes).
+    """
+
+    name = "duckdb"
+
+    def __init__(self, db_path):
+        _require_duckdb()
+        super().__init__(db_path)
+        self._local = threading.local()
+
+    def _open(self):
+        # Only LOAD here: opening a connection must not reach the network (see install_duckdb_extension)
+        conn = duckdb.connect(config={"autoinstall_known_extensions": False})
+        try:
+            conn.execute(f"LOAD {DUCKDB_EXTENSION}")
+        except duckdb.IOException as exc:
+            conn.close()
+            raise RuntimeError(
+                f"DuckDB's {DUCKDB_EXTENSION} extension is not installed; "
+                "run `python -m src.backends --install-duckdb-extension` once (needs network)"
+            ) from exc
+        path = str(self.db_path).replace("'", "''")
+        conn.execute(f"ATTACH '{path}' AS clinical (TYPE sqlite, READ_ONLY)")
+        conn.execute("USE clinical")
+        return conn
+
+    @contextmanager
+    def connect(self):
+        inode = self.db_path.stat().st_ino
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.inode != inode:
+            if conn is not None:
+                conn.close()
+            self._local.conn, self._local.inode = self._open(), inode
+        yield self._local.conn
+
+    def read(self, query, params=None):
+        with self.connect() as conn:
+            cursor = conn.execute(query, list(params or ()))
+            df, columns = cursor.df(), cursor.description
+        # SUM over integers is HUGEINT in DuckDB, which arrives as float64; SQLite returns ints
+        for name, type_code, *_ in columns:
+            if str(type_code) == "HUGEINT" and df[name].notna().all():
+                df[name] = df[name].astype("int64")
+        return df
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+def get_backend(name=None):
+    """Process-wide backend `name` (default ANALYTIC_BACKEND) for the active DB file (see sqlite_io.use_db)."""
+    name = name or ANALYTIC_BACKEND
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend: {name!r} (expected one of {BACKENDS})")
+    db_path = get_manager().db_path
+    with _backends_lock:
+        if (name, db_path) not in _backends:
+            _backends[(name, db_path)] = (DuckDBBackend if name == "duckdb" else SQLiteBackend)(db_path)
+        return _backends[(name, db_path)]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Analytic backend setup.")
+    parser.add_argument("--install-duckdb-extension", action="store_true",
+                        help="Install DuckDB's sqlite extension (one-time, needs network)")
+    args = parser.parse_args()
+    if args.install_duckdb_extension:
+        install_duckdb_extension()
+    else:
+        parser.print_help()
@@ -0,0 +1,432 @@
+"""Reproducible benchmark of the pipeline stages and dashboard query sets.
+
+Each scale runs in a fresh subprocess against its own throwaway DB (via
+CQM_DB_PATH), so the live DB is untouched and peak RSS is per scale. Every
+stage records wall time, CPU time, peak RSS and rows, and each scale the size
+of the built DB; results are written as JSON and compared against a stored
+baseline, exiting non-zero on regression. A 1k baseline is committed in
+benchmarks/baseline.json; --compare also fails when the baseline is missing
+or does not cover a scale (or startup page) that was run.
+
+    python -m src.benchmark --scales 1k --compare         # run + compare
+    python -m src.benchmark --scales 1k,100k --save-baseline
+    python -m src.benchmark --scales "" --startup         # dashboard cold start only
+    python -m src.benchmark --scales 100k --backends sqlite,duckdb
+
+With --startup each dashboard page is also rendered (Streamlit AppTest) in
+a fresh process, so imports are cold, and its time to first render is
+checked against STARTUP_BUDGET_SECONDS as well as the baseline.
+
+With --backends each scale is also run on the other analytic backends
+(src/backends.py), recorded as "<scale>/<backend>" next to the SQLite run.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from src.config import (
+    BASE_DIR, TARGET_N_PATIENTS, TARGET_N_ENCOUNTERS, RANDOM_SEED, GENERATION_CHUNK_PATIENTS, FACTS_ENGINE,
+    BENCHMARK_SCALES, BENCHMARK_DIR, BENCHMARK_TOLERANCE, BENCHMARK_MIN_DELTA_SECONDS, BENCHMARK_MIN_DELTA_MB,
+    STARTUP_BUDGET_SECONDS, STARTUP_SCALE, ANALYTIC_BACKEND,
+)
+
+# --- Measurement ---
+
+@contextmanager
+def measure(stages, name):
+    """Times the block into stages[name]; repeated names accumulate (e.g. per chunk).
+
+    Yields the stage record so the block can add a 'rows' count.
+    """
+    # Imported here: the --startup-child process must not load pandas before the page does
+    from src.instrumentation import PeakRSS
+
+    record = stages.setdefault(name, {"wall_s": 0.0, "cpu_s": 0.0, "peak_rss_mb": 0.0, "rows": 0})
+    wall, cpu = time.perf_counter(), time.process_time()
+    with PeakRSS() as rss:
+        yield record
+    record["wall_s"] += time.perf_counter() - wall
+    record["cpu_s"] += time.process_time() - cpu
+    record["peak_rss_mb"] = max(record["peak_rss_mb"], rss.peak / 2**20)
+
+# --- Stages (run inside the per-scale subprocess) ---
+
+def _page_query_sets():
+    """Each dashboard page's default-selection query set, as the page issues it (concurrently)."""
+    from src import dashboard_queries as dq
+    from src.sqlite_io import run_concurrently
+
+    def rows(data):
+        return sum(len(df) for df in data.values())
+
+    def executive_overview():
+        month = dq.list_months()[0]
+        services = dq.list_service_lines()
+        for dim in dq.DRILL_DIMENSIONS:
+            dq.list_cube_values(dim)
+        data, _ = run_concurrently({
+            "kpi_totals": lambda: dq.kpi_totals(month, services).to_frame(),
+            "kpi_trend": lambda: dq.kpi_trend(services),
+            "kpi_snapshot": lambda: dq.kpi_snapshot(month, services),
+            "sketch_summary": lambda: [dq.sketch_summary(services, [month])],
+            "kpi_control_chart": lambda: dq.kpi_control_chart(services),
+        })
+        return rows(data)
+
+    def medication_safety():
+        services = dq.list_service_lines("event_metrics_monthly")
+        types = dq.list_event_types()
+        data, _ = run_concurrently({
+            "event_counts_by_type": lambda: dq.event_counts_by_type(services, types),
+            "high_risk_trend": lambda: dq.high_risk_trend(services),
+            "event_heatmap": lambda: dq.event_heatmap(services, types),
+            "event_metrics": lambda: dq.event_metrics(services, types),
+        })
+        return rows(data)
+
+    def compliance_data_quality():
+        data, _ = run_concurrently({
+            "bin_services": lambda: dq.list_service_lines("reporting_delay_bins"),
+            "audit_date_range": dq.audit_date_range,
+            "data_quality_report": dq.data_quality_report,
+        })
+        audit, _ = run_concurrently({
+            "delay_bin_totals": lambda: dq.delay_bin_totals(data["bin_services"]),
+            "sketch_summary": lambda: [dq.sketch_summary(data["bin_services"])],
+            "audit_count": dq.audit_count,
+            "audit_page": lambda: dq.audit_page()[0],
+        })
+        return len(data["data_quality_report"]) + len(audit["delay_bin_totals"]) + len(audit["audit_page"])
+
+    return {
+        "executive_overview": executive_overview,
+        "medication_safety": medication_safety,
+        "compliance_data_quality": compliance_data_quality,
+    }
+
+def run_scale(n_encounters, engine=None, workers=1, chunk_size=GENERATION_CHUNK_PATIENTS, seed=RANDOM_SEED):
+    """Runs every stage once at one scale against CQM_DB_PATH.
+
+    Returns {"stages": {stage: metrics}, "db_size_mb": size after build_kpis}.
+    """
+    from src.sqlite_io import init_db, run_query, get_manager
+    from src.query_cache import get_query_cache
+    from src import generate_data as gd
+    from src.build_facts_kpis import build_encounter_facts, build_kpis
+
+    n_patients = max(1, round(n_encounters * TARGET_N_PATIENTS / TARGET_N_ENCOUNTERS))
+    stages = {}
+
+    with measure(stages, "init_db"):
+        init_db()
+
+    # Generators alone, in memory, chunk by chunk (as iter_generation_chunks calls them)
+    for idx in range(-(-n_patients // chunk_size)):
+        (p0, p1), (e0, e1) = gd.chunk_bounds(n_patients, n_encounters, chunk_size, idx)
+        rng = gd.chunk_rng(seed, idx)
+        with measure(stages, "generate_patients") as m:
+            patients_df = gd.generate_patients(p1 - p0, rng, start=p0)
+            m["rows"] += len(patients_df)
+        with measure(stages, "generate_encounters") as m:
+            encounters_df = gd.generate_encounters(patients_df, e1 - e0, rng, start=e0)
+            m["rows"] += len(encounters_df)
+        with measure(stages, "generate_med_orders") as m:
+            med_orders_df = gd.generate_med_orders(encounters_df, rng)
+            m["rows"] += len(med_orders_df)
+        with measure(stages, "generate_safety_events") as m:
+            m["rows"] += len(gd.generate_safety_events(encounters_df, rng))
+        del patients_df, encounters_df, med_orders_df
+
+    # End to end: generation plus the SQLite load
+    with measure(stages, "run_data_generation") as m:
+        m["rows"] = sum(gd.run_data_generation(n_patients, n_encounters, seed, chunk_size, workers=workers).values())
+    with measure(stages, "build_encounter_facts") as m:
+        build_encounter_facts(engine)
+        m["rows"] = int(run_query("SELECT COUNT(*) AS n FROM encounter_facts")["n"].iloc[0])
+    with measure(stages, "build_kpis") as m:
+        build_kpis()
+        m["rows"] = int(run_query("SELECT COUNT(*) AS n FROM kpi_cube")["n"].iloc[0])
+    with get_manager().writer() as conn:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    db_size_mb = get_manager().db_path.stat().st_size / 2**20
+
+    # Cold page loads: the query cache is cleared before each page
+    for page, load in _page_query_sets().items():
+        get_query_cache().clear()
+        with measure(stages, f"page_{page}") as m:
+            m["rows"] = load()
+    return {"stages": stages, "db_size_mb": db_size_mb}
+
+# --- Dashboard cold start ---
+
+STARTUP_PAGES = ["app/app.py", *sorted(p.relative_to(BASE_DIR).as_posix() for p in (BASE_DIR / "app" / "pages").glob("*.py"))]
+
+def run_startup_page(page):
+    """First render of one page in this (fresh) process: Streamlit import, then the page run.
+
+    Nothing but the stdlib and src.config is loaded before, so the page pays
+    for every import it triggers (pandas, plotly, src modules).
+    """
+    wall, cpu = time.perf_counter(), time.process_time()
+    from streamlit.testing.v1 import AppTest
+    imported = time.perf_counter()
+    at = AppTest.from_file(str(BASE_DIR / page), default_timeout=600).run()
+    rendered = time.perf_counter()
+    errors = [e.value for e in at.exception] + [e.body for e in at.error]
+    if errors:
+        raise RuntimeError(f"{page} failed to render: {errors[0]}")
+    scale = 1 if sys.platform == "darwin" else 1024
+    return {"import_s": imported - wall, "render_s": rendered - imported, "cpu_s": time.process_time() - cpu,
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2**20}
+
+def _run_startup_subprocess(page, env):
+    """Launches a fresh interpreter for one page; wall_s spans the whole process (interpreter start included)."""
+    with tempfile.TemporaryDirectory(prefix="cqm-startup-") as tmp:
+        out = Path(tmp) / "startup.json"
+        wall = time.perf_counter()
+        proc = subprocess.run([sys.executable, "-m", "src.benchmark", "--startup-child", page, "--out", str(out)],
+                              cwd=BASE_DIR, env=env, text=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        wall = time.perf_counter() - wall
+        if proc.returncode != 0:
+            raise RuntimeError(f"Startup benchmark of {page} failed:\n{proc.stdout}")
+        with open(out) as f:
+            return {"wall_s": wall, **json.load(f), "rows": 0}
+
+def run_startup_benchmark(n_encounters, repeat=1, verbose=False):
+    """Time to first render of every page, each in a fresh process, against a throwaway DB."""
+    n_patients = max(1, round(n_encounters * TARGET_N_PATIENTS / TARGET_N_ENCOUNTERS))
+    with tempfile.TemporaryDirectory(prefix="cqm-startup-") as tmp:
+        env = dict(os.environ, CQM_DB_PATH=str(Path(tmp) / "startup.db"))
+        for cmd in (["src.generate_data", "--patients", str(n_patients), "--encounters", str(n_encounters)],
+                    ["src.build_facts_kpis"]):
+            subprocess.run([sys.executable, "-m", *cmd], cwd=BASE_DIR, env=env, check=True,
+                           stdout=None if verbose else subprocess.DEVNULL)
+        pages = {}
+        for page in STARTUP_PAGES:
+            print(f"Cold-starting {page}...")
+            runs = [_run_startup_subprocess(page, env) for _ in range(repeat)]
+            pages[page] = min(runs, key=lambda m: m["wall_s"])
+    return {"n_encounters": n_encounters, "budget_s": STARTUP_BUDGET_SECONDS, "pages": pages}
+
+def check_startup_budget(startup, budget=STARTUP_BUDGET_SECONDS):
+    """Pages whose cold start exceeds the budget (as messages)."""
+    return [f"startup {page}: {m['wall_s']:.2f}s > budget {budget:.2f}s"
+            for page, m in startup["pages"].items() if m["wall_s"] > budget]
+
+# --- Driver ---
+
+def parse_scales(text):
+    """'1k,100k' or raw encounter counts ('250000') -> {name: n_encounters}."""
+    scales = {}
+    for name in filter(None, (s.strip() for s in text.split(","))):
+        scales[name] = BENCHMARK_SCALES[name] if name in BENCHMARK_SCALES else int(name)
+    return scales
+
+def scale_key(name, backend):
+    """Results key of one scale on one backend (SQLite runs keep the bare scale name)."""
+    return name if backend == "sqlite" else f"{name}/{backend}"
+
+def _run_scale_subprocess(n_encounters, engine, workers, chunk_size, verbose, backend=ANALYTIC_BACKEND):
+    with tempfile.TemporaryDirectory(prefix="cqm-bench-") as tmp:
+        out = Path(tmp) / "stages.json"
+        cmd = [sys.executable, "-m", "src.benchmark", "--child", str(n_encounters), "--out", str(out),
+               "--workers", str(workers), "--chunk-size", str(chunk_size)]
+        if engine:
+            cmd += ["--engine", engine]
+        env = dict(os.environ, CQM_DB_PATH=str(Path(tmp) / "bench.db"), CQM_BACKEND=backend)
+        proc = subprocess.run(cmd, cwd=BASE_DIR, env=env, text=True,
+                              stdout=None if verbose else subprocess.PIPE, stderr=subprocess.STDOUT)
+        if proc.returncode != 0:
+            raise RuntimeError(f"Benchmark at {n_encounters:,} encounters ({backend}) failed:\n{proc.stdout or ''}")
+        with open(out) as f:
+            return json.load(f)
+
+def _best_of(runs):
+    """Per stage, the fastest of several runs (the least noisy estimate)."""
+    return {stage: min((run[stage] for run in runs), key=lambda m: m["wall_s"]) for stage in runs[0]}
+
+def run_benchmarks(scales, engine=None, workers=1, chunk_size=GENERATION_CHUNK_PATIENTS, repeat=1, verbose=False,
+                   backends=None):
+    backends = backends or [ANALYTIC_BACKEND]
+    results = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "engine": engine or FACTS_ENGINE,
+        "workers": workers,
+        "backends": backends,
+        "repeat": repeat,
+        "scales": {},
+    }
+    for name, n_encounters in scales.items():
+        for backend in backends:
+            print(f"Benchmarking {name} ({n_encounters:,} encounters, {backend} backend)...")
+            runs = [_run_scale_subprocess(n_encounters, engine, workers, chunk_size, verbose, backend)
+                    for _ in range(repeat)]
+            results["scales"][scale_key(name, backend)] = {
+                "n_encounters": n_encounters,
+                "backend": backend,
+                "db_size_mb": runs[0]["db_size_mb"],
+                "stages": _best_of([run["stages"] for run in runs]),
+            }
+    return results
+
+def compare_to_baseline(results, baseline, tolerance=BENCHMARK_TOLERANCE):
+    """Regressions (as messages) of DB size, and of wall time and peak RSS for stages present in both runs."""
+    regressions = []
+    for scale, run in results["scales"].items():
+        base_run = baseline.get("scales", {}).get(scale, {})
+        size, base_size = run.get("db_size_mb"), base_run.get("db_size_mb")
+        if size is not None and base_size is not None:
+            if size > base_size * (1 + tolerance) and size - base_size > BENCHMARK_MIN_DELTA_MB:
+                regressions.append(f"{scale} db_size_mb: {base_size:.2f}MB -> {size:.2f}MB (+{size / base_size - 1:.0%})")
+        base_stages = base_run.get("stages", {})
+        for stage, m in run["stages"].items():
+            if stage not in base_stages:
+                continue
+            b = base_stages[stage]
+            for key, floor, unit in [("wall_s", BENCHMARK_MIN_DELTA_SECONDS, "s"),
+                                     ("peak_rss_mb", BENCHMARK_MIN_DELTA_MB, "MB")]:
+                if m[key] > b[key] * (1 + tolerance) and m[key] - b[key] > floor:
+                    regressions.append(f"{scale} {stage}: {key} {b[key]:.2f}{unit} -> {m[key]:.2f}{unit} "
+                                       f"(+{(m[key] / b[key] - 1) if b[key] else float('inf'):.0%})")
+    base_pages = baseline.get("startup", {}).get("pages", {})
+    for page, m in results.get("startup", {}).get("pages", {}).items():
+        b = base_pages.get(page)
+        if b and m["wall_s"] > b["wall_s"] * (1 + tolerance) and m["wall_s"] - b["wall_s"] > BENCHMARK_MIN_DELTA_SECONDS:
+            regressions.append(f"startup {page}: wall_s {b['wall_s']:.2f}s -> {m['wall_s']:.2f}s "
+                               f"(+{m['wall_s'] / b['wall_s'] - 1:.0%})")
+    return regressions
+
+def missing_from_baseline(results, baseline):
+    """Scales and startup pages of this run that the baseline has no measurements for."""
+    missing = [scale for scale in results["scales"] if scale not in baseline.get("scales", {})]
+    base_pages = baseline.get("startup", {}).get("pages", {})
+    missing += [f"startup {page}" for page in results.get("startup", {}).get("pages", {}) if page not in base_pages]
+    return missing
+
+def print_backend_comparison(results):
+    """Wall time of each stage on every other backend relative to the same scale on SQLite."""
+    for scale, run in results["scales"].items():
+        backend = run.get("backend", "sqlite")
+        sqlite_run = results["scales"].get(scale.split("/")[0])
+        if backend == "sqlite" or sqlite_run is None:
+            continue
+        print(f"\n== {scale.split('/')[0]}: {backend} vs sqlite ==")
+        print(f"{'stage':<32}{'sqlite s':>10}{backend + ' s':>10}{'speedup':>10}")
+        for stage, m in run["stages"].items():
+            base = sqlite_run["stages"].get(stage)
+            # Generation and init_db write through SQLite on every backend
+            if base is None or stage.startswith(("generate_", "run_data_generation", "init_db")):
+                continue
+            speedup = f"{base['wall_s'] / m['wall_s']:.2f}x" if m["wall_s"] else ""
+            print(f"{stage:<32}{base['wall_s']:>10.3f}{m['wall_s']:>10.3f}{speedup:>10}")
+
+def print_report(results, baseline=None):
+    for scale, run in results["scales"].items():
+        base_stages = (baseline or {}).get("scales", {}).get(scale, {}).get("stages", {})
+        base_size = (baseline or {}).get("scales", {}).get(scale, {}).get("db_size_mb")
+        print(f"\n== {scale}: {run['n_encounters']:,} encounters, {run.get('backend', 'sqlite')} backend, "
+              f"DB {run['db_size_mb']:,.1f} MB"
+              + (f" (baseline {base_size:,.1f} MB)" if base_size is not None else "") + " ==")
+        print(f"{'stage':<32}{'wall s':>10}{'cpu s':>10}{'peak MB':>10}{'rows':>14}{'vs base':>10}")
+        for stage, m in run["stages"].items():
+            base = base_stages.get(stage)
+            delta = f"{m['wall_s'] / base['wall_s'] - 1:+.0%}" if base and base["wall_s"] else ""
+            print(f"{stage:<32}{m['wall_s']:>10.3f}{m['cpu_s']:>10.3f}{m['peak_rss_mb']:>10.0f}{m['rows']:>14,}{delta:>10}")
+    print_backend_comparison(results)
+    if "startup" in results:
+        startup = results["startup"]
+        base_pages = (baseline or {}).get("startup", {}).get("pages", {})
+        print(f"\n== Dashboard cold start ({startup['n_encounters']:,} encounters, budget {startup['budget_s']:.1f}s) ==")
+        print(f"{'page':<44}{'wall s':>10}{'import s':>10}{'render s':>10}{'peak MB':>10}{'vs base':>10}")
+        for page, m in startup["pages"].items():
+            base = base_pages.get(page)
+            delta = f"{m['wall_s'] / base['wall_s'] - 1:+.0%}" if base else ""
+            print(f"{page:<44}{m['wall_s']:>10.3f}{m['import_s']:>10.3f}{m['render_s']:>10.3f}"
+                  f"{m['peak_rss_mb']:>10.0f}{delta:>10}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark pipeline stages and dashboard queries across scales.")
+    parser.add_argument("--scales", default="1k,100k",
+                        help=f"Comma-separated names ({', '.join(BENCHMARK_SCALES)}) or encounter counts")
+    parser.add_argument("--engine", choices=["pandas", "sql"], default=None)
+    parser.add_argument("--backends", default=ANALYTIC_BACKEND,
+                        help="Comma-separated analytic backends to run each scale on (sqlite, duckdb)")
+    parser.add_argument("--workers", type=int, default=1, help="Generation worker processes")
+    parser.add_argument("--chunk-size", type=int, default=GENERATION_CHUNK_PATIENTS)
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per scale; the fastest run of each stage is kept")
+    parser.add_argument("--out", type=Path, default=BENCHMARK_DIR / "results.json")
+    parser.add_argument("--baseline", type=Path, default=BENCHMARK_DIR / "baseline.json")
+    parser.add_argument("--save-baseline", action="store_true", help="Store this run as the baseline")
+    parser.add_argument("--compare", action="store_true",
+                        help="Fail unless the baseline exists and covers every scale and page run")
+    parser.add_argument("--tolerance", type=float, default=BENCHMARK_TOLERANCE)
+    parser.add_argument("--verbose", action="store_true", help="Show pipeline output")
+    parser.add_argument("--startup", action="store_true",
+                        help=f"Also time each page's cold start (budget {STARTUP_BUDGET_SECONDS:.1f}s, CQM_STARTUP_BUDGET)")
+    parser.add_argument("--startup-scale", default=STARTUP_SCALE, help="Encounters in the DB behind the pages")
+    parser.add_argument("--child", type=int, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--startup-child", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        with open(args.out, "w") as f:
+            json.dump(run_scale(args.child, args.engine, args.workers, args.chunk_size), f)
+        raise SystemExit(0)
+    if args.startup_child is not None:
+        with open(args.out, "w") as f:
+            json.dump(run_startup_page(args.startup_child), f)
+        raise SystemExit(0)
+
+    results = run_benchmarks(parse_scales(args.scales), args.engine, args.workers, args.chunk_size,
+                             args.repeat, args.verbose, args.backends.split(","))
+    if args.startup:
+        (startup_encounters,) = parse_scales(args.startup_scale).values()
+        results["startup"] = run_startup_benchmark(startup_encounters, args.repeat, args.verbose)
+    args.out.parent.mkdir(parents=True, exist_ok=True)
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+
+    baseline = None
+    if args.baseline.exists() and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+    print(f"\nResults written to {args.out}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+    over_budget = check_startup_budget(results["startup"]) if args.startup else []
+    if over_budget:
+        print("\nOVER STARTUP BUDGET:")
+        for line in over_budget:
+            print(f"  {line}")
+    if args.compare and not args.save_baseline:
+        missing = [str(args.baseline)] if baseline is None else missing_from_baseline(results, baseline)
+        if missing:
+            print("\nNO BASELINE FOR:")
+            for line in missing:
+                print(f"  {line}")
+            print("Record one with --save-baseline.")
+            raise SystemExit(1)
+    if baseline is not None:
+        regressions = compare_to_baseline(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\nREGRESSIONS (tolerance {args.tolerance:.0%}):")
+            for line in regressions:
+                print(f"  {line}")
+            raise SystemExit(1)
+        print("No regressions against baseline.")
+    if over_budget:
+        raise SystemExit(1)
@@ -1,16 +1,98 @@
+import argparse
+import itertools
+import uuid
 import pandas as pd
 import numpy as np
-from src.sqlite_io import run_query, DB_PATH
-import sqlite3
+from src.sqlite_io import (
+    get_manager, insert_dataframe, enable_change_capture, drop_secondary_indexes, restore_indexes
+)
+from src.backends import get_backend
+from src.data_quality import run_data_quality_checks
+from src.dimensions import decode, encode, dim_key
+from src.instrumentation import instrumented, record_rows, stage
+from src.kpis import KPI_COUNT_COLUMNS, add_measures, aggregate_kpis, derive_kpi_rates
+from src.readmissions import build_encounter_returns, refresh_encounter_returns
+from src.sketches import compute_sketch_rows
+from src.spc import compute_kpi_spc, first_changed_month, months_before
+from src.config import (
+    FACTS_ENGINE, FACILITIES, SNAPSHOT_FORMAT, CUBE_ENCOUNTER_DIMENSIONS, CUBE_EVENT_DIMENSIONS, CUBE_ALL, ROLLING_WINDOWS,
+    KEYED_KPI_TABLES, KPI_TABLES,
+)
 
-def build_encounter_facts():
-    print("Building encounter_facts...")
-    conn = sqlite3.connect(DB_PATH)
-    
-    # Load raw tables
-    encounters = pd.read_sql("SELECT * FROM encounters", conn)
-    med_orders = pd.read_sql("SELECT * FROM med_orders", conn)
-    safety_events = pd.read_sql("SELECT * FROM safety_events", conn)
+ENCOUNTER_FACTS_COLUMNS = [
+    "encounter_id", "patient_id", "service_line_key", "admission_type_key", "facility_key", "admit_date", "discharge_date",
+    "length_of_stay_days", "med_orders_count", "high_risk_exposure_flag",
+    "adr_flag", "med_error_flag", "severe_event_flag",
+    "reported_flag_any", "on_time_flag_any", "late_reporting_flag_any",
+    "readmission_30d_flag", "ed_revisit_7d_flag",
+]
+
+# Same logic as compute_encounter_facts, evaluated entirely inside SQLite.
+# Readmissions use LEAD() over each patient's encounters (ties broken by encounter_id).
+# Categorical tests compare dimension keys; keys missing from their dimension become NULL.
+ENCOUNTER_FACTS_SQL = """
+WITH meds AS (
+    SELECT encounter_id,
+           COUNT(*) AS med_orders_count,
+           MAX(high_risk_flag) AS high_risk_exposure_flag
+    FROM med_orders
+    {child_filter}
+    GROUP BY encounter_id
+),
+events AS (
+    SELECT encounter_id,
+           MAX(event_type_key = {adr}) AS adr_flag,
+           MAX(event_type_key = {med_error}) AS med_error_flag,
+           MAX(severity_key = {severe}) AS severe_event_flag,
+           MAX(reported_flag = 1) AS reported_flag_any,
+           MAX(reported_flag = 1 AND report_delay_days <= 7) AS on_time_flag_any,
+           MAX(reported_flag = 1 AND report_delay_days > 7) AS late_reporting_flag_any
+    FROM safety_events
+    {child_filter}
+    GROUP BY encounter_id
+),
+seq AS (
+    SELECT e.*,
+           julianday(LEAD(admit_date) OVER w) - julianday(discharge_date) AS days_to_next,
+           LEAD(admission_type_key) OVER w AS next_admission_type_key
+    FROM encounters e
+    {encounter_filter}
+    WINDOW w AS (PARTITION BY patient_id ORDER BY admit_date, encounter_id)
+)
+INSERT INTO {target} ({columns})
+SELECT s.encounter_id, s.patient_id, sl.service_line_key, at.admission_type_key, fa.facility_key,
+       s.admit_date, s.discharge_date,
+       CAST(julianday(s.discharge_date) - julianday(s.admit_date) AS INTEGER),
+       COALESCE(m.med_orders_count, 0),
+       COALESCE(m.high_risk_exposure_flag, 0),
+       COALESCE(ev.adr_flag, 0),
+       COALESCE(ev.med_error_flag, 0),
+       COALESCE(ev.severe_event_flag, 0),
+       COALESCE(ev.reported_flag_any, 0),
+       COALESCE(ev.on_time_flag_any, 0),
+       COALESCE(ev.late_reporting_flag_any, 0),
+       COALESCE(s.days_to_next BETWEEN 0 AND 30, 0),
+       COALESCE(s.days_to_next BETWEEN 0 AND 7 AND s.next_admission_type_key = {ed}, 0)
+FROM seq s
+LEFT JOIN dim_service_line sl ON sl.service_line_key = s.service_line_key
+LEFT JOIN dim_admission_type at ON at.admission_type_key = s.admission_type_key
+LEFT JOIN dim_facility fa ON fa.facility_key = s.facility_key
+LEFT JOIN meds m ON m.encounter_id = s.encounter_id
+LEFT JOIN events ev ON ev.encounter_id = s.encounter_id
+"""
+
+def compute_encounter_facts(read=None):
+    """Builds the encounter_facts frame in pandas from the raw tables.
+
+    `read(query)` returns a DataFrame (default: the analytic backend's read).
+    """
+    read = read or get_backend().read
+    # Load raw tables (only the columns used; dimension keys decoded to Categoricals)
+    encounters = decode(read("SELECT * FROM encounters"))
+    med_orders = read("SELECT encounter_id, high_risk_flag FROM med_orders")
+    safety_events = decode(read(
+        "SELECT encounter_id, event_type_key, severity_key, reported_flag, report_delay_days FROM safety_events"
+    ))
     
     # Pre-process Dates
     encounters['admit_date'] = pd.to_datetime(encounters['admit_date'])
@@ -53,6 +135,7 @@ def build_encounter_facts():
     # Merge Meds
     df = df.merge(med_counts, on='encounter_id', how='left').fillna({'med_orders_count': 0})
     df = df.merge(high_risk, on='encounter_id', how='left').fillna({'high_risk_exposure_flag': 0})
+    df = df.astype({'med_orders_count': int, 'high_risk_exposure_flag': int})
     
     # Flags from Events
     df['adr_flag'] = df['encounter_id'].isin(adr_ids).astype(int)
@@ -66,7 +149,8 @@ def build_encounter_facts():
     df['length_of_stay_days'] = (df['discharge_date'] - df['admit_date']).dt.days
     
     # 3. Readmissions & ED Revisit (Window Functions)
-    df.sort_values(by=['patient_id', 'admit_date'], inplace=True)
+    # encounter_id breaks same-day ties so the result is deterministic (and matches the SQL engine)
+    df.sort_values(by=['patient_id', 'admit_date', 'encounter_id'], inplace=True)
     
     # Next admission
     df['next_admit_date'] = df.groupby('patient_id')['admit_date'].shift(-1)
@@ -89,23 +173,61 @@ def build_encounter_facts():
     # Clean up temp cols
     df.drop(columns=['next_admit_date', 'next_admission_type', 'days_to_next'], inplace=True)
     
-    # Convert dates back to string for SQLite or keep as is (pandas writes timestamp, read back as str usually)
-    # Ensuring standard basic types
-    df['admit_date'] = df['admit_date'].dt.date
-    df['discharge_date'] = df['discharge_date'].dt.date
-    
-    # Write to DB
-    df.to_sql("encounter_facts", conn, if_exists="replace", index=False)
-    print(f"encounter_facts built: {len(df)} rows.")
-    conn.close()
+    # Convert dates back to the 'YYYY-MM-DD' strings SQLite stores, categories back to keys
+    df['admit_date'] = df['admit_date'].dt.strftime('%Y-%m-%d')
+    df['discharge_date'] = df['discharge_date'].dt.strftime('%Y-%m-%d')
+    return encode(df)[ENCOUNTER_FACTS_COLUMNS]
 
-def build_kpis():
-    print("Building KPI tables...")
-    conn = sqlite3.connect(DB_PATH)
-    facts = pd.read_sql("SELECT * FROM encounter_facts", conn)
-    med_orders = pd.read_sql("SELECT * FROM med_orders", conn) # for denom
-    safety_events = pd.read_sql("SELECT * FROM safety_events", conn)
-    
+def insert_encounter_facts_sql(conn, target="encounter_facts", patients_table=None):
+    """Runs the SQL engine as a single INSERT ... SELECT into `target` (no commit).
+
+    With `patients_table` (a table with a patient_id column) only those
+    patients' encounters are computed; readmission flags stay correct because
+    a patient's encounters are always recomputed together.
+    """
+    encounter_filter = child_filter = ""
+    if patients_table:
+        encounter_filter = f"WHERE e.patient_id IN (SELECT patient_id FROM {patients_table})"
+        child_filter = (f"WHERE encounter_id IN (SELECT encounter_id FROM encounters "
+                        f"WHERE patient_id IN (SELECT patient_id FROM {patients_table}))")
+    conn.execute(ENCOUNTER_FACTS_SQL.format(
+        target=target, columns=", ".join(ENCOUNTER_FACTS_COLUMNS),
+        encounter_filter=encounter_filter, child_filter=child_filter,
+        adr=dim_key("event_type", "ADR"), med_error=dim_key("event_type", "Med_Error"),
+        severe=dim_key("severity", "Severe"), ed=dim_key("admission_type", "ED"),
+    ))
+
+@instrumented
+def build_encounter_facts(engine=None):
+    engine = engine or FACTS_ENGINE
+    print(f"Building encounter_facts ({engine} engine)...")
+    if engine == "sql":
+        with get_manager().writer() as conn:
+            conn.execute("BEGIN")
+            with conn:
+                ddl = drop_secondary_indexes(conn, ["encounter_facts"])
+                conn.execute("DELETE FROM encounter_facts")
+                insert_encounter_facts_sql(conn)
+                restore_indexes(conn, ddl)
+            n_rows = conn.execute("SELECT COUNT(*) FROM encounter_facts").fetchone()[0]
+    elif engine == "pandas":
+        # Raw tables are scanned on the analytic backend; the frame is written through SQLite
+        backend = get_backend()
+        n_rows = backend.write({"encounter_facts": compute_encounter_facts(backend.read)})["encounter_facts"]
+    else:
+        raise ValueError(f"Unknown facts engine: {engine!r} (expected 'pandas' or 'sql')")
+    record_rows(rows_out=n_rows)
+    print(f"encounter_facts built: {n_rows} rows.")
+
+def compute_kpi_tables(facts, safety_events):
+    """Computes the KPI tables keyed by (month, service_line) (KEYED_KPI_TABLES).
+
+    Every output row depends only on the facts and events of its own
+    (month, service_line), so this runs unchanged on a full load or on the
+    slice touched by an incremental refresh. Both frames are decoded (see
+    src/dimensions.py), so groupbys run on Categorical codes. Adds 'month',
+    'has_any_event' and the measure columns (src/kpis.py) to `facts` in place.
+    """
     # Ensure Month column
     facts['month'] = pd.to_datetime(facts['admit_date']).dt.strftime('%Y-%m')
     
@@ -124,43 +246,14 @@ def build_kpis():
     # BETTER: Aggregation from facts is easier. Let's assume 'reported_flag_any' implies event.
     # But for denominator of compliance, we need all events.
     
-    # Recover 'has_event' from join with safety_events distinct IDs
-    event_enc_ids = pd.read_sql("SELECT DISTINCT encounter_id FROM safety_events", conn)['encounter_id']
+    # Recover 'has_event' from the safety_events distinct IDs
+    event_enc_ids = safety_events['encounter_id'].unique()
     facts['has_any_event'] = facts['encounter_id'].isin(event_enc_ids).astype(int)
-    
-    grp = facts.groupby(['month', 'service_line'])
-    
-    kpi_service = pd.DataFrame()
-    kpi_service['total_encounters'] = grp.size()
-    kpi_service['encounters_with_event'] = grp['has_any_event'].sum()
-    kpi_service['encounters_reported'] = grp['reported_flag_any'].sum()
-    kpi_service['on_time_encounters'] = grp['on_time_flag_any'].sum()
-    
-    kpi_service['compliance_rate'] = kpi_service['encounters_reported'] / kpi_service['encounters_with_event'].replace(0, np.nan)
-    kpi_service['timeliness_rate'] = kpi_service['on_time_encounters'] / kpi_service['encounters_reported'].replace(0, np.nan)
-    
-    # Safety Rates (per 1000 encounters)
-    kpi_service['adr_count'] = grp['adr_flag'].sum()
-    kpi_service['severe_count'] = grp['severe_event_flag'].sum()
-    kpi_service['high_risk_exposure_count'] = grp['high_risk_exposure_flag'].sum()
-    
-    kpi_service['adr_per_1000'] = (kpi_service['adr_count'] / kpi_service['total_encounters']) * 1000
-    kpi_service['severe_per_1000'] = (kpi_service['severe_count'] / kpi_service['total_encounters']) * 1000
-    kpi_service['high_risk_exposure_rate'] = kpi_service['high_risk_exposure_count'] / kpi_service['total_encounters']
-    
-    kpi_service.reset_index(inplace=True)
-    kpi_service.fillna(0, inplace=True)
-    kpi_service.to_sql("kpi_monthly_service", conn, if_exists="replace", index=False)
+    audit_columns = [c for c in facts.columns if c != 'age_band']
 
-    # --- 7. KPI Monthly Overall ---
-    # Similar but without service_line
-    grp_all = facts.groupby(['month'])
-    kpi_overall = pd.DataFrame()
-    kpi_overall['total_encounters'] = grp_all.size()
-    # reuse basic logic...
-    kpi_overall['adr_per_1000'] = (grp_all['adr_flag'].sum() / kpi_overall['total_encounters']) * 1000
-    kpi_overall.reset_index(inplace=True)
-    kpi_overall.to_sql("kpi_monthly_overall", conn, if_exists="replace", index=False)
+    # Every registered KPI of the grain in one groupby (src/kpis.py)
+    add_measures(facts)
+    kpi_service = aggregate_kpis(facts, ['month', 'service_line'])
 
     # --- 8. Event Metrics Monthly ---
     # Need granular view: Month, Service, MedClass (from orders? No, from Facts + Event link?)
@@ -172,20 +265,23 @@ def build_kpis():
     # For synthetic demo, let's just aggregate by Service/Month/EventType.
     
     files_df = safety_events.merge(facts[['encounter_id', 'service_line', 'month']], on='encounter_id', how='left')
-    metrics = files_df.groupby(['month', 'service_line', 'event_type']).size().reset_index(name='event_count')
-    metrics.to_sql("event_metrics_monthly", conn, if_exists="replace", index=False)
+    metrics = files_df.groupby(['month', 'service_line', 'event_type'], observed=True).size().reset_index(name='event_count')
     
     # --- 9. Reporting Delay Bins ---
     # Bins: 0-1, 2-3, 4-7, 8-14, 15-30, 31+
     # On safety_events
     bins = [-1, 1, 3, 7, 14, 30, 999]
     labels = ["0-1", "2-3", "4-7", "8-14", "15-30", "31+"]
-    safety_events['delay_bin'] = pd.cut(safety_events['report_delay_days'], bins=bins, labels=labels)
+    safety_events = safety_events.assign(delay_bin=pd.cut(safety_events['report_delay_days'], bins=bins, labels=labels))
     # Join for service line
     se_enriched = safety_events.merge(facts[['encounter_id', 'service_line', 'month']], on='encounter_id', how='left')
     
-    delay_bins = se_enriched.groupby(['month', 'service_line', 'delay_bin']).size().reset_index(name='count')
-    delay_bins.to_sql("reporting_delay_bins", conn, if_exists="replace", index=False)
+    delay_bins = se_enriched.groupby(['month', 'service_line', 'delay_bin'], observed=True).size().reset_index(name='count')
+
+    # --- 9b. Sketches ---
+    # Distinct patients and delay percentiles aren't additive; selections merge these instead
+    sketches = compute_sketch_rows(facts[['month', 'service_line', 'patient_id']],
+                                   se_enriched[['month', 'service_line', 'report_delay_days']])
     
     # --- 10. Audit View ---
     # Criteria: High Risk = 1 AND (ADR or MedError or Severe) AND Late Reporting = 1
@@ -196,29 +292,259 @@ def build_kpis():
         ((facts['adr_flag'] == 1) | (facts['med_error_flag'] == 1) | (facts['severe_event_flag'] == 1)) &
         (facts['late_reporting_flag_any'] == 1)
     )
-    audit_view = facts[audit_mask].copy()
-    audit_view.to_sql("audit_view", conn, if_exists="replace", index=False)
-    
-    # --- 11. Data Quality Report ---
-    # Simple checks
-    dq_data = []
-    # Check 1: Orphans (Safety events without encounter)
-    orphans = safety_events[~safety_events['encounter_id'].isin(facts['encounter_id'])]
-    dq_data.append({"check": "Safety Events Orphans", "status": "PASS" if orphans.empty else "FAIL", "count": len(orphans)})
-    
-    # Check 2: Negative LOS
-    neg_los = facts[facts['length_of_stay_days'] < 0]
-    dq_data.append({"check": "Negative LOS", "status": "PASS" if neg_los.empty else "FAIL", "count": len(neg_los)})
-    
-    dq_df = pd.DataFrame(dq_data)
-    dq_df.to_sql("data_quality_report", conn, if_exists="replace", index=False)
-    
-    conn.close()
+    audit_view = facts.loc[audit_mask, audit_columns].copy()
+
+    return {
+        "kpi_monthly_service": kpi_service,
+        "event_metrics_monthly": metrics,
+        "reporting_delay_bins": delay_bins,
+        "kpi_sketches": sketches,
+        "audit_view": audit_view,
+    }
+
+CUBE_DIMENSIONS = CUBE_ENCOUNTER_DIMENSIONS + CUBE_EVENT_DIMENSIONS
+CUBE_MEASURES = KPI_COUNT_COLUMNS + ['event_count']
+
+def compute_cube_leaves(facts, safety_events):
+    """Finest-grain cells of kpi_cube: all encounter dimensions set.
+
+    Four leaf families cover the event dimensions: none, event_type only,
+    severity only, both. In an event-dimension cell the encounter measures
+    count the encounters having at least one such event, so they are not
+    additive across event values; they are additive across every encounter
+    dimension, which is what rollup_cube relies on. `facts` needs the 'month'
+    and 'age_band' columns and the measure columns added by compute_kpi_tables.
+    """
+    enc = facts[['encounter_id'] + CUBE_ENCOUNTER_DIMENSIONS + KPI_COUNT_COLUMNS].assign(
+        age_band=facts['age_band'].cat.add_categories('Unknown').fillna('Unknown')
+    )
+    events = safety_events[['encounter_id'] + CUBE_EVENT_DIMENSIONS]
+
+    leaves = []
+    for r in range(len(CUBE_EVENT_DIMENSIONS) + 1):
+        for event_dims in map(list, itertools.combinations(CUBE_EVENT_DIMENSIONS, r)):
+            if event_dims:
+                per_encounter = (events.groupby(['encounter_id'] + event_dims, observed=True).size()
+                                 .rename('event_count').reset_index())
+                base = per_encounter.merge(enc, on='encounter_id')
+            else:
+                counts = events.groupby('encounter_id').size()
+                base = enc.assign(event_count=enc['encounter_id'].map(counts).fillna(0).astype(int))
+            leaf = base.groupby(CUBE_ENCOUNTER_DIMENSIONS + event_dims, observed=True)[CUBE_MEASURES].sum().reset_index()
+            for dim in CUBE_EVENT_DIMENSIONS:
+                if dim not in event_dims:
+                    leaf[dim] = CUBE_ALL
+            leaves.append(leaf[CUBE_DIMENSIONS + CUBE_MEASURES])
+    return pd.concat(leaves, ignore_index=True)
+
+def rollup_cube(leaves, include_leaves=True):
+    """Adds every grouping-set subtotal over the encounter dimensions by summing leaves."""
+    cells = [leaves] if include_leaves else []
+    for r in range(len(CUBE_ENCOUNTER_DIMENSIONS)):
+        for kept in map(list, itertools.combinations(CUBE_ENCOUNTER_DIMENSIONS, r)):
+            subtotal = leaves.groupby(kept + CUBE_EVENT_DIMENSIONS, observed=True)[CUBE_MEASURES].sum().reset_index()
+            for dim in CUBE_ENCOUNTER_DIMENSIONS:
+                if dim not in kept:
+                    subtotal[dim] = CUBE_ALL
+            cells.append(subtotal[CUBE_DIMENSIONS + CUBE_MEASURES])
+    return pd.concat(cells, ignore_index=True)
+
+# Facts plus the patient's age band (a kpi_cube dimension); decode() the result
+_FACTS_WITH_AGE_BAND = """
+    SELECT f.*, p.age_band_key FROM encounter_facts f
+    LEFT JOIN patients p ON p.patient_id = f.patient_id
+"""
+_SAFETY_EVENT_COLUMNS = "SELECT encounter_id, event_type_key, severity_key, report_delay_days FROM safety_events"
+
+@instrumented
+def build_kpis():
+    backend = get_backend()
+    print(f"Building KPI tables ({backend.name} backend)...")
+    facts = decode(backend.read(_FACTS_WITH_AGE_BAND))
+    safety_events = decode(backend.read(_SAFETY_EVENT_COLUMNS))
+
+    tables = compute_kpi_tables(facts, safety_events)
+
+    # --- 7. KPI Monthly Overall ---
+    # Same metrics as the service table, without service_line
+    tables["kpi_monthly_overall"] = aggregate_kpis(facts, 'month')
+
+    # --- 7b. Rolling rates and SPC limits ---
+    # Running sums over each (service_line, KPI) series, from the service rows
+    tables["kpi_spc_monthly"] = compute_kpi_spc(tables["kpi_monthly_service"])
+
+    # --- 12. KPI Cube ---
+    # month x service_line x admission_type x age_band x event_type x severity, with all subtotals
+    tables["kpi_cube"] = rollup_cube(compute_cube_leaves(facts, safety_events))
+
+    # Refill the declared tables (keys and indexes intact) in one SQLite transaction
+    rows = backend.write({table: tables[table] for table in KPI_TABLES})
+    record_rows(rows_in=len(facts) + len(safety_events), rows_out=sum(rows.values()))
+
     print("KPIs built successfully.")
 
-def run_pipeline():
-    build_encounter_facts()
+# Incremental refresh scope: encounter_facts rows whose (month, service_line) was touched.
+# affected_keys holds service line labels, as the KPI tables do.
+_AFFECTED_KEY_ENCOUNTERS = """
+    SELECT f.encounter_id FROM encounter_facts f
+    JOIN dim_service_line d ON d.service_line_key = f.service_line_key
+    JOIN temp.affected_keys k
+      ON d.service_line = k.service_line
+     AND f.admit_date >= k.month || '-01' AND f.admit_date < date(k.month || '-01', '+1 month')
+"""
+
+def _capture_affected_keys(conn):
+    conn.execute("""
+        INSERT OR IGNORE INTO temp.affected_keys
+        SELECT DISTINCT substr(f.admit_date, 1, 7), d.service_line FROM encounter_facts f
+        LEFT JOIN dim_service_line d ON d.service_line_key = f.service_line_key
+        WHERE f.patient_id IN (SELECT patient_id FROM temp.affected_patients)
+    """)
+
+@instrumented
+def refresh_incremental():
+    """Applies the changes captured in change_log to encounter_facts and the KPI tables.
+
+    Facts are recomputed for every patient with a touched encounter (readmission
+    flags depend on neighbouring encounters), then only the (month, service_line)
+    KPI rows those patients fall in, before or after the change, are rebuilt.
+    Cost scales with the size of the change rather than the database.
+    """
+    print("Refreshing incrementally from change_log...")
+    with get_manager().writer() as conn:
+        max_change = conn.execute("SELECT MAX(change_id) FROM change_log").fetchone()[0]
+        if max_change is None:
+            print("No captured changes; nothing to refresh.")
+            return 0
+
+        # TEMP tables live as long as the (pooled) writer connection
+        for temp_table in ("affected_patients", "affected_keys", "scope_encounters"):
+            conn.execute(f"DROP TABLE IF EXISTS temp.{temp_table}")
+
+        conn.execute("BEGIN")
+        with conn:
+            conn.execute("""
+                CREATE TEMP TABLE affected_patients AS
+                SELECT patient_id FROM change_log WHERE change_id <= :max AND patient_id IS NOT NULL
+                UNION SELECT e.patient_id FROM change_log c JOIN encounters e ON e.encounter_id = c.encounter_id
+                      WHERE c.change_id <= :max
+                UNION SELECT f.patient_id FROM change_log c JOIN encounter_facts f ON f.encounter_id = c.encounter_id
+                      WHERE c.change_id <= :max
+            """, {"max": max_change})
+            conn.execute("CREATE TEMP TABLE affected_keys (month TEXT, service_line TEXT, PRIMARY KEY (month, service_line))")
+
+            # 1. Facts for affected patients (keys captured before and after, so moved rows are covered)
+            _capture_affected_keys(conn)
+            conn.execute("DELETE FROM encounter_facts WHERE patient_id IN (SELECT patient_id FROM temp.affected_patients)")
+            insert_encounter_facts_sql(conn, patients_table="temp.affected_patients")
+            _capture_affected_keys(conn)
+            refresh_encounter_returns(conn, "temp.affected_patients")
+
+            # 2. KPI rows for affected (month, service_line) keys
+            conn.execute(f"CREATE TEMP TABLE scope_encounters AS {_AFFECTED_KEY_ENCOUNTERS}")
+            scope = "encounter_id IN (SELECT encounter_id FROM temp.scope_encounters)"
+            facts = decode(pd.read_sql(f"{_FACTS_WITH_AGE_BAND} WHERE f.{scope}", conn))
+            safety_events = decode(pd.read_sql(f"{_SAFETY_EVENT_COLUMNS} WHERE {scope}", conn))
+            key_filter = "(month, service_line) IN (SELECT month, service_line FROM temp.affected_keys)"
+            service_before = pd.read_sql(f"SELECT * FROM kpi_monthly_service WHERE {key_filter}", conn)
+            kpi_tables = compute_kpi_tables(facts, safety_events)
+            for table in KEYED_KPI_TABLES:
+                conn.execute(f"DELETE FROM {table} WHERE {key_filter}")
+                insert_dataframe(conn, table, kpi_tables[table])
+
+            # SPC rows only from the first month whose counts changed, continuing the stored running sums
+            start = first_changed_month(service_before, kpi_tables["kpi_monthly_service"])
+            if start is not None:
+                history = pd.read_sql(
+                    "SELECT * FROM kpi_spc_monthly WHERE month >= ? AND month < ?", conn,
+                    params=[months_before(start, max(ROLLING_WINDOWS)), start],
+                )
+                later = pd.read_sql("SELECT * FROM kpi_monthly_service WHERE month >= ?", conn, params=[start])
+                conn.execute("DELETE FROM kpi_spc_monthly WHERE month >= ?", (start,))
+                insert_dataframe(conn, "kpi_spc_monthly", compute_kpi_spc(later, history, start))
+
+            # Overall rows are re-summed from the refreshed service rows of the affected months
+            service_rows = pd.read_sql(
+                "SELECT * FROM kpi_monthly_service WHERE month IN (SELECT month FROM temp.affected_keys)", conn
+            )
+            conn.execute("DELETE FROM kpi_monthly_overall WHERE month IN (SELECT month FROM temp.affected_keys)")
+            insert_dataframe(conn, "kpi_monthly_overall",
+                             derive_kpi_rates(service_rows.groupby('month')[KPI_COUNT_COLUMNS].sum()).reset_index())
+
+            # Cube: replace the affected leaves, then re-roll every subtotal from the (small) leaf set
+            leaf_filter = " AND ".join(f"{dim} != '{CUBE_ALL}'" for dim in CUBE_ENCOUNTER_DIMENSIONS)
+            conn.execute(f"DELETE FROM kpi_cube WHERE {key_filter} AND {leaf_filter}")
+            insert_dataframe(conn, "kpi_cube", compute_cube_leaves(facts, safety_events))
+            leaves = pd.read_sql(f"SELECT * FROM kpi_cube WHERE {leaf_filter}", conn)
+            conn.execute(f"DELETE FROM kpi_cube WHERE NOT ({leaf_filter})")
+            insert_dataframe(conn, "kpi_cube", rollup_cube(leaves, include_leaves=False))
+
+            n_patients = conn.execute("SELECT COUNT(*) FROM temp.affected_patients").fetchone()[0]
+            n_keys = conn.execute("SELECT COUNT(*) FROM temp.affected_keys").fetchone()[0]
+            n_changes = conn.execute("DELETE FROM change_log WHERE change_id <= ?", (max_change,)).rowcount
+
+    record_rows(rows_in=n_changes, rows_out=len(facts))
+    print(f"Incremental refresh done: {n_patients} patients, {n_keys} (month, service_line) KPI keys.")
+    return n_patients
+
+def record_build(conn, mode):
+    """Stamps a completed build; readers key their cached results on the latest build_id."""
+    build_id = uuid.uuid4().hex
+    with conn:
+        conn.execute(
+            "INSERT INTO build_info (build_id, built_at, mode) VALUES (?, ?, ?)",
+            (build_id, pd.Timestamp.now().isoformat(timespec="seconds"), mode),
+        )
+    get_manager().note_build()
+    return build_id
+
+def run_pipeline(engine=None, incremental=False, snapshot=None, facilities=None):
+    """Builds the facts and KPI tables of the active DB, or with `facilities` of those shards."""
+    if facilities:
+        # One process per facility shard, each running (and recording) this pipeline on its own DB
+        # (src/facilities.py); nothing is measured here, so the main DB is left alone
+        from src.facilities import build_facilities
+        return build_facilities(facilities, engine=engine, generate=False, incremental=incremental)
+    with stage("run_pipeline"):
+        return _build(engine, incremental, snapshot)
+
+def _build(engine, incremental, snapshot):
+    snapshot = SNAPSHOT_FORMAT if snapshot is None else snapshot
+    if snapshot:
+        # pyarrow is only loaded for builds that export a snapshot
+        from src.columnar import export_snapshot
+    if incremental:
+        n_patients = refresh_incremental()
+        if n_patients:
+            run_data_quality_checks()
+            with get_manager().writer() as conn:
+                build_id = record_build(conn, "incremental")
+            if snapshot:
+                export_snapshot(build_id, snapshot)
+        return n_patients
+    build_encounter_facts(engine)
+    build_encounter_returns()
     build_kpis()
+    run_data_quality_checks()
+    # Start capturing changes against this build
+    with get_manager().writer() as conn:
+        with conn:
+            conn.execute("DELETE FROM change_log")
+        enable_change_capture(conn)
+        build_id = record_build(conn, "full")
+    if snapshot:
+        export_snapshot(build_id, snapshot)
 
 if __name__ == "__main__":
-    run_pipeline()
+    parser = argparse.ArgumentParser(description="Build encounter_facts and the KPI tables.")
+    parser.add_argument("--engine", choices=["pandas", "sql"], default=None)
+    parser.add_argument("--incremental", action="store_true", help="Refresh only what change_log says was touched")
+    parser.add_argument("--snapshot", choices=["parquet", "arrow"], default=None,
+                        help="Also export a columnar snapshot of the build (default: CQM_SNAPSHOT_FORMAT)")
+    parser.add_argument("--facilities", default=None,
+                        help="Build these facility shards (comma-separated, or 'all' for CQM_FACILITIES) in parallel")
+    args = parser.parse_args()
+    facilities = None
+    if args.facilities:
+        facilities = FACILITIES if args.facilities == "all" else args.facilities.split(",")
+    run_pipeline(args.engine, args.incremental, args.snapshot, facilities)
@@ -0,0 +1,233 @@
+"""Columnar snapshots of the derived tables (DERIVED_TABLES: facts, returns, KPIs).
+
+After a build the tables can be exported to Parquet (hive-partitioned by
+month) or Arrow IPC files under SNAPSHOT_DIR/<build_id>/, with a
+manifest.json describing them so other tools can consume the same build.
+read_snapshot memory-maps those files and materializes only the requested
+columns and rows; iter_snapshot streams them one record batch at a time in
+the table's stored order (the audit CSV export reads from it when the build
+was exported). pyarrow is optional: without it exports fail loudly and reads
+return None so callers fall back to SQLite.
+"""
+import json
+import os
+import shutil
+import pandas as pd
+from src.config import SNAPSHOT_DIR, SNAPSHOT_CHUNK_ROWS, DERIVED_TABLES
+from src.instrumentation import instrumented, record_rows
+from src.sqlite_io import get_manager
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.ipc as ipc
+    import pyarrow.parquet as pq
+except ImportError:  # optional dependency
+    pa = None
+
+SNAPSHOT_FORMATS = ["parquet", "arrow"]
+MANIFEST_NAME = "manifest.json"
+# Tables written in a fixed row order, so readers can stream them sorted
+SNAPSHOT_SORT_KEYS = {"audit_view": ["admit_date", "encounter_id"]}
+
+def _arrow_schema(conn, table):
+    """Arrow schema from the declared SQLite column types (stable across chunks)."""
+    types = {"INTEGER": pa.int64(), "REAL": pa.float64(), "BLOB": pa.binary()}
+    return pa.schema([
+        (name, types.get(decl.upper(), pa.string()))
+        for _, name, decl, *_ in conn.execute(f"PRAGMA table_info({table})")
+    ])
+
+def _partition_expr(schema):
+    """SQL for the month partition key: the month column, else derived from admit_date."""
+    if "month" in schema.names:
+        return None
+    if "admit_date" in schema.names:
+        return "substr(admit_date, 1, 7)"
+    return False
+
+def _export_table(conn, table, fmt, out_dir):
+    schema = _arrow_schema(conn, table)
+    derived = _partition_expr(schema)
+    partitioned = fmt == "parquet" and derived is not False
+    select = f"SELECT *, {derived} AS month FROM {table}" if partitioned and derived else f"SELECT * FROM {table}"
+    sort_keys = SNAPSHOT_SORT_KEYS.get(table)
+    if sort_keys:
+        select += f" ORDER BY {', '.join(sort_keys)}"
+    write_schema = schema.append(pa.field("month", pa.string())) if partitioned and derived else schema
+
+    rows = 0
+    chunks = pd.read_sql(select, conn, chunksize=SNAPSHOT_CHUNK_ROWS)
+    if fmt == "arrow":
+        with ipc.new_file(str(out_dir / f"{table}.arrow"), write_schema) as writer:
+            for chunk in chunks:
+                writer.write_table(pa.Table.from_pandas(chunk, schema=write_schema, preserve_index=False))
+                rows += len(chunk)
+    else:
+        target = out_dir / table
+        target.mkdir()
+        for i, chunk in enumerate(chunks):
+            batch = pa.Table.from_pandas(chunk, schema=write_schema, preserve_index=False)
+            if partitioned:
+                # Zero-padded so file names sort in write order
+                pq.write_to_dataset(batch, str(target), partition_cols=["month"],
+                                    basename_template=f"part-{i:05d}-{{i}}.parquet")
+            else:
+                pq.write_table(batch, str(target / f"part-{i:05d}.parquet"))
+            rows += len(chunk)
+    return {
+        "columns": schema.names,
+        "rows": rows,
+        "partitioned_by": "month" if partitioned else None,
+        "sorted_by": sort_keys,
+    }
+
+@instrumented
+def export_snapshot(build_id, fmt="parquet", tables=None, snapshot_dir=None):
+    """Writes the tables of one build to SNAPSHOT_DIR/<build_id>/ and prunes older builds.
+
+    Files are written into a temporary directory that is renamed into place,
+    so readers only ever see a complete snapshot.
+    """
+    if pa is None:
+        raise RuntimeError("Columnar snapshots need pyarrow (pip install pyarrow)")
+    if fmt not in SNAPSHOT_FORMATS:
+        raise ValueError(f"Unknown snapshot format {fmt!r} (expected one of {SNAPSHOT_FORMATS})")
+    root = snapshot_dir or SNAPSHOT_DIR
+    root.mkdir(parents=True, exist_ok=True)
+    tmp_dir = root / f".{build_id}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir()
+
+    manifest = {"build_id": build_id, "format": fmt, "tables": {}}
+    with get_manager().reader() as conn:
+        for table in tables or DERIVED_TABLES:
+            manifest["tables"][table] = _export_table(conn, table, fmt, tmp_dir)
+    with open(tmp_dir / MANIFEST_NAME, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_dir, root / build_id)
+
+    # Keep only the snapshot of this build (open memory maps of old files stay valid on POSIX)
+    for old in root.iterdir():
+        if old.is_dir() and old.name != build_id:
+            shutil.rmtree(old, ignore_errors=True)
+    total = sum(t["rows"] for t in manifest["tables"].values())
+    record_rows(rows_out=total)
+    print(f"Exported {fmt} snapshot of {len(manifest['tables'])} tables ({total:,} rows) to {root / build_id}")
+    return manifest
+
+def load_manifest(build_id, snapshot_dir=None):
+    """Manifest of a build's snapshot, or None if it was not exported."""
+    if build_id is None:
+        return None
+    path = (snapshot_dir or SNAPSHOT_DIR) / build_id / MANIFEST_NAME
+    if not path.exists():
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def _filter_expression(filters, schema):
+    """pyarrow expression ANDing (column, op, value) filters; `in` lists take the column's type (so [] works)."""
+    return pq.filters_to_expression([
+        (col, op, pa.array(list(value), type=schema.field(col).type) if op in ("in", "not in") else value)
+        for col, op, value in filters
+    ])
+
+def _categoricals_to_str(df):
+    """Hive partition keys come back as dictionaries; match the SQLite dtypes."""
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype(str)
+    return df
+
+def read_snapshot(table, build_id, columns=None, snapshot_dir=None, filters=None):
+    """Reads `columns` of a snapshotted table into a DataFrame via memory-mapped files.
+
+    `filters` are (column, op, value) tuples ANDed together, as in
+    pyarrow.parquet (op: =, !=, <, <=, >, >=, in, not in); on Parquet they
+    prune month partitions and row groups. Returns None when pyarrow is
+    missing or the build has no snapshot of the table, so callers can fall
+    back to SQLite.
+    """
+    if pa is None:
+        return None
+    manifest = load_manifest(build_id, snapshot_dir)
+    if manifest is None or table not in manifest["tables"]:
+        return None
+    info = manifest["tables"][table]
+    columns = list(columns or info["columns"])
+    base = (snapshot_dir or SNAPSHOT_DIR) / build_id
+
+    if manifest["format"] == "arrow":
+        # Only the selected columns' buffers are paged in and copied out of the map
+        with pa.memory_map(str(base / f"{table}.arrow")) as source:
+            data = ipc.open_file(source).read_all()
+            if filters:
+                data = data.filter(_filter_expression(filters, data.schema))
+            df = data.select(columns).to_pandas()
+    else:
+        partitioning = "hive" if info["partitioned_by"] else None
+        dataset = pq.ParquetDataset(str(base / table), memory_map=True, partitioning=partitioning)
+        if filters:
+            dataset = pq.ParquetDataset(str(base / table), memory_map=True, partitioning=partitioning,
+                                        filters=_filter_expression(filters, dataset.schema))
+        df = dataset.read(columns=columns).to_pandas()
+    return _categoricals_to_str(df)
+
+def _ordered_fragments(dataset):
+    """A Parquet dataset's files in write order: month partitions (NULL first), then file name."""
+    def key(fragment):
+        month = ds.get_partition_keys(fragment.partition_expression).get("month")
+        return month is not None, month or "", fragment.path
+    return sorted(dataset.get_fragments(), key=key)
+
+def _snapshot_batches(base, table, info, fmt, columns, filters):
+    """Record batches of a snapshotted table in stored order, filtered and projected."""
+    if fmt == "arrow":
+        with pa.memory_map(str(base / f"{table}.arrow")) as source:
+            reader = ipc.open_file(source)
+            expression = _filter_expression(filters, reader.schema) if filters else None
+            for i in range(reader.num_record_batches):
+                data = pa.Table.from_batches([reader.get_batch(i)])
+                if expression is not None:
+                    data = data.filter(expression)
+                yield from data.select(columns).to_batches()
+    else:
+        partitioning = "hive" if info["partitioned_by"] else None
+        dataset = ds.dataset(str(base / table), format="parquet", partitioning=partitioning)
+        expression = _filter_expression(filters, dataset.schema) if filters else None
+        # A dataset keeps its fragments' order, and a single-threaded scan yields batches in it
+        ordered = ds.FileSystemDataset(_ordered_fragments(dataset), dataset.schema, dataset.format,
+                                       dataset.filesystem)
+        yield from ordered.to_batches(columns=columns, filter=expression, use_threads=False)
+
+def iter_snapshot(table, build_id, columns=None, snapshot_dir=None, filters=None, order=None,
+                  chunk_rows=SNAPSHOT_CHUNK_ROWS):
+    """Streams a snapshotted table as DataFrames of at most `chunk_rows` rows, in its stored order.
+
+    Takes the same `filters` as read_snapshot; only one record batch is
+    materialized at a time. With `order` (a list of columns), returns None
+    unless the snapshot was written sorted by exactly those columns
+    (SNAPSHOT_SORT_KEYS); also None when there is no snapshot. An empty
+    result still yields one empty frame, so callers get the columns.
+    """
+    if pa is None:
+        return None
+    manifest = load_manifest(build_id, snapshot_dir)
+    if manifest is None or table not in manifest["tables"]:
+        return None
+    info = manifest["tables"][table]
+    if order is not None and info.get("sorted_by") != list(order):
+        return None
+    columns = list(columns or info["columns"])
+    base = (snapshot_dir or SNAPSHOT_DIR) / build_id
+
+    def chunks():
+        empty = True
+        for batch in _snapshot_batches(base, table, info, manifest["format"], columns, filters):
+            for offset in range(0, batch.num_rows, chunk_rows):
+                empty = False
+                yield _categoricals_to_str(batch.slice(offset, chunk_rows).to_pandas())
+        if empty:
+            yield pd.DataFrame(columns=columns)
+    return chunks()
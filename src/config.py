@@ -5,19 +5,189 @@ from pathlib import Path
 BASE_DIR = Path(__file__).resolve().parent.parent
 DB_DIR = BASE_DIR / "db"
 DB_NAME = "clinical_ops.db"
-DB_PATH = DB_DIR / DB_NAME
+DB_PATH = Path(os.environ.get("CQM_DB_PATH", DB_DIR / DB_NAME))  # override to build elsewhere (benchmarks)
+# Background rebuilds build here, next to DB_PATH so the final rename is atomic
+REBUILD_DB_PATH = DB_PATH.with_name(f".{DB_PATH.stem}.rebuild{DB_PATH.suffix}")
 SCHEMA_PATH = DB_DIR / "schema.sql"
+CHANGE_CAPTURE_PATH = DB_DIR / "change_capture.sql"
+METRICS_SCHEMA_PATH = DB_DIR / "metrics_schema.sql"
 
 # Parameters
-RANDOM_SEED = 42
-TARGET_N_PATIENTS = 500  # Small enough for rapid dev, large enough for charts
-TARGET_N_ENCOUNTERS = 1200
+# Sizes can be overridden per run via env vars (or the generate_data CLI) for load tests
+RANDOM_SEED = int(os.environ.get("CQM_RANDOM_SEED", 42))
+TARGET_N_PATIENTS = int(os.environ.get("CQM_N_PATIENTS", 500))  # Small enough for rapid dev, large enough for charts
+TARGET_N_ENCOUNTERS = int(os.environ.get("CQM_N_ENCOUNTERS", 1200))
+# Patients per generation chunk; bounds peak memory regardless of total size
+GENERATION_CHUNK_PATIENTS = int(os.environ.get("CQM_CHUNK_PATIENTS", 50_000))
+# Worker processes for sharded generation (1 = stream in-process)
+GENERATION_WORKERS = int(os.environ.get("CQM_GENERATION_WORKERS", 1))
 START_DATE = "2024-01-01"
 END_DATE = "2024-12-31"
 
+# Multi-facility shards (src/facilities.py): one SQLite file per facility under FACILITY_DB_DIR,
+# built in parallel by FACILITY_BUILD_WORKERS processes and queried together through ATTACH.
+# Empty = a single facility in DB_PATH.
+FACILITIES = [f.strip() for f in os.environ.get("CQM_FACILITIES", "").split(",") if f.strip()]
+FACILITY_DB_DIR = Path(os.environ.get("CQM_FACILITY_DB_DIR", DB_DIR / "facilities"))
+FACILITY_BUILD_WORKERS = int(os.environ.get("CQM_FACILITY_WORKERS", os.cpu_count() or 1))
+# Facility of the single DB_PATH database. dim_facility lists it first, then FACILITIES, so the keys
+# of built shards stay put when facilities are appended to CQM_FACILITIES (don't reorder it).
+DEFAULT_FACILITY = os.environ.get("CQM_DEFAULT_FACILITY", "main")
+FACILITY_LABELS = list(dict.fromkeys([DEFAULT_FACILITY, *FACILITIES]))
+
+# Pipeline
+# Engine for the pipeline's scans and the dashboard's reads (src/backends.py): "sqlite" or "duckdb"
+# (columnar, reads the same SQLite file; needs the optional duckdb package). Writes always use SQLite.
+ANALYTIC_BACKEND = os.environ.get("CQM_BACKEND", "sqlite")
+# Engine for encounter_facts: "pandas" (in-memory) or "sql" (computed inside SQLite)
+FACTS_ENGINE = os.environ.get("CQM_FACTS_ENGINE", "pandas")
+
+# Return windows for encounter_returns (src/readmissions.py), all computed in one sorted pass.
+# scope: "all" = any later encounter, "same_service" = same service line, "ed" = ED admissions
+READMISSION_WINDOWS = (
+    [{"name": f"readmit_{d}d", "days": d, "scope": "all"} for d in (7, 30, 90)]
+    + [{"name": f"same_service_readmit_{d}d", "days": d, "scope": "same_service"} for d in (7, 30, 90)]
+    + [{"name": f"ed_revisit_{d}d", "days": d, "scope": "ed"} for d in (3, 7, 30)]
+)
+
+# SQLite connection layer (src/sqlite_io.py)
+# WAL lets dashboard reads proceed while a rebuild writes; values are applied verbatim as PRAGMAs.
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 10_000,
+    "cache_size": -65_536,  # KiB (64 MB)
+    "mmap_size": 268_435_456,  # 256 MB
+    "temp_store": "MEMORY",
+}
+# Throwaway files (generation shards) skip durability entirely
+SQLITE_BULK_PRAGMAS = {
+    "journal_mode": "OFF",
+    "synchronous": "OFF",
+    "cache_size": -65_536,
+    "temp_store": "MEMORY",
+}
+SQLITE_READ_POOL_SIZE = int(os.environ.get("CQM_SQLITE_READ_POOL", 8))
+SQLITE_STATEMENT_CACHE_SIZE = 256
+
+# Dashboard query cache (src/query_cache.py): LRU bounded by entries and DataFrame bytes
+QUERY_CACHE_MAX_ENTRIES = int(os.environ.get("CQM_QUERY_CACHE_ENTRIES", 256))
+QUERY_CACHE_MAX_BYTES = int(os.environ.get("CQM_QUERY_CACHE_BYTES", 256 * 1024 * 1024))
+# Builds of this process and file swaps invalidate the cache at once; builds run by another
+# process (e.g. the CLI) are noticed within this many seconds
+BUILD_VERSION_TTL_S = float(os.environ.get("CQM_BUILD_VERSION_TTL", 5))
+
+# Mergeable sketches per (month, service_line) in kpi_sketches (src/sketches.py):
+# HyperLogLog of distinct patients with 2**HLL_PRECISION registers (~1.04 / sqrt(2**p) relative error)
+# and a KLL quantile sketch of report_delay_days with compactor size KLL_K (~1.65 / KLL_K rank error)
+HLL_PRECISION = int(os.environ.get("CQM_HLL_PRECISION", 12))
+KLL_K = int(os.environ.get("CQM_KLL_K", 200))
+DELAY_PERCENTILES = [0.5, 0.9, 0.99]
+
+# Audit worklist (src/dashboard_queries.py): keyset page size, and CSV exports streamed from
+# SQLite this many rows at a time into a temp file that spills to disk past EXPORT_SPOOL_BYTES
+AUDIT_PAGE_SIZE = int(os.environ.get("CQM_AUDIT_PAGE_SIZE", 50))
+EXPORT_CHUNK_ROWS = int(os.environ.get("CQM_EXPORT_CHUNK_ROWS", 50_000))
+EXPORT_SPOOL_BYTES = 16 * 1024 * 1024
+
+# Pipeline instrumentation (src/instrumentation.py)
+# Set to a directory to dump a cProfile .prof file per stage and run
+PROFILE_DIR = os.environ.get("CQM_PROFILE_DIR") or None
+PIPELINE_HEALTH_RUNS = 50  # runs shown on the Pipeline Health trend
+
+# Data quality rules (src/data_quality.py): tables above this many rows are checked on a random
+# sample of DQ_SAMPLE_RATE of their rows, in blocks of DQ_SAMPLE_BLOCK_ROWS consecutive rowids,
+# unless a full pass is requested
+DQ_SAMPLE_THRESHOLD_ROWS = int(os.environ.get("CQM_DQ_SAMPLE_THRESHOLD", 5_000_000))
+DQ_SAMPLE_RATE = 0.1
+DQ_SAMPLE_BLOCK_ROWS = 4096
+
+# Columnar snapshots (src/columnar.py): "parquet" (partitioned by month), "arrow" (IPC) or "" (off)
+SNAPSHOT_DIR = Path(os.environ.get("CQM_SNAPSHOT_DIR", DB_DIR / "snapshots"))
+SNAPSHOT_FORMAT = os.environ.get("CQM_SNAPSHOT_FORMAT", "")
+SNAPSHOT_CHUNK_ROWS = 250_000  # rows streamed out of SQLite per write
+
+# Benchmarks (src/benchmark.py): named scales in encounters; patients keep the default ratio
+BENCHMARK_SCALES = {"1k": 1_000, "100k": 100_000, "1m": 1_000_000, "10m": 10_000_000}
+BENCHMARK_DIR = BASE_DIR / "benchmarks"
+# A stage regresses when it is this much slower (or bigger) than the baseline...
+BENCHMARK_TOLERANCE = float(os.environ.get("CQM_BENCHMARK_TOLERANCE", 0.25))
+# ...and by more than these absolute floors (keeps tiny stages from flapping on noise)
+BENCHMARK_MIN_DELTA_SECONDS = 0.25
+BENCHMARK_MIN_DELTA_MB = 16
+
+# Dashboard cold start (python -m src.benchmark --startup): seconds from launching a fresh
+# process to the first complete render of each page, against a DB of STARTUP_SCALE encounters
+STARTUP_BUDGET_SECONDS = float(os.environ.get("CQM_STARTUP_BUDGET", 4.0))
+STARTUP_SCALE = "1k"
+
 # Business Rules / Lists
 SERVICE_LINES = ["Medicine", "Surgery", "ED", "ICU", "OB", "Pediatrics", "Oncology"]
 ADMISSION_TYPES = ["ED", "Inpatient", "Outpatient"]
 MED_CLASSES = ["Opioid", "Antibiotic", "Anticoagulant", "Insulin", "Sedative", "Statin", "Bronchodilator"]
 EVENT_TYPES = ["ADR", "Med_Error", "Near_Miss", "Allergy", "Interaction", "Omission"]
 SEVERITIES = ["Mild", "Moderate", "Severe"]
+AGE_BANDS = ["18-39", "40-64", "65+"]
+SEXES = ["F", "M", "Unknown"]
+
+# Dimension tables (dim_<name>, src/dimensions.py): the integer surrogate key of a label is its
+# position in the list. Raw tables and encounter_facts store <name>_key; KPI outputs keep labels.
+DIMENSIONS = {
+    "service_line": SERVICE_LINES,
+    "admission_type": ADMISSION_TYPES,
+    "med_class": MED_CLASSES,
+    "event_type": EVENT_TYPES,
+    "severity": SEVERITIES,
+    "age_band": AGE_BANDS,
+    "sex": SEXES,
+    "facility": FACILITY_LABELS,
+}
+
+# KPI registry (src/kpis.py). Measures are additive counts: the SUM over encounter_facts rows of
+# an expression valid in both pandas eval and SQLite (columns, numbers, arithmetic, comparisons;
+# has_any_event = the encounter has a safety event). KPIs are ratios of measures times `scale`.
+# Every grain is one groupby over all measures, and selections re-aggregate measures before
+# dividing. A new KPI over existing measures needs no extra pass (and no kpi_cube change);
+# to store it in kpi_monthly_service/overall, add its column to db/schema.sql.
+# `control_chart` ("p" for proportions, "u" for counts per encounter) adds the KPI to kpi_spc_monthly.
+KPI_MEASURES = {
+    "total_encounters": "1",
+    "encounters_with_event": "has_any_event",
+    "encounters_reported": "reported_flag_any",
+    "on_time_encounters": "on_time_flag_any",
+    "adr_count": "adr_flag",
+    "severe_count": "severe_event_flag",
+    "high_risk_exposure_count": "high_risk_exposure_flag",
+}
+KPI_DEFINITIONS = {
+    "compliance_rate": {"numerator": "encounters_reported", "denominator": "encounters_with_event",
+                        "label": "Compliance Rate", "format": "{:.1%}", "help": "Events Reported / Total Events Detected",
+                        "control_chart": "p"},
+    "timeliness_rate": {"numerator": "on_time_encounters", "denominator": "encounters_reported",
+                        "label": "Timeliness Rate", "format": "{:.1%}", "help": "Reported within 7 days",
+                        "control_chart": "p"},
+    "high_risk_exposure_rate": {"numerator": "high_risk_exposure_count", "denominator": "total_encounters",
+                                "label": "High Risk Exposure", "format": "{:.1%}", "help": "% Encounters with High Risk Meds"},
+    "adr_per_1000": {"numerator": "adr_count", "denominator": "total_encounters", "scale": 1000,
+                     "label": "ADR Rate / 1k", "format": "{:.2f}", "control_chart": "u"},
+    "severe_per_1000": {"numerator": "severe_count", "denominator": "total_encounters", "scale": 1000,
+                        "label": "Severe Events / 1k", "format": "{:.2f}", "control_chart": "u"},
+}
+
+# Rolling rates and SPC limits (kpi_spc_monthly, src/spc.py): trailing windows in months (each needs
+# a rate_<N>m column in db/schema.sql) and the control-limit width in standard deviations
+ROLLING_WINDOWS = [3, 12]
+SPC_SIGMA = 3
+
+# Tables the pipeline derives from the raw data (src/build_facts_kpis.py). compute_kpi_tables returns
+# the KEYED ones, whose rows depend only on their own (month, service_line), so an incremental refresh
+# replaces just the touched keys; the rest are re-derived from them. build_kpis writes KPI_TABLES, and
+# columnar snapshots export every DERIVED_TABLES entry.
+KEYED_KPI_TABLES = ["kpi_monthly_service", "event_metrics_monthly", "reporting_delay_bins", "kpi_sketches", "audit_view"]
+KPI_TABLES = [*KEYED_KPI_TABLES, "kpi_monthly_overall", "kpi_spc_monthly", "kpi_cube"]
+DERIVED_TABLES = ["encounter_facts", "encounter_returns", *KPI_TABLES]
+
+# KPI cube (kpi_cube): every grouping set over these dimensions, CUBE_ALL marking a subtotal
+CUBE_ENCOUNTER_DIMENSIONS = ["month", "service_line", "admission_type", "age_band"]
+CUBE_EVENT_DIMENSIONS = ["event_type", "severity"]
+CUBE_ALL = "ALL"
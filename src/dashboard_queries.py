@@ -0,0 +1,321 @@
+"""Server-side queries behind the dashboard pages.
+
+Each function takes the sidebar selections and returns only the columns a
+widget needs, already filtered and aggregated in SQLite (parameterized IN
+lists, indexed KPI tables), so page latency and memory stay flat as history
+grows. Results go through the build-versioned query cache.
+"""
+import pandas as pd
+from src.config import CUBE_ALL, PIPELINE_HEALTH_RUNS, AUDIT_PAGE_SIZE, DELAY_PERCENTILES, EXPORT_CHUNK_ROWS
+from src.kpis import KPI_COUNT_COLUMNS, derive_kpi_rates, kpi_select_sql
+from src.query_cache import cached_query, cached_federated_query, current_build_version
+from src.sketches import HyperLogLog, KLLSketch, merge_sketches
+from src.spc import derive_spc
+from src.sqlite_io import run_query, export_csv, spool_csv, available_facilities
+
+def timings_summary(timings):
+    """One-line summary of run_concurrently timings for a page footer."""
+    slowest = max(timings, key=timings.get)
+    return (f"{len(timings)} queries loaded concurrently; slowest: {slowest} ({timings[slowest] * 1000:.0f} ms), "
+            f"{sum(timings.values()) * 1000:.0f} ms if run one after another")
+
+def _in_list(values):
+    """Placeholders for a parameterized IN (...) list."""
+    return ", ".join("?" for _ in values)
+
+# --- Filter options ---
+
+def list_months():
+    return cached_query("SELECT DISTINCT month FROM kpi_monthly_service ORDER BY month DESC")['month'].tolist()
+
+def list_service_lines(table="kpi_monthly_service"):
+    return cached_query(f"SELECT DISTINCT service_line FROM {table} ORDER BY service_line")['service_line'].tolist()
+
+def list_event_types():
+    return cached_query("SELECT DISTINCT event_type FROM event_metrics_monthly ORDER BY event_type")['event_type'].tolist()
+
+DRILL_DIMENSIONS = ["admission_type", "age_band", "event_type", "severity"]
+
+def list_cube_values(dim):
+    """Drill-down options for one kpi_cube dimension (without the 'ALL' subtotal marker)."""
+    return cached_query(
+        f"SELECT DISTINCT {dim} FROM kpi_cube WHERE {dim} != ? ORDER BY {dim}", [CUBE_ALL]
+    )[dim].tolist()
+
+# --- Executive Overview ---
+
+# Summed measures plus every registered KPI re-derived from them (src/kpis.py)
+_KPI_TOTALS = kpi_select_sql()
+
+def _cube_filter(services, drill):
+    """WHERE clause for a kpi_cube slice.
+
+    `drill` maps DRILL_DIMENSIONS to a value; omitted dimensions use their
+    'ALL' subtotal rows. When every service line is selected the 'ALL'
+    service rows are read instead of summing them, so the lookup is a
+    single indexed row per month.
+    """
+    drill = drill or {}
+    clauses = [f"{dim} = ?" for dim in DRILL_DIMENSIONS]
+    params = [drill.get(dim, CUBE_ALL) for dim in DRILL_DIMENSIONS]
+    if services is None or set(services) >= set(list_service_lines()):
+        clauses.append("service_line = ?")
+        params.append(CUBE_ALL)
+    else:
+        clauses.append(f"service_line IN ({_in_list(services)})")
+        params.extend(services)
+    return " AND ".join(clauses), params
+
+def kpi_totals(month, services, drill=None):
+    """One row of summed counts and re-derived rates for the tiles."""
+    where, params = _cube_filter(services, drill)
+    return cached_query(
+        f"SELECT {_KPI_TOTALS} FROM kpi_cube WHERE month = ? AND {where}",
+        [month, *params],
+    ).fillna(0).iloc[0]
+
+def kpi_trend(services, drill=None):
+    """Monthly re-aggregated KPIs across the selected service lines."""
+    where, params = _cube_filter(services, drill)
+    return cached_query(
+        f"SELECT month, {_KPI_TOTALS} FROM kpi_cube WHERE month != ? AND {where} GROUP BY month ORDER BY month",
+        [CUBE_ALL, *params],
+    )
+
+def kpi_snapshot(month, services, drill=None):
+    """Per-service-line KPI rows for one month (snapshot table and CSV export)."""
+    drill = drill or {}
+    where = " AND ".join(f"{dim} = ?" for dim in DRILL_DIMENSIONS)
+    return cached_query(
+        f"SELECT month, service_line, {_KPI_TOTALS} FROM kpi_cube "
+        f"WHERE month = ? AND service_line IN ({_in_list(services)}) AND {where} "
+        "GROUP BY month, service_line ORDER BY service_line",
+        [month, *services, *(drill.get(dim, CUBE_ALL) for dim in DRILL_DIMENSIONS)],
+    )
+
+def kpi_control_chart(services):
+    """Monthly rate, trailing-window rates and control limits of every SPC KPI (kpi_spc_monthly).
+
+    All service lines read the stored system ('ALL') series; a subset sums
+    the series' monthly counts and re-derives windows and limits from them.
+    """
+    if set(services) >= set(list_service_lines()):
+        return cached_query("SELECT * FROM kpi_spc_monthly WHERE service_line = ? ORDER BY kpi, month", [CUBE_ALL])
+    counts = cached_query(
+        "SELECT month, kpi, SUM(numerator) AS numerator, SUM(denominator) AS denominator FROM kpi_spc_monthly "
+        f"WHERE service_line IN ({_in_list(services)}) GROUP BY month, kpi",
+        list(services),
+    )
+    return derive_spc(counts.assign(service_line=', '.join(services)))
+
+def sketch_summary(services, months=None):
+    """Approximate distinct patients and reporting-delay percentiles of a selection.
+
+    Merges the kpi_sketches rows of the selected service lines (and months;
+    None = all), so the non-additive figures need no rescan of the raw data.
+    Keys: 'distinct_patients', 'delay_events' and 'delay_p<N>' per DELAY_PERCENTILES.
+    """
+    where, params = f"service_line IN ({_in_list(services)})", list(services)
+    if months is not None:
+        where += f" AND month IN ({_in_list(months)})"
+        params.extend(months)
+    rows = cached_query(f"SELECT patients_hll, delay_kll FROM kpi_sketches WHERE {where}", params)
+    patients = merge_sketches(rows['patients_hll'], HyperLogLog)
+    delays = merge_sketches(rows['delay_kll'], KLLSketch) or KLLSketch()
+    summary = {"distinct_patients": round(patients.estimate()) if patients else 0, "delay_events": delays.n}
+    for q, value in zip(DELAY_PERCENTILES, delays.quantiles(DELAY_PERCENTILES)):
+        summary[f"delay_p{q * 100:g}"] = value
+    return summary
+
+# --- Facilities (federated over the facility shards, src/facilities.py) ---
+
+def list_facilities():
+    """Configured facilities whose shard has been built."""
+    return available_facilities()
+
+def facility_kpis(month):
+    """Per-facility KPI rows for one month plus a system-wide 'ALL' row.
+
+    Each shard's kpi_monthly_overall row comes from the federated UNION ALL;
+    the system row sums the measures across facilities and re-derives rates.
+    """
+    per_facility = cached_federated_query("SELECT * FROM {db}.kpi_monthly_overall WHERE month = ?", [month])
+    if per_facility.empty:
+        return per_facility
+    system = derive_kpi_rates(per_facility[KPI_COUNT_COLUMNS].sum().to_frame().T)
+    system.insert(0, 'facility', CUBE_ALL)
+    return pd.concat([per_facility.drop(columns='month'), system], ignore_index=True)
+
+# --- Medication Safety ---
+
+def _event_filter(services, event_types):
+    where = f"service_line IN ({_in_list(services)}) AND event_type IN ({_in_list(event_types)})"
+    return where, [*services, *event_types]
+
+def event_counts_by_type(services, event_types):
+    where, params = _event_filter(services, event_types)
+    return cached_query(
+        f"SELECT event_type, SUM(event_count) AS event_count FROM event_metrics_monthly WHERE {where} "
+        "GROUP BY event_type ORDER BY event_type",
+        params,
+    )
+
+def event_heatmap(services, event_types):
+    where, params = _event_filter(services, event_types)
+    return cached_query(
+        f"SELECT month, service_line, SUM(event_count) AS event_count FROM event_metrics_monthly WHERE {where} "
+        "GROUP BY month, service_line ORDER BY month, service_line",
+        params,
+    )
+
+def _event_metrics_query(services, event_types):
+    where, params = _event_filter(services, event_types)
+    return (f"SELECT month, service_line, event_type, event_count FROM event_metrics_monthly WHERE {where} "
+            "ORDER BY month, service_line, event_type"), params
+
+def event_metrics(services, event_types):
+    return cached_query(*_event_metrics_query(services, event_types))
+
+def event_metrics_csv(services, event_types):
+    """event_metrics as a CSV file, streamed from SQLite in chunks."""
+    return export_csv(*_event_metrics_query(services, event_types))
+
+def high_risk_trend(services):
+    return cached_query(
+        "SELECT month, service_line, high_risk_exposure_rate FROM kpi_monthly_service "
+        f"WHERE service_line IN ({_in_list(services)}) ORDER BY service_line, month",
+        list(services),
+    )
+
+# --- Compliance & Data Quality ---
+
+DELAY_BIN_ORDER = ["0-1", "2-3", "4-7", "8-14", "15-30", "31+"]
+
+def delay_bin_totals(services):
+    order = " ".join(f"WHEN '{label}' THEN {i}" for i, label in enumerate(DELAY_BIN_ORDER))
+    return cached_query(
+        f"SELECT delay_bin, SUM(count) AS count FROM reporting_delay_bins "
+        f"WHERE service_line IN ({_in_list(services)}) "
+        f"GROUP BY delay_bin ORDER BY CASE delay_bin {order} END",
+        list(services),
+    )
+
+AUDIT_COLUMNS = ['encounter_id', 'service_line', 'admit_date', 'med_orders_count', 'length_of_stay_days']
+# Indexed sort columns; encounter_id breaks ties so (sort value, encounter_id) is a unique cursor
+AUDIT_SORT_COLUMNS = ['admit_date', 'length_of_stay_days', 'med_orders_count']
+
+def _audit_filter(services=None, date_from=None, date_to=None):
+    """WHERE clause for the audit search: service lines and an inclusive admit-date range."""
+    clauses, params = ["1 = 1"], []
+    if services is not None:
+        clauses.append(f"service_line IN ({_in_list(services)})")
+        params.extend(services)
+    if date_from:
+        clauses.append("admit_date >= ?")
+        params.append(str(date_from))
+    if date_to:
+        clauses.append("admit_date <= ?")
+        params.append(str(date_to))
+    return " AND ".join(clauses), params
+
+def _audit_order(sort, descending):
+    if sort not in AUDIT_SORT_COLUMNS:
+        raise ValueError(f"Unknown audit sort column: {sort!r}")
+    direction = "DESC" if descending else "ASC"
+    return f"{sort} {direction}, encounter_id {direction}"
+
+def audit_date_range():
+    """(first, last) admit_date in the worklist, or (None, None) when it is empty."""
+    row = cached_query("SELECT MIN(admit_date) AS first, MAX(admit_date) AS last FROM audit_view").iloc[0]
+    return row['first'], row['last']
+
+def audit_count(services=None, date_from=None, date_to=None):
+    where, params = _audit_filter(services, date_from, date_to)
+    return int(cached_query(f"SELECT COUNT(*) AS n FROM audit_view WHERE {where}", params)['n'].iloc[0])
+
+def audit_page(services=None, date_from=None, date_to=None, sort='admit_date', descending=False,
+               after=None, limit=AUDIT_PAGE_SIZE):
+    """One keyset page of the audit worklist and the cursor of the next page.
+
+    `after` is the cursor returned with the previous page (None = first page).
+    Each page is a range scan of the sort column's index from the cursor, so
+    deep pages cost the same as the first. The next cursor is None on the
+    last page.
+    """
+    order = _audit_order(sort, descending)
+    where, params = _audit_filter(services, date_from, date_to)
+    if after is not None:
+        op = "<" if descending else ">"
+        where += f" AND ({sort}, encounter_id) {op} (?, ?)"
+        params.extend(after)
+    page = cached_query(
+        f"SELECT {', '.join(AUDIT_COLUMNS)} FROM audit_view WHERE {where} "
+        f"ORDER BY {order} LIMIT ?",
+        [*params, limit + 1],
+    )
+    if len(page) <= limit:
+        return page, None
+    page = page.iloc[:limit]
+    # Series.tolist() gives Python scalars, which sqlite3 binds natively (numpy ints are not)
+    return page, tuple(page[col].tolist()[-1] for col in (sort, 'encounter_id'))
+
+def _audit_snapshot_chunks(services=None, date_from=None, date_to=None, sort='admit_date', descending=False):
+    """The filtered worklist streamed from the build's columnar snapshot in chunks.
+
+    None when the build wasn't exported or the snapshot isn't stored in the
+    requested order (only ascending admit_date is), so the caller streams
+    SQLite instead.
+    """
+    if descending:
+        return None
+    # Imported on export only: pages don't load pyarrow
+    from src.columnar import iter_snapshot
+
+    filters = []
+    if services is not None:
+        filters.append(('service_line', 'in', list(services)))
+    if date_from:
+        filters.append(('admit_date', '>=', str(date_from)))
+    if date_to:
+        filters.append(('admit_date', '<=', str(date_to)))
+    return iter_snapshot("audit_view", current_build_version(), filters=filters, order=[sort, 'encounter_id'],
+                         chunk_rows=EXPORT_CHUNK_ROWS)
+
+def audit_export_csv(services=None, date_from=None, date_to=None, sort='admit_date', descending=False):
+    """Every audit column of the filtered worklist as a CSV file, EXPORT_CHUNK_ROWS rows at a time.
+
+    Streamed from the build's columnar snapshot when one was exported in
+    this order (filters pushed down), else from SQLite.
+    """
+    order = _audit_order(sort, descending)
+    chunks = _audit_snapshot_chunks(services, date_from, date_to, sort, descending)
+    if chunks is not None:
+        return spool_csv(chunks)
+    where, params = _audit_filter(services, date_from, date_to)
+    return export_csv(f"SELECT * FROM audit_view WHERE {where} ORDER BY {order}", params, EXPORT_CHUNK_ROWS)
+
+def data_quality_report():
+    return cached_query('SELECT * FROM data_quality_report ORDER BY table_name, "check"')
+
+# --- Pipeline Health ---
+# Metrics are written after builds as well as by standalone CLI runs, so these bypass the build-keyed cache
+
+def pipeline_runs(limit=PIPELINE_HEALTH_RUNS):
+    return run_query(
+        "SELECT * FROM (SELECT * FROM pipeline_runs ORDER BY started_at DESC LIMIT ?) ORDER BY started_at",
+        [limit],
+    )
+
+def pipeline_stage_history(limit=PIPELINE_HEALTH_RUNS):
+    """Stage metrics of the last `limit` runs, with rows/s where rows are known."""
+    return run_query(
+        """
+        SELECT r.started_at AS run_started_at, r.label, s.* ,
+               COALESCE(s.rows_out, s.rows_in) * 1.0 / NULLIF(s.wall_s, 0) AS rows_per_s
+        FROM pipeline_stage_metrics s
+        JOIN (SELECT run_id, started_at, label FROM pipeline_runs ORDER BY started_at DESC LIMIT ?) r
+          ON r.run_id = s.run_id
+        ORDER BY r.started_at, s.seq
+        """,
+        [limit],
+    )
@@ -0,0 +1,183 @@
+"""Declarative data quality rules, evaluated as one batched SQL pass per table.
+
+Each rule names its table and one of:
+  - "when":    a row predicate over the table (alias t) and its joined parent
+  - "unique":  a column that must not repeat
+  - "column" + "allowed": a column that must be non-null and in the list
+  - "column" + "dimension": a surrogate key that must be non-null and present in dim_<dimension>
+All rules of a table become SUM(CASE ...) terms of a single aggregate query,
+so every table is scanned once. Tables above DQ_SAMPLE_THRESHOLD_ROWS are
+checked on random blocks of consecutive rowids, each read as a rowid range
+search, so a sampled pass costs in proportion to the sample rather than the
+table; counts are scaled up by the sampled share. A sample cannot see
+duplicates that fall in different blocks, so "unique" rules of a sampled
+table are still checked on every row, as one ordered GROUP BY over the
+column's index.
+"""
+import time
+import numpy as np
+import pandas as pd
+from src.config import DQ_SAMPLE_THRESHOLD_ROWS, DQ_SAMPLE_RATE, DQ_SAMPLE_BLOCK_ROWS
+from src.instrumentation import instrumented, record_rows
+from src.sqlite_io import get_manager, bulk_load
+
+# FROM clause per table; {t} is the (possibly sampled) table, aliased t
+DQ_TABLE_SOURCES = {
+    "patients": "{t}",
+    "encounters": "{t} LEFT JOIN patients p ON p.patient_id = t.patient_id",
+    "med_orders": "{t} LEFT JOIN encounters e ON e.encounter_id = t.encounter_id",
+    "safety_events": "{t} LEFT JOIN encounters e ON e.encounter_id = t.encounter_id",
+}
+
+# severity "error" fails the quality gates; "warning" is reported only
+DQ_RULES = [
+    # patients
+    {"check": "Patients Duplicate IDs", "table": "patients", "unique": "patient_id", "severity": "error"},
+    {"check": "Patients Unknown Age Band", "table": "patients", "column": "age_band_key", "dimension": "age_band", "severity": "warning"},
+    {"check": "Patients Unknown Sex", "table": "patients", "column": "sex_key", "dimension": "sex", "severity": "warning"},
+    # encounters
+    {"check": "Encounters Duplicate IDs", "table": "encounters", "unique": "encounter_id", "severity": "error"},
+    {"check": "Encounters Orphans", "table": "encounters", "when": "p.patient_id IS NULL", "severity": "error"},
+    {"check": "Encounters Missing Dates", "table": "encounters",
+     "when": "t.admit_date IS NULL OR t.discharge_date IS NULL", "severity": "error"},
+    {"check": "Negative LOS", "table": "encounters", "when": "t.discharge_date < t.admit_date", "severity": "error"},
+    {"check": "Encounters Unknown Service Line", "table": "encounters", "column": "service_line_key", "dimension": "service_line", "severity": "warning"},
+    {"check": "Encounters Unknown Admission Type", "table": "encounters", "column": "admission_type_key", "dimension": "admission_type", "severity": "warning"},
+    {"check": "Encounters Unknown Facility", "table": "encounters", "column": "facility_key", "dimension": "facility", "severity": "warning"},
+    # med_orders
+    {"check": "Med Orders Duplicate IDs", "table": "med_orders", "unique": "med_order_id", "severity": "error"},
+    {"check": "Med Orders Orphans", "table": "med_orders", "when": "e.encounter_id IS NULL", "severity": "error"},
+    {"check": "Med Orders Outside Stay", "table": "med_orders",
+     "when": "e.encounter_id IS NOT NULL AND (t.order_date IS NULL OR t.order_date < e.admit_date OR t.order_date > e.discharge_date)",
+     "severity": "error"},
+    {"check": "Med Orders Unknown Class", "table": "med_orders", "column": "med_class_key", "dimension": "med_class", "severity": "warning"},
+    {"check": "Med Orders Invalid High-Risk Flag", "table": "med_orders", "column": "high_risk_flag", "allowed": [0, 1], "severity": "warning"},
+    # safety_events
+    {"check": "Safety Events Duplicate IDs", "table": "safety_events", "unique": "event_id", "severity": "error"},
+    {"check": "Safety Events Orphans", "table": "safety_events", "when": "e.encounter_id IS NULL", "severity": "error"},
+    {"check": "Safety Events Date Outside Stay", "table": "safety_events",
+     "when": "e.encounter_id IS NOT NULL AND (t.event_date IS NULL OR t.event_date < e.admit_date OR t.event_date > e.discharge_date)",
+     "severity": "error"},
+    {"check": "Safety Events Negative Report Delay", "table": "safety_events",
+     "when": "t.report_delay_days IS NULL OR t.report_delay_days < 0", "severity": "error"},
+    {"check": "Safety Events Unknown Type", "table": "safety_events", "column": "event_type_key", "dimension": "event_type", "severity": "warning"},
+    {"check": "Safety Events Unknown Severity", "table": "safety_events", "column": "severity_key", "dimension": "severity", "severity": "warning"},
+    {"check": "Safety Events Invalid Reported Flag", "table": "safety_events", "column": "reported_flag", "allowed": [0, 1], "severity": "warning"},
+]
+
+def _sql_literal(value):
+    return str(value) if isinstance(value, (int, float)) else "'" + str(value).replace("'", "''") + "'"
+
+def _violation_term(rule):
+    """Aggregate SQL counting one rule's violations."""
+    if "unique" in rule:
+        return f"COUNT(t.{rule['unique']}) - COUNT(DISTINCT t.{rule['unique']})"
+    if "dimension" in rule:
+        keys = f"SELECT {rule['dimension']}_key FROM dim_{rule['dimension']}"
+        predicate = f"t.{rule['column']} IS NULL OR t.{rule['column']} NOT IN ({keys})"
+    elif "allowed" in rule:
+        allowed = ", ".join(_sql_literal(v) for v in rule["allowed"])
+        predicate = f"t.{rule['column']} IS NULL OR t.{rule['column']} NOT IN ({allowed})"
+    else:
+        predicate = rule["when"]
+    return f"SUM(CASE WHEN {predicate} THEN 1 ELSE 0 END)"
+
+def _sample_blocks(conn, table, sample):
+    """None for a full pass, else random (first, last) rowid blocks covering ~DQ_SAMPLE_RATE of the table.
+
+    sample=None decides by table size. Returns (blocks, sampled share of the rowid span).
+    """
+    if sample is False:
+        return None, 1.0
+    # MIN/MAX(rowid) are O(log n); their span estimates the row count
+    first, last = conn.execute(f"SELECT MIN(rowid), MAX(rowid) FROM {table}").fetchone()
+    if first is None:
+        return None, 1.0
+    span = last - first + 1
+    if sample is None and span <= DQ_SAMPLE_THRESHOLD_ROWS:
+        return None, 1.0
+    n_grid = -(-span // DQ_SAMPLE_BLOCK_ROWS)
+    n_blocks = max(1, round(n_grid * DQ_SAMPLE_RATE))
+    if n_blocks >= n_grid:
+        return None, 1.0
+    starts = first + np.sort(np.random.default_rng().choice(n_grid, n_blocks, replace=False)) * DQ_SAMPLE_BLOCK_ROWS
+    return [(start, start + DQ_SAMPLE_BLOCK_ROWS - 1) for start in starts.tolist()], n_blocks / n_grid
+
+def _unique_violations(conn, table, column):
+    """(rows, repeated values) of a full pass, grouped in index order so no temp B-tree is built."""
+    rows = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    repeats = conn.execute(
+        f"SELECT COALESCE(SUM(n - 1), 0) FROM (SELECT COUNT(*) AS n FROM {table} "
+        f"WHERE {column} IS NOT NULL GROUP BY {column} HAVING n > 1)"
+    ).fetchone()[0]
+    return rows, repeats
+
+def _report_row(rule, count, rows_checked, rate, elapsed_ms):
+    failed_status = "FAIL" if rule["severity"] == "error" else "WARN"
+    return {
+        "check": rule["check"],
+        "table_name": rule["table"],
+        "severity": rule["severity"],
+        "status": "PASS" if count == 0 else failed_status,
+        "count": round(count / rate),
+        "rows_checked": rows_checked,
+        "sample_rate": rate,
+        "elapsed_ms": elapsed_ms,
+    }
+
+def evaluate_rules(conn, rules=None, sample=None):
+    """Runs the rules (one aggregate query per table) and returns the report rows.
+
+    sample: None = sample only tables above DQ_SAMPLE_THRESHOLD_ROWS,
+    True = sample every table, False = full pass everywhere. "unique" rules
+    always cover the full table.
+    """
+    rules = DQ_RULES if rules is None else rules
+    by_table = {}
+    for rule in rules:
+        by_table.setdefault(rule["table"], []).append(rule)
+
+    report = {}
+    for table, table_rules in by_table.items():
+        blocks, rate = _sample_blocks(conn, table, sample)
+        if blocks:
+            for rule in [r for r in table_rules if "unique" in r]:
+                started = time.perf_counter()
+                rows_checked, count = _unique_violations(conn, table, rule["unique"])
+                report[rule["check"]] = _report_row(rule, count, rows_checked, 1.0,
+                                                    (time.perf_counter() - started) * 1000)
+            table_rules = [r for r in table_rules if "unique" not in r]
+            if not table_rules:
+                continue
+            conn.execute("DROP TABLE IF EXISTS temp.dq_sample_blocks")
+            conn.execute("CREATE TEMP TABLE dq_sample_blocks (first INTEGER, last INTEGER)")
+            with conn:
+                conn.executemany("INSERT INTO temp.dq_sample_blocks VALUES (?, ?)", blocks)
+            # One rowid range search per block
+            source = (f"(SELECT s.* FROM temp.dq_sample_blocks b CROSS JOIN {table} s "
+                      f"ON s.rowid BETWEEN b.first AND b.last) t")
+        else:
+            source = f"{table} t"
+        terms = ",\n".join(f"COALESCE({_violation_term(rule)}, 0)" for rule in table_rules)
+        started = time.perf_counter()
+        row = conn.execute(
+            f"SELECT COUNT(*),\n{terms}\nFROM {DQ_TABLE_SOURCES[table].format(t=source)}"
+        ).fetchone()
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if blocks:
+            conn.execute("DROP TABLE temp.dq_sample_blocks")
+        rows_checked, counts = row[0], row[1:]
+        for rule, count in zip(table_rules, counts):
+            report[rule["check"]] = _report_row(rule, count, rows_checked, rate, elapsed_ms)
+    return pd.DataFrame([report[rule["check"]] for rule in rules])
+
+@instrumented
+def run_data_quality_checks(sample=None):
+    """Evaluates every rule and refills data_quality_report; returns the report."""
+    with get_manager().writer() as conn:
+        report = evaluate_rules(conn, sample=sample)
+        bulk_load(conn, {"data_quality_report": report})
+    record_rows(rows_in=report.groupby("table_name")["rows_checked"].first().sum(), rows_out=len(report))
+    failed = report[report["status"] != "PASS"]
+    print(f"Data quality: {len(report)} rules, {len(failed)} not passing.")
+    return report
@@ -0,0 +1,46 @@
+"""Integer-coded categorical columns and their dim_<name> lookup tables.
+
+Raw tables and encounter_facts store each categorical column as <name>_key,
+an integer surrogate key whose label lives in dim_<name> (key = position in
+config.DIMENSIONS). decode() turns loaded keys straight into pd.Categorical
+columns, whose codes are the keys, so no per-row strings are built; encode()
+is its inverse for writes. Keys outside the dimension decode to missing.
+"""
+import numpy as np
+import pandas as pd
+from src.config import DIMENSIONS
+
+def key_column(dim):
+    return f"{dim}_key"
+
+def dim_key(dim, label):
+    """Surrogate key of one label, e.g. for a SQL literal."""
+    return DIMENSIONS[dim].index(label)
+
+def seed_dimensions(conn):
+    """Refills every dim_<name> table from config.DIMENSIONS (no commit)."""
+    for dim, labels in DIMENSIONS.items():
+        conn.execute(f"DELETE FROM dim_{dim}")
+        conn.executemany(f"INSERT INTO dim_{dim} ({key_column(dim)}, {dim}) VALUES (?, ?)", enumerate(labels))
+
+def decode(df):
+    """Replaces each <name>_key column of `df` with a Categorical <name> column (in place)."""
+    for dim, labels in DIMENSIONS.items():
+        col = key_column(dim)
+        if col not in df.columns:
+            continue
+        keys = pd.to_numeric(df[col], errors="coerce").fillna(-1).to_numpy(dtype=np.int64)
+        codes = np.where((keys >= 0) & (keys < len(labels)), keys, -1)
+        df[col] = pd.Categorical.from_codes(codes, categories=labels)
+        df.rename(columns={col: dim}, inplace=True)
+    return df
+
+def encode(df):
+    """Inverse of decode: Categorical <name> columns back to <name>_key (missing -> NULL)."""
+    for dim, labels in DIMENSIONS.items():
+        if dim not in df.columns or not isinstance(df[dim].dtype, pd.CategoricalDtype):
+            continue
+        codes = df[dim].cat.set_categories(labels).cat.codes.to_numpy(dtype=np.int64)
+        df[dim] = codes if (codes >= 0).all() else pd.Series(codes, index=df.index, dtype=object).where(codes >= 0, None)
+        df.rename(columns={dim: key_column(dim)}, inplace=True)
+    return df
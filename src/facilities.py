@@ -0,0 +1,127 @@
+"""Multi-facility builds: one SQLite shard per facility, built in parallel.
+
+Every facility in FACILITIES has its own database (facility_db_path) with
+the full schema, generated from a seed derived from the run seed and the
+facility name; its encounters carry the facility's dim_facility key.
+Shards are independent, so build_facilities runs one process per facility
+(up to FACILITY_BUILD_WORKERS at a time) and any facility can be rebuilt on
+its own. A full build writes a scratch file next to the shard and renames
+it over the shard only when the quality gates pass, like the background
+rebuild. Each build's pipeline metrics are recorded in its own shard; the
+orchestrating process writes to no database. System-wide views union the
+shards' KPI tables through sqlite_io.federated_query.
+"""
+import argparse
+import multiprocessing
+import os
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+import numpy as np
+from src.config import (
+    FACILITIES, FACILITY_BUILD_WORKERS, RANDOM_SEED, TARGET_N_PATIENTS, TARGET_N_ENCOUNTERS, DIMENSIONS
+)
+from src.instrumentation import pipeline_run
+from src.sqlite_io import facility_db_path, use_db, release_db
+
+def facility_seed(seed, facility):
+    """Seed of one facility's data, stable under adding or reordering facilities."""
+    sequence = np.random.SeedSequence(seed, spawn_key=(zlib.crc32(facility.encode("utf-8")),))
+    return int(sequence.generate_state(1)[0])
+
+def _remove_db_files(path, suffixes=("", "-wal", "-shm")):
+    for suffix in suffixes:
+        Path(f"{path}{suffix}").unlink(missing_ok=True)
+
+def _build_facility(facility, n_patients, n_encounters, seed, engine, generate, incremental):
+    """Worker: builds one facility shard in this process and returns a summary dict.
+
+    With `generate` the shard is regenerated into a scratch file and swapped
+    in when the gates pass; otherwise the pipeline runs in place on the
+    shard's raw tables (optionally incrementally).
+    """
+    # Imported here: spawned workers import only what the build needs
+    from src.sqlite_io import init_db
+    from src.generate_data import run_data_generation
+    from src.build_facts_kpis import run_pipeline
+    from src.quality_checks import run_quality_gates
+
+    path = facility_db_path(facility)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    target = path.with_name(f".{path.stem}.rebuild{path.suffix}") if generate else path
+    if generate:
+        _remove_db_files(target)
+    elif not path.exists():
+        raise FileNotFoundError(f"Facility {facility!r} has no shard at {path}; build it with generation first")
+
+    started = time.perf_counter()
+    passed = False
+    try:
+        with use_db(target), pipeline_run(f"facility_build:{facility}"):
+            if generate:
+                init_db()
+                run_data_generation(n_patients, n_encounters, facility_seed(seed, facility), facility=facility)
+            run_pipeline(engine, incremental=incremental)
+            passed = run_quality_gates()
+    finally:
+        release_db(target)
+        if generate and not passed:
+            _remove_db_files(target)
+    if generate and passed:
+        # release_db left the scratch file self-contained; stale -wal/-shm of the old shard must go
+        _remove_db_files(path, ("-wal", "-shm"))
+        os.replace(target, path)
+    return {"facility": facility, "passed": passed, "wall_s": time.perf_counter() - started}
+
+def build_facilities(facilities=None, n_patients=None, n_encounters=None, seed=None, engine=None,
+                     workers=None, generate=True, incremental=False):
+    """Builds the facility shards in parallel, one process per facility.
+
+    Sizes are per facility. Returns {facility: summary}; a facility whose
+    gates fail keeps its previous shard and does not stop the others.
+    """
+    facilities = list(FACILITIES if facilities is None else facilities)
+    if not facilities:
+        raise ValueError("No facilities to build (set CQM_FACILITIES or pass --facilities)")
+    unknown = [f for f in facilities if f not in DIMENSIONS["facility"]]
+    if unknown:
+        # Shards store dim_facility keys, so every facility must be declared
+        raise ValueError(f"Facilities not in CQM_FACILITIES: {', '.join(unknown)}")
+    n_patients = TARGET_N_PATIENTS if n_patients is None else n_patients
+    n_encounters = TARGET_N_ENCOUNTERS if n_encounters is None else n_encounters
+    seed = RANDOM_SEED if seed is None else seed
+    workers = min(workers or FACILITY_BUILD_WORKERS, len(facilities))
+    print(f"Building {len(facilities)} facility shards ({workers} workers)...")
+
+    results = {}
+    # spawn: workers must not inherit the parent's open SQLite connections
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = {
+            pool.submit(_build_facility, facility, n_patients, n_encounters, seed, engine, generate, incremental): facility
+            for facility in facilities
+        }
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {"facility": futures[future], "passed": False, "error": str(e)}
+            results[result["facility"]] = result
+            detail = f"{result['wall_s']:.1f}s" if "wall_s" in result else result.get("error", "")
+            print(f"  {result['facility']}: {'PASS' if result['passed'] else 'FAILED'} ({detail})")
+    failed = [f for f, r in results.items() if not r["passed"]]
+    print(f"Facility shards built: {len(results) - len(failed)} passed" + (f", failed: {', '.join(failed)}" if failed else "."))
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate and build one SQLite shard per facility, in parallel.")
+    parser.add_argument("--facilities", default=None, help="Comma-separated facility codes (default: CQM_FACILITIES)")
+    parser.add_argument("--patients", type=int, default=TARGET_N_PATIENTS, help="Patients per facility")
+    parser.add_argument("--encounters", type=int, default=TARGET_N_ENCOUNTERS, help="Encounters per facility")
+    parser.add_argument("--seed", type=int, default=RANDOM_SEED)
+    parser.add_argument("--engine", choices=["pandas", "sql"], default=None)
+    parser.add_argument("--workers", type=int, default=FACILITY_BUILD_WORKERS, help="Facilities built at once")
+    args = parser.parse_args()
+    facilities = args.facilities.split(",") if args.facilities else None
+    results = build_facilities(facilities, args.patients, args.encounters, args.seed, args.engine, args.workers)
+    raise SystemExit(0 if all(r["passed"] for r in results.values()) else 1)
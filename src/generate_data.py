@@ -1,145 +1,319 @@
+import argparse
+import multiprocessing
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import pandas as pd
 import numpy as np
-import uuid
-import random
+from pathlib import Path
 from src.config import (
-    SERVICE_LINES, ADMISSION_TYPES, MED_CLASSES, EVENT_TYPES, SEVERITIES,
-    TARGET_N_PATIENTS, TARGET_N_ENCOUNTERS, START_DATE, END_DATE, RANDOM_SEED, DB_PATH
+    SERVICE_LINES, ADMISSION_TYPES, MED_CLASSES, EVENT_TYPES, SEVERITIES, AGE_BANDS, SEXES,
+    TARGET_N_PATIENTS, TARGET_N_ENCOUNTERS, START_DATE, END_DATE, RANDOM_SEED,
+    GENERATION_CHUNK_PATIENTS, GENERATION_WORKERS, SQLITE_BULK_PRAGMAS, DEFAULT_FACILITY
+)
+from src.dimensions import dim_key
+from src.instrumentation import instrumented, pipeline_run, record_rows
+from src.sqlite_io import (
+    init_db, insert_dataframe, disable_change_capture, get_manager, open_connection,
+    drop_secondary_indexes, restore_indexes
 )
-from src.sqlite_io import init_db
-import sqlite3
 
-np.random.seed(RANDOM_SEED)
-random.seed(RANDOM_SEED)
+# Distributions (kept identical to the original row-by-row generator; aligned with the config lists)
+AGE_BAND_P = [0.3, 0.4, 0.3]
+SEX_P = [0.5, 0.45, 0.05]
+ADMISSION_TYPE_P = [0.4, 0.4, 0.2]
+SEVERITY_P = [0.6, 0.3, 0.1]  # 10% severe
+HIGH_RISK_CLASSES = ["Opioid", "Anticoagulant", "Insulin", "Sedative"]
+MAX_MEDS_PER_ENCOUNTER = 8
+EVENT_RATE = 0.15
+ON_TIME_SHARE = 0.6
+REPORTED_SHARE = 0.9
 
-import pandas as pd
-import numpy as np
-import uuid
-import random
-from src.config import (
-    SERVICE_LINES, ADMISSION_TYPES, MED_CLASSES, EVENT_TYPES, SEVERITIES,
-    TARGET_N_PATIENTS, TARGET_N_ENCOUNTERS, START_DATE, END_DATE, RANDOM_SEED, DB_PATH
-)
-from src.sqlite_io import init_db
-import sqlite3
-
-np.random.seed(RANDOM_SEED)
-random.seed(RANDOM_SEED)
-
-def generate_patients(n=TARGET_N_PATIENTS):
-    data = []
-    for _ in range(n):
-        pid = f"P-{str(uuid.uuid4())[:8]}"
-        age = np.random.choice(["18-39", "40-64", "65+"], p=[0.3, 0.4, 0.3])
-        sex = np.random.choice(["F", "M", "Unknown"], p=[0.5, 0.45, 0.05])
-        data.append((pid, age, sex))
-    return pd.DataFrame(data, columns=["patient_id", "age_band", "sex"])
-
-def generate_encounters(patients_df, n=TARGET_N_ENCOUNTERS):
-    data = []
-    patient_ids = patients_df["patient_id"].values
-    dates = pd.date_range(START_DATE, END_DATE).to_series()
-    
-    for _ in range(n):
-        eid = f"E-{str(uuid.uuid4())[:8]}"
-        pid = np.random.choice(patient_ids)
-        svc = np.random.choice(SERVICE_LINES)
-        adm_type = np.random.choice(ADMISSION_TYPES, p=[0.4, 0.4, 0.2])
-        
-        admit = dates.sample(1).iloc[0]
-        los = int(np.random.gamma(shape=2, scale=3)) + 1 
-        discharge = admit + pd.Timedelta(days=los)
-        
-        data.append((eid, pid, svc, adm_type, admit.date(), discharge.date()))
-        
-    return pd.DataFrame(data, columns=["encounter_id", "patient_id", "service_line", "admission_type", "admit_date", "discharge_date"])
-
-def generate_med_orders(encounters_df):
-    data = []
-    # High risk classes
-    high_risk_classes = ["Opioid", "Anticoagulant", "Insulin", "Sedative"]
-    
-    for _, row in encounters_df.iterrows():
-        eid = row["encounter_id"]
-        # Random number of meds per encounter (0 to 8)
-        n_meds = np.random.randint(0, 9)
-        
-        for _ in range(n_meds):
-            mid = f"M-{str(uuid.uuid4())[:8]}"
-            mclass = np.random.choice(MED_CLASSES)
-            
-            # High risk logic: if class is in high_risk_classes, flag=1 logic with high prob, 
-            # but to be simple we just define the flag by the class logic strictly or with noise.
-            # Let's say: High Risk Class always = High Risk Flag for simplicity of metrics,
-            # or maybe 90% chance. Let's make it deterministic for clarity.
-            is_high_risk = 1 if mclass in high_risk_classes else 0
-            
-            # Order date between admit and discharge
-            # approximate by admit date
-            odate = row["admit_date"]
-            
-            data.append((mid, eid, mclass, is_high_risk, odate))
-            
-    return pd.DataFrame(data, columns=["med_order_id", "encounter_id", "med_class", "high_risk_flag", "order_date"])
-
-def generate_safety_events(encounters_df, med_orders_df):
-    data = []
-    # Event rate: say 10% of encounters have an event
-    n_encounters = len(encounters_df)
-    n_events = int(n_encounters * 0.15) # 15% rate
-    
-    target_encounters = encounters_df.sample(n_events)
-    
-    for _, row in target_encounters.iterrows():
-        ev_id = f"EV-{str(uuid.uuid4())[:8]}"
-        eid = row["encounter_id"]
-        
-        ev_type = np.random.choice(EVENT_TYPES)
-        
-        # Severity distribution
-        severity = np.random.choice(SEVERITIES, p=[0.6, 0.3, 0.1]) # 10% severe
-        
-        # Reporting Delay
-        # 60% on time (<=7), 40% late (>7)
-        if np.random.random() < 0.6:
-            delay = np.random.randint(0, 8)
-        else:
-            delay = np.random.randint(8, 45)
-            
-        # Reported flag (Compliance)
-        # 90% reported
-        reported = 1 if np.random.random() < 0.9 else 0
-        
-        # Event date
-        ev_date = row["discharge_date"] # Simplified: detected at discharge/post-discharge usually
-        
-        data.append((ev_id, eid, ev_type, severity, delay, reported, ev_date))
-        
-    return pd.DataFrame(data, columns=["event_id", "encounter_id", "event_type", "severity", "report_delay_days", "reported_flag", "event_date"])
-
-def run_data_generation():
-    print("Generating synthetic data...")
-    patients_df = generate_patients()
-    encounters_df = generate_encounters(patients_df)
-    med_orders_df = generate_med_orders(encounters_df)
-    safety_events_df = generate_safety_events(encounters_df, med_orders_df)
-    
-    print(f"Generated: {len(patients_df)} Patients, {len(encounters_df)} Encounters, {len(med_orders_df)} MedOrders, {len(safety_events_df)} Events.")
-    
-    # Save to DB
-    conn = sqlite3.connect(DB_PATH)
-    # Use replace to ensure fresh data on rebuild
-    patients_df.to_sql("patients", conn, if_exists="replace", index=False)
-    encounters_df.to_sql("encounters", conn, if_exists="replace", index=False)
-    med_orders_df.to_sql("med_orders", conn, if_exists="replace", index=False)
-    safety_events_df.to_sql("safety_events", conn, if_exists="replace", index=False)
-    conn.close()
+# Raw tables in load order (parents first)
+RAW_TABLES = ["patients", "encounters", "med_orders", "safety_events"]
+
+
+def make_rng(seed=None):
+    """Returns a seeded numpy Generator (defaults to RANDOM_SEED)."""
+    return np.random.default_rng(RANDOM_SEED if seed is None else seed)
+
+
+def _draw(rng, labels, n, p=None):
+    """Draws n surrogate keys (positions in `labels`, see config.DIMENSIONS); no strings are created."""
+    return rng.choice(len(labels), size=n, p=p)
+
+
+def _date_labels(day_offsets, first_day):
+    """Maps day offsets to 'YYYY-MM-DD' (the format SQLite stores) via a small lookup table."""
+    labels = np.datetime_as_string(first_day + np.arange(day_offsets.max(initial=0) + 1), unit="D")
+    return pd.Categorical.from_codes(day_offsets, categories=labels)
+
+
+def generate_patients(n=TARGET_N_PATIENTS, rng=None, start=0):
+    rng = rng if rng is not None else make_rng()
+    return pd.DataFrame({
+        "patient_id": np.arange(start, start + n),
+        "age_band_key": _draw(rng, AGE_BANDS, n, AGE_BAND_P),
+        "sex_key": _draw(rng, SEXES, n, SEX_P),
+    })
+
+
+def generate_encounters(patients_df, n=TARGET_N_ENCOUNTERS, rng=None, start=0, facility_key=0):
+    """Draws n encounters for the given patients, all at one facility.
+
+    Encounter IDs are global sequence numbers (also the frame index); med
+    orders and safety events derive their IDs from them.
+    """
+    rng = rng if rng is not None else make_rng()
+    patient_ids = patients_df["patient_id"].to_numpy()
+    first_day = np.datetime64(START_DATE, "D")
+    n_days = (np.datetime64(END_DATE, "D") - first_day).astype(int) + 1
+
+    admit = rng.integers(0, n_days, size=n)
+    los = rng.gamma(shape=2, scale=3, size=n).astype(np.int64) + 1
+
+    seq = np.arange(start, start + n)
+    return pd.DataFrame({
+        "encounter_id": seq,
+        "patient_id": patient_ids[rng.integers(0, len(patient_ids), size=n)],
+        "service_line_key": _draw(rng, SERVICE_LINES, n),
+        "admission_type_key": _draw(rng, ADMISSION_TYPES, n, ADMISSION_TYPE_P),
+        "admit_date": _date_labels(admit, first_day),
+        "discharge_date": _date_labels(admit + los, first_day),
+        "facility_key": np.full(n, facility_key, dtype=np.int64),
+    }, index=pd.RangeIndex(start, start + n))
+
+
+def generate_med_orders(encounters_df, rng=None):
+    rng = rng if rng is not None else make_rng()
+    # Random number of meds per encounter (0 to 8)
+    n_meds = rng.integers(0, MAX_MEDS_PER_ENCOUNTER + 1, size=len(encounters_df))
+    enc_pos = np.repeat(np.arange(len(encounters_df)), n_meds)
+    # Position of each order within its encounter (0..n_meds-1)
+    within = np.arange(len(enc_pos)) - np.repeat(np.cumsum(n_meds) - n_meds, n_meds)
+    enc_seq = encounters_df.index.to_numpy()[enc_pos]
+
+    med_class = _draw(rng, MED_CLASSES, len(enc_pos))
+    # High Risk Class always = High Risk Flag for simplicity of metrics
+    is_high_risk = np.isin(MED_CLASSES, HIGH_RISK_CLASSES).astype(np.int64)
+
+    return pd.DataFrame({
+        "med_order_id": enc_seq * MAX_MEDS_PER_ENCOUNTER + within,
+        "encounter_id": enc_seq,
+        "med_class_key": med_class,
+        "high_risk_flag": is_high_risk[med_class],
+        # Order date approximated by admit date
+        "order_date": encounters_df["admit_date"].take(enc_pos).array,
+    })
+
+
+def generate_safety_events(encounters_df, rng=None):
+    rng = rng if rng is not None else make_rng()
+    n_events = int(len(encounters_df) * EVENT_RATE)  # 15% rate
+    # At most one event per encounter, so events reuse the encounter sequence number
+    pos = np.sort(rng.choice(len(encounters_df), size=n_events, replace=False))
+
+    # Reporting Delay: 60% on time (<=7), 40% late (>7)
+    on_time = rng.random(n_events) < ON_TIME_SHARE
+    delay = np.where(on_time, rng.integers(0, 8, size=n_events), rng.integers(8, 45, size=n_events))
+    # Reported flag (Compliance): 90% reported
+    reported = (rng.random(n_events) < REPORTED_SHARE).astype(np.int64)
+
+    return pd.DataFrame({
+        "event_id": encounters_df.index.to_numpy()[pos],
+        "encounter_id": encounters_df.index.to_numpy()[pos],
+        "event_type_key": _draw(rng, EVENT_TYPES, n_events),
+        "severity_key": _draw(rng, SEVERITIES, n_events, SEVERITY_P),
+        "report_delay_days": delay,
+        "reported_flag": reported,
+        # Simplified: detected at discharge/post-discharge usually
+        "event_date": encounters_df["discharge_date"].take(pos).array,
+    })
+
+
+def chunk_rng(seed, chunk_idx):
+    """Independent Generator for one chunk, derived from (seed, chunk index)."""
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(chunk_idx,)))
+
+
+def chunk_bounds(n_patients, n_encounters, chunk_size, chunk_idx):
+    """Patient and encounter sequence ranges covered by one chunk."""
+    p0 = chunk_idx * chunk_size
+    p1 = min(p0 + chunk_size, n_patients)
+    # Encounters are split in proportion to patients so every chunk is self-contained
+    return (p0, p1), (n_encounters * p0 // n_patients, n_encounters * p1 // n_patients)
+
+
+def iter_generation_chunks(n_patients, n_encounters, seed=RANDOM_SEED,
+                           chunk_size=GENERATION_CHUNK_PATIENTS, chunks=None, facility_key=0):
+    """Yields dicts of raw-table DataFrames, one fixed-size slice of patients at a time.
+
+    Each chunk holds a block of patients together with their encounters, med
+    orders and safety events, drawn from its own (seed, chunk) Generator, so only
+    one chunk is ever in memory. `chunks` restricts generation to a range of
+    chunk indices; every encounter is at facility `facility_key`.
+    """
+    n_chunks = -(-n_patients // chunk_size)
+    for idx in (range(n_chunks) if chunks is None else chunks):
+        (p0, p1), (e0, e1) = chunk_bounds(n_patients, n_encounters, chunk_size, idx)
+        rng = chunk_rng(seed, idx)
+        patients_df = generate_patients(p1 - p0, rng, start=p0)
+        encounters_df = generate_encounters(patients_df, e1 - e0, rng, start=e0, facility_key=facility_key)
+        med_orders_df = generate_med_orders(encounters_df, rng)
+        safety_events_df = generate_safety_events(encounters_df, rng)
+        yield {
+            "patients": patients_df,
+            "encounters": encounters_df,
+            "med_orders": med_orders_df,
+            "safety_events": safety_events_df,
+        }
+
+
+def write_chunk(conn, chunk):
+    """Inserts one chunk into the declared raw tables in its own transaction."""
+    with conn:
+        return {table: insert_dataframe(conn, table, chunk[table]) for table in RAW_TABLES}
+
+
+def _generate_shard(shard_path, table_ddl, n_patients, n_encounters, seed, chunk_size, chunks, facility_key):
+    """Worker: generates a contiguous range of chunks into its own SQLite file."""
+    conn = open_connection(shard_path, SQLITE_BULK_PRAGMAS)
+    try:
+        conn.executescript(";\n".join(table_ddl))
+        totals = dict.fromkeys(RAW_TABLES, 0)
+        for chunk in iter_generation_chunks(n_patients, n_encounters, seed, chunk_size, chunks, facility_key):
+            for table, n in write_chunk(conn, chunk).items():
+                totals[table] += n
+    finally:
+        conn.close()
+    return totals
+
+
+def _merge_shard(conn, shard_path):
+    """Appends one shard's rows to the main DB in a single transaction."""
+    conn.execute("ATTACH DATABASE ? AS shard", (str(shard_path),))
+    try:
+        with conn:
+            for table in RAW_TABLES:
+                conn.execute(f"INSERT INTO main.{table} SELECT * FROM shard.{table}")
+    finally:
+        conn.execute("DETACH DATABASE shard")
+
+
+def _run_sharded(conn, n_patients, n_encounters, seed, chunk_size, workers, on_rows, facility_key):
+    """Generates shards on a process pool and merges them in shard order.
+
+    Each chunk's Generator is derived from (seed, chunk index) and shards are
+    contiguous chunk ranges merged in order, so the resulting DB is identical
+    for a given seed whatever the shard count. Workers are spawned, and a
+    spawned process re-imports the caller's main script: scripts must call
+    this under `if __name__ == "__main__":`.
+    """
+    n_chunks = -(-n_patients // chunk_size)
+    shards = [range(c[0], c[-1] + 1) for c in np.array_split(np.arange(n_chunks), workers) if len(c)]
+    table_ddl = [conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (t,)).fetchone()[0]
+                 for t in RAW_TABLES]
+
+    tmp_dir = Path(tempfile.mkdtemp(prefix=".shards-", dir=get_manager().db_path.parent))
+    try:
+        paths = [tmp_dir / f"shard_{i:03d}.db" for i in range(len(shards))]
+        # spawn: workers must not inherit the parent's open SQLite connections
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            futures = [
+                pool.submit(_generate_shard, str(path), table_ddl, n_patients, n_encounters, seed, chunk_size, chunks,
+                            facility_key)
+                for path, chunks in zip(paths, shards)
+            ]
+            # Merge as shards complete, but always in shard order
+            for path, future in zip(paths, futures):
+                shard_totals = future.result()
+                _merge_shard(conn, path)
+                path.unlink()
+                on_rows(shard_totals)
+    except BrokenProcessPool as exc:
+        raise RuntimeError(
+            "A generation worker died. Workers are spawned and re-import the main script, so a script that "
+            "generates with workers > 1 must do it under `if __name__ == \"__main__\":`"
+        ) from exc
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+@instrumented
+def run_data_generation(n_patients=None, n_encounters=None, seed=None, chunk_size=None, progress=None, workers=None,
+                        facility=None):
+    """Streams synthetic data for one facility (default DEFAULT_FACILITY) into SQLite chunk by chunk.
+
+    Peak memory is bounded by `chunk_size` patients regardless of the total
+    size. With `workers` > 1 the chunks are generated in parallel shards (one
+    spawned process each, see _run_sharded) and merged into the DB. `progress`, if given, is called with
+    (rows_done, rows_per_second) after each chunk or shard.
+    """
+    n_patients = TARGET_N_PATIENTS if n_patients is None else n_patients
+    n_encounters = TARGET_N_ENCOUNTERS if n_encounters is None else n_encounters
+    seed = RANDOM_SEED if seed is None else seed
+    chunk_size = chunk_size or GENERATION_CHUNK_PATIENTS
+    workers = workers or GENERATION_WORKERS
+    facility_key = dim_key("facility", facility or DEFAULT_FACILITY)
+    print("Generating synthetic data..." + (f" ({workers} workers)" if workers > 1 else ""))
+
+    totals = dict.fromkeys(RAW_TABLES, 0)
+    started = time.perf_counter()
+
+    def on_rows(counts):
+        for table, n in counts.items():
+            totals[table] += n
+        rows = sum(totals.values())
+        rate = rows / max(time.perf_counter() - started, 1e-9)
+        print(f"  {totals['encounters']:,}/{n_encounters:,} encounters, {rows:,} rows ({rate:,.0f} rows/s)")
+        if progress:
+            progress(rows, rate)
+
+    with get_manager().writer() as conn:
+        # Fresh data on rebuild, while keeping the declared schema (keys) intact.
+        # Bulk loads bypass change capture; the next full pipeline run re-enables it.
+        disable_change_capture(conn)
+        # Secondary indexes are dropped for the load and rebuilt once at the end.
+        with conn:
+            index_ddl = drop_secondary_indexes(conn, RAW_TABLES)
+            for table in reversed(RAW_TABLES):
+                conn.execute(f"DELETE FROM {table}")
+
+        try:
+            if workers > 1:
+                _run_sharded(conn, n_patients, n_encounters, seed, chunk_size, workers, on_rows, facility_key)
+            else:
+                for chunk in iter_generation_chunks(n_patients, n_encounters, seed, chunk_size, facility_key=facility_key):
+                    on_rows(write_chunk(conn, chunk))
+        finally:
+            with conn:
+                restore_indexes(conn, index_ddl)
+
+    print(f"Generated: {totals['patients']} Patients, {totals['encounters']} Encounters, {totals['med_orders']} MedOrders, {totals['safety_events']} Events "
+          f"in {time.perf_counter() - started:.1f}s.")
     print("Data inserted into SQLite.")
+    record_rows(rows_out=sum(totals.values()))
+    return totals
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate synthetic clinical data into SQLite.")
+    parser.add_argument("--patients", type=int, default=TARGET_N_PATIENTS)
+    parser.add_argument("--encounters", type=int, default=TARGET_N_ENCOUNTERS)
+    parser.add_argument("--seed", type=int, default=RANDOM_SEED)
+    parser.add_argument("--chunk-size", type=int, default=GENERATION_CHUNK_PATIENTS,
+                        help="Patients per chunk (bounds peak memory)")
+    parser.add_argument("--workers", type=int, default=GENERATION_WORKERS,
+                        help="Worker processes for sharded generation")
+    parser.add_argument("--facility", default=DEFAULT_FACILITY, help="Facility of the generated encounters")
+    return parser.parse_args(argv)
 
-if __name__ == "__main__":
-    init_db()
-    run_data_generation()
 
 if __name__ == "__main__":
-    init_db()
-    run_data_generation()
+    args = parse_args()
+    with pipeline_run("generate_data"):
+        init_db()
+        run_data_generation(args.patients, args.encounters, args.seed, args.chunk_size, workers=args.workers,
+                            facility=args.facility)
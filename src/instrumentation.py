@@ -0,0 +1,197 @@
+"""Per-stage pipeline metrics, persisted to pipeline_runs / pipeline_stage_metrics.
+
+Stages are functions decorated with @instrumented. Each records wall time,
+CPU time, peak RSS, rows in/out (via record_rows) and the bytes the process
+sent to storage while it ran (mostly the DB and its WAL; worker processes'
+writes are not included). Stages called inside pipeline_run() belong to that
+run; a stage called on its own (e.g. from a CLI) opens a run of its own. With PROFILE_DIR
+set every stage is also profiled to <PROFILE_DIR>/<run_id>/<seq>_<stage>.prof;
+a stage's profile excludes the instrumented stages nested in it.
+"""
+import contextvars
+import cProfile
+import functools
+import os
+import resource
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+import pandas as pd
+from src.config import METRICS_SCHEMA_PATH, PROFILE_DIR
+
+def rss_bytes():
+    """Current resident set size (falls back to the process peak off Linux)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        scale = 1 if sys.platform == "darwin" else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+class PeakRSS:
+    """Samples RSS on a background thread to catch the peak inside a block."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = rss_bytes()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, rss_bytes())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, rss_bytes())
+
+def storage_bytes_written():
+    """Bytes this process has sent to storage so far (/proc/self/io write_bytes; None off Linux).
+
+    Counted as pages are dirtied, so rewrites in place count as much as
+    growth: DB and WAL pages, checkpoints, and any other file a stage writes.
+    """
+    try:
+        with open("/proc/self/io") as f:
+            return int(next(line for line in f if line.startswith("write_bytes:")).split()[1])
+    except (OSError, StopIteration):
+        return None
+
+def _bytes_written_since(before):
+    after = storage_bytes_written()
+    return None if before is None or after is None else after - before
+
+class _Run:
+    def __init__(self, label):
+        self.run_id = uuid.uuid4().hex
+        self.label = label
+        self.stages = []
+        self.profiler = None  # profiler of the innermost profiled stage
+
+_current_run = contextvars.ContextVar("pipeline_run", default=None)
+_current_stage = contextvars.ContextVar("pipeline_stage", default=None)
+
+def _now():
+    return pd.Timestamp.now().isoformat(timespec="seconds")
+
+@contextmanager
+def pipeline_run(label):
+    """Groups the stages run inside the block into one pipeline_runs row."""
+    if _current_run.get() is not None:
+        yield _current_run.get()
+        return
+    run = _Run(label)
+    token = _current_run.set(run)
+    started_at, wall, cpu, written = _now(), time.perf_counter(), time.process_time(), storage_bytes_written()
+    status = "failed"
+    try:
+        with PeakRSS() as rss:
+            yield run
+        status = "ok"
+    finally:
+        _current_run.reset(token)
+        _persist(run, {
+            "run_id": run.run_id,
+            "label": label,
+            "started_at": started_at,
+            "finished_at": _now(),
+            "status": status,
+            "wall_s": time.perf_counter() - wall,
+            "cpu_s": time.process_time() - cpu,
+            "peak_rss_mb": rss.peak / 2**20,
+            "db_bytes_written": _bytes_written_since(written),
+        })
+
+@contextmanager
+def stage(name):
+    """Measures one stage of the current run (opening a run if there is none)."""
+    run = _current_run.get()
+    if run is None:
+        with pipeline_run(name), stage(name) as record:
+            yield record
+        return
+
+    parent = _current_stage.get()
+    record = {
+        "run_id": run.run_id,
+        "seq": len(run.stages),
+        "stage": name,
+        "parent_stage": parent["stage"] if parent else None,
+        "started_at": _now(),
+        "status": "failed",
+        "rows_in": None,
+        "rows_out": None,
+        "profile_path": None,
+    }
+    run.stages.append(record)
+    token = _current_stage.set(record)
+
+    outer_profiler = run.profiler
+    if PROFILE_DIR:
+        if outer_profiler:
+            outer_profiler.disable()
+        run.profiler = cProfile.Profile()
+        run.profiler.enable()
+
+    wall, cpu, written = time.perf_counter(), time.process_time(), storage_bytes_written()
+    try:
+        with PeakRSS() as rss:
+            yield record
+        record["status"] = "ok"
+    finally:
+        record["wall_s"] = time.perf_counter() - wall
+        record["cpu_s"] = time.process_time() - cpu
+        record["peak_rss_mb"] = rss.peak / 2**20
+        record["db_bytes_written"] = _bytes_written_since(written)
+        _current_stage.reset(token)
+        if PROFILE_DIR:
+            run.profiler.disable()
+            path = Path(PROFILE_DIR) / run.run_id / f"{record['seq']:02d}_{name}.prof"
+            path.parent.mkdir(parents=True, exist_ok=True)
+            run.profiler.dump_stats(path)
+            record["profile_path"] = str(path)
+            run.profiler = outer_profiler
+            if outer_profiler:
+                outer_profiler.enable()
+
+def instrumented(func):
+    """Runs the decorated function as a stage named after it."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with stage(func.__name__):
+            return func(*args, **kwargs)
+    return wrapper
+
+def record_rows(rows_in=None, rows_out=None):
+    """Sets the row counts of the current stage (no-op outside a stage)."""
+    record = _current_stage.get()
+    if record is None:
+        return
+    if rows_in is not None:
+        record["rows_in"] = int(rows_in)
+    if rows_out is not None:
+        record["rows_out"] = int(rows_out)
+
+def _persist(run, summary):
+    """Writes the run and its stages; metrics never fail the pipeline itself."""
+    from src.sqlite_io import get_manager, insert_dataframe
+
+    try:
+        with get_manager().writer() as conn:
+            if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'pipeline_stage_metrics'").fetchone() is None:
+                with open(METRICS_SCHEMA_PATH, "r") as f:
+                    conn.executescript(f.read())
+            with conn:
+                insert_dataframe(conn, "pipeline_runs", pd.DataFrame([summary]))
+                if run.stages:
+                    insert_dataframe(conn, "pipeline_stage_metrics", pd.DataFrame(run.stages))
+    except Exception as e:
+        print(f"Could not record pipeline metrics: {e}")
@@ -0,0 +1,49 @@
+"""KPI registry compiler: config.KPI_MEASURES and KPI_DEFINITIONS to pandas and SQL.
+
+Measures are additive counts, each the SUM of an expression over
+encounter_facts rows; KPIs are ratios of measures. add_measures evaluates
+every measure once per row, aggregate_kpis builds any grain in one groupby
+over all of them, and kpi_select_sql re-aggregates pre-aggregated rows
+(kpi_cube) by summing measures before dividing, so a selection's rates are
+exact. The build and the dashboard share these definitions.
+"""
+import numpy as np
+import pandas as pd
+from src.config import KPI_MEASURES, KPI_DEFINITIONS
+
+KPI_COUNT_COLUMNS = list(KPI_MEASURES)
+KPI_RATE_COLUMNS = list(KPI_DEFINITIONS)
+
+def _evaluate(facts, expression):
+    values = facts.eval(expression)
+    if np.isscalar(values):
+        return np.full(len(facts), values, dtype=np.int64)
+    return values.to_numpy(dtype=np.int64)
+
+def add_measures(facts):
+    """Adds one column per measure to a frame of encounter_facts rows (in place)."""
+    for name, expression in KPI_MEASURES.items():
+        facts[name] = _evaluate(facts, expression)
+    return facts
+
+def derive_kpi_rates(kpi):
+    """Adds the KPI columns to a frame of (summed) measures; empty denominators give 0."""
+    for name, kpi_def in KPI_DEFINITIONS.items():
+        ratio = kpi[kpi_def['numerator']] / kpi[kpi_def['denominator']].replace(0, np.nan)
+        kpi[name] = ratio * kpi_def['scale'] if 'scale' in kpi_def else ratio
+    return kpi.fillna(0)
+
+def aggregate_kpis(facts, by):
+    """Measures and KPIs per `by` grain: one groupby over rows with add_measures columns."""
+    kpi = facts.groupby(by, observed=True)[KPI_COUNT_COLUMNS].sum()
+    return derive_kpi_rates(kpi).reset_index()
+
+def kpi_select_sql():
+    """SQL select list re-aggregating rows that hold the measure columns."""
+    terms = [f"SUM({name}) AS {name}" for name in KPI_COUNT_COLUMNS]
+    for name, kpi_def in KPI_DEFINITIONS.items():
+        terms.append(
+            f"COALESCE(SUM({kpi_def['numerator']}) * {float(kpi_def.get('scale', 1))!r} "
+            f"/ NULLIF(SUM({kpi_def['denominator']}), 0), 0) AS {name}"
+        )
+    return ",\n    ".join(terms)
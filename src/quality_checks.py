@@ -1,14 +1,43 @@
+import argparse
+from src.data_quality import run_data_quality_checks
+from src.instrumentation import instrumented, record_rows
 from src.sqlite_io import run_query
 
-def run_quality_gates():
+@instrumented
+def run_quality_gates(recheck=False, sample=None):
+    """Fails on any error-severity data quality rule.
+
+    Uses the data_quality_report written by the last build unless `recheck`
+    (or a `sample` mode) asks for a fresh evaluation.
+    """
     print("Running Quality Gates...")
     # Gate 1: DB connection (implicit if we get here)
-    
-    # Gate 2: Integrity
     enc_counts = run_query("SELECT count(*) as C FROM encounters")
     print(f"Encounters count: {enc_counts['C'].iloc[0]}")
-    
+    record_rows(rows_in=enc_counts['C'].iloc[0])
+
+    # Gate 2: Data quality rules (src/data_quality.py)
+    report = run_query("SELECT * FROM data_quality_report")
+    if recheck or sample is not None or report.empty:
+        report = run_data_quality_checks(sample=sample)
+    for _, row in report[report['status'] != 'PASS'].iterrows():
+        print(f"  {row['status']} {row['check']}: {row['count']} ({row['table_name']}, sample {row['sample_rate']:.0%})")
+    errors = report[report['status'] == 'FAIL']
+    if not errors.empty:
+        print(f"Data quality gate FAILED: {len(errors)} error rules")
+        return False
+    print(f"Data quality gate: PASS ({len(report)} rules)")
+
     return True
 
 if __name__ == "__main__":
-    run_quality_gates()
+    parser = argparse.ArgumentParser(description="Run pipeline quality gates.")
+    parser.add_argument("--recheck", action="store_true", help="Re-evaluate the data quality rules")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--sample", dest="sample", action="store_const", const=True, default=None,
+                      help="Check every table on a sample")
+    mode.add_argument("--full", dest="sample", action="store_const", const=False,
+                      help="Check every table in full, however large")
+    args = parser.parse_args()
+    ok = run_quality_gates(recheck=args.recheck, sample=args.sample)
+    raise SystemExit(0 if ok else 1)
@@ -0,0 +1,128 @@
+import threading
+import time
+from collections import OrderedDict
+from src.config import QUERY_CACHE_MAX_ENTRIES, QUERY_CACHE_MAX_BYTES, BUILD_VERSION_TTL_S
+from src.backends import get_backend
+from src.sqlite_io import get_manager, federated_query, available_facilities, shard_versions
+
+_build_versions = {}  # db_path -> (build_id, manager, manager.version, checked_at)
+
+def _read_build_version(manager):
+    with manager.reader() as conn:
+        try:
+            row = conn.execute("SELECT build_id FROM build_info ORDER BY rowid DESC LIMIT 1").fetchone()
+        except Exception:
+            return None
+    return row[0] if row else None
+
+def current_build_version():
+    """Latest build_id written by run_pipeline (None if the DB has never been built).
+
+    Kept in memory: re-read only when the DB's manager changed version (a
+    file swap or a build recorded by this process) or BUILD_VERSION_TTL_S
+    has passed, so cache hits don't touch the DB.
+    """
+    manager = get_manager()
+    known = _build_versions.get(manager.db_path)
+    now = time.monotonic()
+    if (known is not None and known[1] is manager and known[2] == manager.version
+            and now - known[3] < BUILD_VERSION_TTL_S):
+        return known[0]
+    version = manager.version
+    build_id = _read_build_version(manager)
+    _build_versions[manager.db_path] = (build_id, manager, version, now)
+    return build_id
+
+class QueryCache:
+    """LRU cache of query results keyed by (sql, params, build version).
+
+    Entries never expire on a timer: a new build changes the version part of
+    the key, so stale results simply stop being hit and age out of the LRU.
+    Concurrent misses on the same key run the query once. Cached DataFrames
+    are shared between callers and must be treated as read-only.
+    """
+
+    def __init__(self, max_entries=QUERY_CACHE_MAX_ENTRIES, max_bytes=QUERY_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (df, nbytes)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_or_load(self, key, load):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+            key_lock = self._inflight.setdefault(key, threading.Lock())
+
+        try:
+            with key_lock:
+                # Another thread may have loaded it while we waited
+                with self._lock:
+                    if key in self._entries:
+                        self._entries.move_to_end(key)
+                        self.hits += 1
+                        return self._entries[key][0]
+                    self.misses += 1
+                df = load()
+                self._put(key, df)
+                return df
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def _put(self, key, df):
+        nbytes = int(df.memory_usage(index=True, deep=True).sum())
+        with self._lock:
+            if nbytes > self.max_bytes:
+                return
+            self._entries[key] = (df, nbytes)
+            self._bytes += nbytes
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted_bytes) = self._entries.popitem(last=False)
+                self._bytes -= evicted_bytes
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+_cache = QueryCache()
+
+def get_query_cache():
+    return _cache
+
+def cached_query(query, params=None):
+    """A read on the analytic backend through the process-wide cache, invalidated by each new build."""
+    if isinstance(params, dict):
+        params_key = tuple(sorted(params.items()))
+    else:
+        params_key = tuple(params) if params is not None else None
+    backend = get_backend()
+    key = (backend.name, query, params_key, current_build_version())
+    return _cache.get_or_load(key, lambda: backend.read(query, params))
+
+def cached_federated_query(query, params=None, facilities=None):
+    """federated_query through the same cache, invalidated when any shard file changes."""
+    facilities = available_facilities(facilities)
+    key = ("federated", query, tuple(params or ()), shard_versions(facilities))
+    return _cache.get_or_load(key, lambda: federated_query(query, params, facilities))
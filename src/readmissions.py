@@ -0,0 +1,121 @@
+"""Multi-window readmission / revisit engine.
+
+For every encounter and every window in READMISSION_WINDOWS, counts the
+patient's later encounters admitted within `days` of discharge (and the days
+to the first one). Encounters are sorted once by (patient_id, admit_date,
+encounter_id); each horizon is then one vectorized searchsorted over a
+(patient, admit day) key, and scope filters (same service line, ED) are
+searchsorted over the positions of each category, so no window re-sorts or
+re-groups. Unlike the encounter_facts flags this looks past the very next
+encounter.
+"""
+import numpy as np
+import pandas as pd
+from src.backends import get_backend
+from src.config import READMISSION_WINDOWS
+from src.dimensions import decode
+from src.instrumentation import instrumented, record_rows
+from src.sqlite_io import insert_dataframe
+
+ENCOUNTER_RETURNS_COLUMNS = [
+    "encounter_id", "patient_id", "return_window", "horizon_days", "return_count", "days_to_first_return",
+]
+
+def _days(dates):
+    return pd.to_datetime(dates).to_numpy().astype("datetime64[D]").astype(np.int64)
+
+def _scoped_returns(codes, index_codes, lo, hi):
+    """Counts and first positions in [lo, hi) of rows whose code equals the index row's code.
+
+    `codes` are per sorted row; `index_codes` is the code each index row
+    matches (-1 = none). Works per code value on its ascending positions.
+    """
+    n = len(lo)
+    counts = np.zeros(n, dtype=np.int64)
+    first = np.full(n, -1, dtype=np.int64)
+    for code in np.unique(index_codes[index_codes >= 0]):
+        positions = np.flatnonzero(codes == code)
+        rows = np.flatnonzero(index_codes == code)
+        start = np.searchsorted(positions, lo[rows], side="left")
+        end = np.searchsorted(positions, hi[rows], side="left")
+        counts[rows] = np.maximum(end - start, 0)
+        has = counts[rows] > 0
+        first[rows[has]] = positions[start[has]]
+    return counts, first
+
+def compute_encounter_returns(encounters, windows=None):
+    """Sparse encounter_returns rows for `encounters` (complete per patient).
+
+    `encounters` needs encounter_id, patient_id, service_line, admission_type,
+    admit_date and discharge_date (categories decoded, see src/dimensions.py).
+    """
+    windows = READMISSION_WINDOWS if windows is None else windows
+    if encounters.empty or not windows:
+        return pd.DataFrame(columns=ENCOUNTER_RETURNS_COLUMNS)
+
+    # The one sort; everything below works on these positions
+    df = encounters.sort_values(["patient_id", "admit_date", "encounter_id"], ignore_index=True)
+    patient_codes = pd.factorize(df["patient_id"])[0].astype(np.int64)
+    admit = _days(df["admit_date"])
+    discharge = _days(df["discharge_date"])
+
+    # Sorted (patient, admit day) key: a patient's admits are one contiguous, ascending run
+    base = min(admit.min(), discharge.min())
+    span = int(max(admit.max(), discharge.max()) - base) + max(w["days"] for w in windows) + 2
+    key = patient_codes * span + (admit - base)
+    index_key = patient_codes * span + (discharge - base)
+
+    # Returns are later encounters (position > i) admitted on or after discharge
+    lo = np.maximum(np.searchsorted(key, index_key, side="left"), np.arange(len(df)) + 1)
+    hi_by_days = {d: np.searchsorted(key, index_key + d, side="right") for d in {w["days"] for w in windows}}
+
+    service_codes = pd.factorize(df["service_line"])[0]
+    ed = (df["admission_type"] == "ED").to_numpy().astype(np.int64)
+    scopes = {
+        "all": None,
+        "same_service": (service_codes, service_codes),
+        "ed": (ed, np.ones(len(df), dtype=np.int64)),
+    }
+
+    encounter_ids = df["encounter_id"].to_numpy()
+    patient_ids = df["patient_id"].to_numpy()
+    parts = []
+    for window in windows:
+        hi = hi_by_days[window["days"]]
+        if scopes[window["scope"]] is None:
+            counts = np.maximum(hi - lo, 0)
+            first = np.where(counts > 0, lo, -1)
+        else:
+            counts, first = _scoped_returns(*scopes[window["scope"]], lo, hi)
+        rows = np.flatnonzero(counts > 0)
+        parts.append(pd.DataFrame({
+            "encounter_id": encounter_ids[rows],
+            "patient_id": patient_ids[rows],
+            "return_window": window["name"],
+            "horizon_days": window["days"],
+            "return_count": counts[rows],
+            "days_to_first_return": admit[first[rows]] - discharge[rows],
+        }))
+    return pd.concat(parts, ignore_index=True)[ENCOUNTER_RETURNS_COLUMNS]
+
+_ENCOUNTER_COLUMNS = "encounter_id, patient_id, service_line_key, admission_type_key, admit_date, discharge_date"
+
+@instrumented
+def build_encounter_returns():
+    """Full rebuild of encounter_returns from the encounters table."""
+    print("Building encounter_returns...")
+    backend = get_backend()
+    encounters = decode(backend.read(f"SELECT {_ENCOUNTER_COLUMNS} FROM encounters"))
+    returns = compute_encounter_returns(encounters)
+    n_rows = backend.write({"encounter_returns": returns})["encounter_returns"]
+    record_rows(rows_in=len(encounters), rows_out=n_rows)
+    print(f"encounter_returns built: {n_rows} rows over {len(READMISSION_WINDOWS)} windows.")
+
+def refresh_encounter_returns(conn, patients_table):
+    """Recomputes the rows of the patients listed in `patients_table` (no commit)."""
+    conn.execute(f"DELETE FROM encounter_returns WHERE patient_id IN (SELECT patient_id FROM {patients_table})")
+    encounters = decode(pd.read_sql(
+        f"SELECT {_ENCOUNTER_COLUMNS} FROM encounters WHERE patient_id IN (SELECT patient_id FROM {patients_table})",
+        conn,
+    ))
+    return insert_dataframe(conn, "encounter_returns", compute_encounter_returns(encounters))
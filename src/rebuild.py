@@ -0,0 +1,135 @@
+"""Background full rebuild into a scratch DB, swapped in atomically.
+
+The build (init_db, generation, pipeline, quality gates) runs on a worker
+thread against REBUILD_DB_PATH via use_db(), so the live DB and its readers
+are untouched. Only when the gates pass is the scratch file renamed over
+DB_PATH; until then readers keep seeing the previous build. One rebuild runs
+at a time per process.
+"""
+import threading
+import time
+import traceback
+from pathlib import Path
+from src.config import DB_PATH, REBUILD_DB_PATH, TARGET_N_PATIENTS, TARGET_N_ENCOUNTERS
+from src.instrumentation import pipeline_run
+from src.sqlite_io import get_manager, use_db, release_db
+
+# (step, share of the progress bar it starts at)
+REBUILD_STEPS = [
+    ("Initializing schema", 0.0),
+    ("Generating synthetic data", 0.05),
+    ("Building facts & KPIs", 0.6),
+    ("Running quality gates", 0.9),
+    ("Swapping in the new database", 0.97),
+]
+
+class RebuildJob:
+    """Progress of one rebuild; read by the UI while the worker updates it."""
+
+    def __init__(self):
+        self.state = "running"  # running | succeeded | failed
+        self.step = REBUILD_STEPS[0][0]
+        self.progress = 0.0
+        self.message = ""
+        self.started_at = time.time()
+        self.finished_at = None
+
+    def enter(self, index):
+        self.step, self.progress = REBUILD_STEPS[index]
+
+    def advance(self, index, fraction):
+        """Progress within step `index` (fraction in [0, 1])."""
+        start = REBUILD_STEPS[index][1]
+        end = REBUILD_STEPS[index + 1][1] if index + 1 < len(REBUILD_STEPS) else 1.0
+        self.progress = start + (end - start) * min(max(fraction, 0.0), 1.0)
+
+    def status(self):
+        return {
+            "state": self.state,
+            "step": self.step,
+            "progress": self.progress,
+            "message": self.message,
+            "elapsed_s": (self.finished_at or time.time()) - self.started_at,
+        }
+
+_lock = threading.Lock()
+_job = None
+
+def _copy_pipeline_history(conn, live_path):
+    """Carries the pipeline metrics of the live DB over into the new one."""
+    if not Path(live_path).exists():
+        return
+    conn.execute("ATTACH DATABASE ? AS live", (str(live_path),))
+    try:
+        live_tables = {r[0] for r in conn.execute("SELECT name FROM live.sqlite_master WHERE type = 'table'")}
+        with conn:
+            for table in ("pipeline_runs", "pipeline_stage_metrics"):
+                if table in live_tables:
+                    conn.execute(f"INSERT OR IGNORE INTO main.{table} SELECT * FROM live.{table}")
+    finally:
+        conn.execute("DETACH DATABASE live")
+
+def _run(job, n_patients, n_encounters):
+    # Imported here: these modules are heavy and only the worker needs them
+    from src.sqlite_io import init_db
+    from src.generate_data import run_data_generation
+    from src.build_facts_kpis import run_pipeline
+    from src.quality_checks import run_quality_gates
+
+    scratch = Path(REBUILD_DB_PATH)
+    for suffix in ("", "-wal", "-shm"):
+        Path(f"{scratch}{suffix}").unlink(missing_ok=True)
+    # Rough total raw rows, for the generation progress bar
+    expected_rows = n_patients + n_encounters * 5.15
+
+    try:
+        with use_db(scratch):
+            with pipeline_run("background_rebuild"):
+                job.enter(0)
+                init_db()
+                job.enter(1)
+                run_data_generation(n_patients, n_encounters,
+                                    progress=lambda rows, rate: job.advance(1, rows / expected_rows))
+                job.enter(2)
+                run_pipeline()
+                job.enter(3)
+                passed = run_quality_gates()
+            if not passed:
+                raise RuntimeError("Quality gates failed; the live database was left unchanged")
+            job.enter(4)
+            with get_manager().writer() as conn:
+                _copy_pipeline_history(conn, DB_PATH)
+        release_db(scratch)
+        get_manager(DB_PATH).replace_file(scratch)
+        job.progress = 1.0
+        job.state = "succeeded"
+        job.message = "Database rebuilt and swapped in."
+    except Exception as e:
+        traceback.print_exc()
+        release_db(scratch)
+        for suffix in ("", "-wal", "-shm"):
+            Path(f"{scratch}{suffix}").unlink(missing_ok=True)
+        job.state = "failed"
+        job.message = str(e)
+    finally:
+        job.finished_at = time.time()
+
+def start_rebuild(n_patients=None, n_encounters=None):
+    """Starts a background rebuild; returns False if one is already running."""
+    global _job
+    with _lock:
+        if _job is not None and _job.state == "running":
+            return False
+        _job = RebuildJob()
+        threading.Thread(
+            target=_run,
+            args=(_job, n_patients or TARGET_N_PATIENTS, n_encounters or TARGET_N_ENCOUNTERS),
+            name="cqm-rebuild",
+            daemon=True,
+        ).start()
+        return True
+
+def rebuild_status():
+    """Status dict of the current/last rebuild, or None if none was started."""
+    with _lock:
+        return _job.status() if _job is not None else None
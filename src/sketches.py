@@ -0,0 +1,182 @@
+"""Mergeable sketches for the non-additive KPIs.
+
+Distinct patients and reporting-delay percentiles can't be summed across
+pre-aggregated rows, so build_kpis stores two small sketches per
+(month, service_line) in kpi_sketches:
+
+- HyperLogLog: 2**p one-byte registers holding the longest run of leading
+  zeros seen among hashed patient IDs per bucket. Merging is an elementwise
+  max, so the union of any selection is estimated without rescanning.
+- KLL: a stack of sorted compactors whose items weigh 2**level; a full
+  level keeps every other item (random offset) and promotes them. Merging
+  concatenates levels and compacts, with rank error ~1.65 / k.
+
+Both serialize to plain bytes (BLOB columns) and are vectorized with numpy.
+"""
+from functools import reduce
+import numpy as np
+import pandas as pd
+from src.config import HLL_PRECISION, KLL_K
+
+SKETCH_KEYS = ['month', 'service_line']
+
+# --- HyperLogLog ---
+
+def _hash64(values):
+    """splitmix64 finalizer: well-mixed 64-bit hashes of integer IDs."""
+    x = np.asarray(values).astype(np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+def _bit_length(x):
+    """Bit length of uint64 values (halves go through float64 exactly)."""
+    hi, lo = (x >> np.uint64(32)).astype(np.float64), (x & np.uint64(0xFFFFFFFF)).astype(np.float64)
+    return np.where(hi > 0, 32 + np.frexp(hi)[1], np.frexp(lo)[1])
+
+def _hll_positions(values, p):
+    """(register index, rank) of each value: top p hash bits pick the register, the rest give the rank."""
+    h = _hash64(values)
+    index = (h >> np.uint64(64 - p)).astype(np.int64)
+    # A sentinel bit caps the rank at 64 - p + 1 when the remaining bits are all zero
+    rest = (h << np.uint64(p)) | np.uint64(1 << (p - 1))
+    return index, (65 - _bit_length(rest)).astype(np.uint8)
+
+class HyperLogLog:
+    """Distinct-count sketch over integer IDs."""
+
+    def __init__(self, p=HLL_PRECISION, registers=None):
+        self.p = p
+        self.registers = np.zeros(1 << p, dtype=np.uint8) if registers is None else registers
+
+    def update(self, values):
+        index, rank = _hll_positions(values, self.p)
+        np.maximum.at(self.registers, index, rank)
+        return self
+
+    def merge(self, other):
+        if other.p != self.p:
+            raise ValueError(f"Cannot merge HyperLogLog sketches of precision {self.p} and {other.p}")
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def estimate(self):
+        m = len(self.registers)
+        raw = 0.7213 / (1 + 1.079 / m) * m * m / np.ldexp(1.0, -self.registers.astype(np.int64)).sum()
+        zeros = int((self.registers == 0).sum())
+        # Small cardinalities: linear counting of the empty registers is more accurate
+        if raw <= 2.5 * m and zeros:
+            return m * np.log(m / zeros)
+        return float(raw)
+
+    def to_bytes(self):
+        return bytes([self.p]) + self.registers.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data):
+        return cls(data[0], np.frombuffer(data, dtype=np.uint8, offset=1).copy())
+
+def hll_by_group(codes, values, n_groups, p=HLL_PRECISION):
+    """One HyperLogLog per group code in a single vectorized pass."""
+    index, rank = _hll_positions(values, p)
+    registers = np.zeros((n_groups, 1 << p), dtype=np.uint8)
+    np.maximum.at(registers, (np.asarray(codes), index), rank)
+    return [HyperLogLog(p, row) for row in registers]
+
+# --- KLL ---
+
+class KLLSketch:
+    """Quantile sketch over numeric values (NaN ignored)."""
+
+    def __init__(self, k=KLL_K, levels=None, seed=0):
+        self.k = k
+        self.levels = levels or [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+
+    @property
+    def n(self):
+        """Values summarized (compaction keeps every level's total weight)."""
+        return sum(len(items) << level for level, items in enumerate(self.levels))
+
+    def _capacity(self, level):
+        return max(2, int(np.ceil(self.k * (2 / 3) ** (len(self.levels) - level - 1))))
+
+    def _compact(self, level):
+        if level + 1 == len(self.levels):
+            self.levels.append(np.empty(0))
+        items = np.sort(self.levels[level])
+        # An odd item out stays behind so no weight is lost
+        keep, items = items[len(items) - len(items) % 2:], items[:len(items) - len(items) % 2]
+        self.levels[level] = keep
+        self.levels[level + 1] = np.concatenate([self.levels[level + 1], items[self._rng.integers(2)::2]])
+
+    def _compress(self):
+        while sum(map(len, self.levels)) > sum(self._capacity(h) for h in range(len(self.levels))):
+            self._compact(next(h for h, items in enumerate(self.levels) if len(items) >= self._capacity(h)))
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        self.levels[0] = np.concatenate([self.levels[0], values[~np.isnan(values)]])
+        self._compress()
+        return self
+
+    def merge(self, other):
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self._compress()
+        return self
+
+    def quantiles(self, qs):
+        """Approximate values at ranks `qs` (NaN for an empty sketch)."""
+        if not self.n:
+            return [np.nan for _ in qs]
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(items), 1 << level) for level, items in enumerate(self.levels)])
+        order = np.argsort(items, kind="stable")
+        items, cumulative = items[order], np.cumsum(weights[order])
+        ranks = np.searchsorted(cumulative, np.asarray(qs) * cumulative[-1], side="left")
+        return items[np.minimum(ranks, len(items) - 1)].tolist()
+
+    def to_bytes(self):
+        header = np.array([self.k, len(self.levels), *map(len, self.levels)], dtype="<i8")
+        return header.tobytes() + np.concatenate(self.levels).astype("<f8").tobytes()
+
+    @classmethod
+    def from_bytes(cls, data):
+        k, n_levels = np.frombuffer(data, dtype="<i8", count=2)
+        sizes = np.frombuffer(data, dtype="<i8", count=n_levels, offset=16)
+        items = np.frombuffer(data, dtype="<f8", offset=16 + 8 * int(n_levels))
+        return cls(int(k), np.split(items.copy(), np.cumsum(sizes)[:-1]))
+
+# --- kpi_sketches rows ---
+
+def compute_sketch_rows(patients, delays):
+    """kpi_sketches rows from (month, service_line, patient_id) and (month, service_line, report_delay_days) frames."""
+    patients = patients.dropna(subset=SKETCH_KEYS)
+    delays = delays.dropna(subset=SKETCH_KEYS)
+    keys = (pd.concat([patients[SKETCH_KEYS], delays[SKETCH_KEYS]]).astype(str)
+            .drop_duplicates().sort_values(SKETCH_KEYS).reset_index(drop=True))
+    key_index = pd.MultiIndex.from_frame(keys)
+
+    patient_codes = key_index.get_indexer(pd.MultiIndex.from_frame(patients[SKETCH_KEYS].astype(str)))
+    hlls = hll_by_group(patient_codes, patients['patient_id'].to_numpy(), len(keys))
+
+    klls = [KLLSketch() for _ in range(len(keys))]
+    delay_codes = key_index.get_indexer(pd.MultiIndex.from_frame(delays[SKETCH_KEYS].astype(str)))
+    order = np.argsort(delay_codes, kind="stable")
+    values = delays['report_delay_days'].to_numpy(dtype=np.float64, na_value=np.nan)[order]
+    bounds = np.searchsorted(delay_codes[order], np.arange(len(keys) + 1))
+    for code, kll in enumerate(klls):
+        kll.update(values[bounds[code]:bounds[code + 1]])
+
+    return keys.assign(
+        patients_hll=[hll.to_bytes() for hll in hlls],
+        delay_kll=[kll.to_bytes() for kll in klls],
+    )
+
+def merge_sketches(blobs, cls):
+    """Merges serialized sketches of one type (None when there are none)."""
+    sketches = [cls.from_bytes(bytes(blob)) for blob in blobs]
+    return reduce(cls.merge, sketches) if sketches else None
@@ -0,0 +1,122 @@
+"""Trailing-window rates and SPC control limits for the KPIs with a control_chart.
+
+kpi_spc_monthly holds one row per (month, service_line, KPI), 'ALL' being
+the whole system, on a gap-free calendar of months. Each row keeps the
+month's numerator and denominator plus their running sums (prefix sums) over
+the series, so a trailing N-month rate is the difference of two running
+sums and the center line is the series rate to date. Control limits follow
+the chart type at SPC_SIGMA standard deviations of the month's denominator:
+
+- p-chart (proportions): p̄ ± k·sqrt(p̄(1 − p̄) / n), clipped to [0, 1]
+- u-chart (counts per encounter): ū ± k·sqrt(ū / n), clipped at 0
+
+Nothing in a row depends on later months, so a refresh recomputes only the
+rows from its first affected month on, continuing the stored running sums.
+"""
+import numpy as np
+import pandas as pd
+from src.config import KPI_DEFINITIONS, ROLLING_WINDOWS, SPC_SIGMA, CUBE_ALL
+
+SPC_KPIS = {name: kpi['control_chart'] for name, kpi in KPI_DEFINITIONS.items() if 'control_chart' in kpi}
+SERIES_KEYS = ['service_line', 'kpi']
+SPC_COLUMNS = [
+    'month', 'service_line', 'kpi', 'chart', 'numerator', 'denominator', 'cum_numerator', 'cum_denominator',
+    'rate', *(f'rate_{window}m' for window in ROLLING_WINDOWS), 'center_line', 'lcl', 'ucl',
+]
+
+def month_range(first, last):
+    """'YYYY-MM' labels of every calendar month from first to last."""
+    return pd.period_range(first, last, freq='M').strftime('%Y-%m').tolist()
+
+def months_before(month, n):
+    """The 'YYYY-MM' label n months before `month`."""
+    return (pd.Period(month, freq='M') - n).strftime('%Y-%m')
+
+def spc_counts(service_rows, months, service_lines):
+    """Per (month, service_line, kpi) numerator and denominator, plus 'ALL' rows, on a dense grid.
+
+    `service_rows` are kpi_monthly_service rows; (month, service_line) pairs
+    without rows count zero.
+    """
+    counts = pd.concat([
+        service_rows[['month', 'service_line']].assign(
+            kpi=name, numerator=service_rows[KPI_DEFINITIONS[name]['numerator']],
+            denominator=service_rows[KPI_DEFINITIONS[name]['denominator']],
+        )
+        for name in SPC_KPIS
+    ])
+    system = counts.groupby(['month', 'kpi'], as_index=False)[['numerator', 'denominator']].sum()
+    counts = pd.concat([counts, system.assign(service_line=CUBE_ALL)])
+    grid = pd.MultiIndex.from_product([months, [*service_lines, CUBE_ALL], list(SPC_KPIS)],
+                                      names=['month', 'service_line', 'kpi'])
+    return (counts.set_index(['month', 'service_line', 'kpi'])[['numerator', 'denominator']]
+            .reindex(grid, fill_value=0).astype('int64').reset_index())
+
+def _ratio(numerator, denominator):
+    """numerator / denominator, NaN where the denominator is 0."""
+    numerator, denominator = np.asarray(numerator, dtype=np.float64), np.asarray(denominator, dtype=np.float64)
+    return np.divide(numerator, denominator, out=np.full(len(numerator), np.nan), where=denominator > 0)
+
+def derive_spc(counts, history=None):
+    """kpi_spc_monthly rows for `counts` (month, service_line, kpi, numerator, denominator).
+
+    `history` holds the stored rows of the max(ROLLING_WINDOWS) months before
+    the first counted month (None on a full build); running sums continue
+    from it and trailing windows reach into it. Returns only the new rows
+    (typed, and empty for empty counts).
+    """
+    # SUMs over no rows come back untyped; cumsum needs numbers
+    new = (counts.astype({'numerator': 'int64', 'denominator': 'int64'})
+           .sort_values([*SERIES_KEYS, 'month']).reset_index(drop=True))
+    cum = new.groupby(SERIES_KEYS)[['numerator', 'denominator']].cumsum().to_numpy()
+    if history is not None and not history.empty:
+        last = history.sort_values('month').groupby(SERIES_KEYS)[['cum_numerator', 'cum_denominator']].last()
+        cum += last.reindex(pd.MultiIndex.from_frame(new[SERIES_KEYS]), fill_value=0).to_numpy()
+    new['cum_numerator'], new['cum_denominator'] = cum[:, 0], cum[:, 1]
+    frame = new.assign(_new=True)
+    if history is not None and not history.empty:
+        frame = pd.concat([history[new.columns].assign(_new=False), frame], ignore_index=True)
+        frame = frame.sort_values([*SERIES_KEYS, 'month']).reset_index(drop=True)
+
+    grouped = frame.groupby(SERIES_KEYS)
+    chart = frame['kpi'].map(SPC_KPIS).to_numpy()
+    scale = frame['kpi'].map(lambda name: KPI_DEFINITIONS[name].get('scale', 1)).to_numpy(dtype=np.float64)
+    frame['chart'] = chart
+    frame['rate'] = _ratio(frame['numerator'], frame['denominator']) * scale
+    for window in ROLLING_WINDOWS:
+        # Running sums just before the window; 0 before the series begins
+        prior = grouped[['cum_numerator', 'cum_denominator']].shift(window).fillna(0)
+        frame[f'rate_{window}m'] = _ratio(frame['cum_numerator'] - prior['cum_numerator'],
+                                          frame['cum_denominator'] - prior['cum_denominator']) * scale
+
+    # Center line: the series rate to date; sigma from the month's own denominator
+    center = _ratio(frame['cum_numerator'], frame['cum_denominator'])
+    sigma = np.sqrt(_ratio(np.where(chart == 'p', center * (1 - center), center), frame['denominator']))
+    upper = center + SPC_SIGMA * sigma
+    frame['center_line'] = center * scale
+    frame['lcl'] = np.maximum(center - SPC_SIGMA * sigma, 0) * scale
+    frame['ucl'] = np.where(chart == 'p', np.minimum(upper, 1), upper) * scale
+    return frame.loc[frame['_new'], SPC_COLUMNS].reset_index(drop=True)
+
+def compute_kpi_spc(service_rows, history=None, start=None):
+    """kpi_spc_monthly rows for kpi_monthly_service rows covering every month from `start` (default: their first) on."""
+    if service_rows.empty:
+        return pd.DataFrame(columns=SPC_COLUMNS)
+    service_rows = service_rows.assign(service_line=service_rows['service_line'].astype(str))
+    months = month_range(start or service_rows['month'].min(), service_rows['month'].max())
+    service_lines = set(service_rows['service_line'])
+    if history is not None:
+        service_lines |= set(history['service_line']) - {CUBE_ALL}
+    return derive_spc(spc_counts(service_rows, months, sorted(service_lines)), history)
+
+def first_changed_month(before, after):
+    """Earliest month whose SPC counts differ between two sets of kpi_monthly_service rows (None if none)."""
+    columns = sorted({KPI_DEFINITIONS[name][part] for name in SPC_KPIS for part in ('numerator', 'denominator')})
+    keys = ['month', 'service_line']
+    merged = before[keys + columns].astype({'service_line': str}).merge(
+        after[keys + columns].astype({'service_line': str}), on=keys, how='outer', suffixes=('_before', '_after'),
+    )
+    changed = np.zeros(len(merged), dtype=bool)
+    for column in columns:
+        changed |= ~merged[f'{column}_before'].fillna(0).eq(merged[f'{column}_after'].fillna(0)).to_numpy()
+    return merged.loc[changed, 'month'].min() if changed.any() else None
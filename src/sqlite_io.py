@@ -1,37 +1,417 @@
+import contextvars
+import functools
+import itertools
+import os
+import queue
+import re
 import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from pathlib import Path
 import pandas as pd
-from src.config import DB_PATH, SCHEMA_PATH
+from src.config import (
+    DB_PATH, SCHEMA_PATH, CHANGE_CAPTURE_PATH, METRICS_SCHEMA_PATH, FACILITIES, FACILITY_DB_DIR,
+    SQLITE_PRAGMAS, SQLITE_READ_POOL_SIZE, SQLITE_STATEMENT_CACHE_SIZE, EXPORT_CHUNK_ROWS, EXPORT_SPOOL_BYTES
+)
+from src.dimensions import seed_dimensions
+from src.instrumentation import instrumented
 
+def open_connection(db_path, pragmas=None, read_only=False, check_same_thread=False):
+    """Opens a tuned connection: statement cache plus PRAGMAs (defaults to SQLITE_PRAGMAS)."""
+    conn = sqlite3.connect(
+        db_path,
+        check_same_thread=check_same_thread,
+        cached_statements=SQLITE_STATEMENT_CACHE_SIZE,
+    )
+    for name, value in (SQLITE_PRAGMAS if pragmas is None else pragmas).items():
+        conn.execute(f"PRAGMA {name} = {value}")
+    if read_only:
+        conn.execute("PRAGMA query_only = ON")
+    return conn
+
+class ConnectionManager:
+    """Pool of read connections plus a single serialized writer for one DB file.
+
+    In WAL mode readers never block on the writer, so dashboard queries keep
+    working (on the last committed snapshot) while a rebuild is writing.
+    Connections are shared across threads but only used by one at a time.
+    """
+
+    def __init__(self, db_path, pool_size=SQLITE_READ_POOL_SIZE, pragmas=None):
+        self.db_path = Path(db_path)
+        self.pool_size = pool_size
+        self.pragmas = SQLITE_PRAGMAS if pragmas is None else pragmas
+        self._idle = queue.LifoQueue()
+        self._n_readers = 0
+        self._lock = threading.Lock()
+        self._writer = None
+        self._writer_lock = threading.RLock()
+        self._generation = 0  # bumped by close_all so stale borrowed readers get closed
+        self._builds = 0  # bumped by note_build
+        self._borrowed = 0
+        self._swapping = False
+        self._swap_cond = threading.Condition()
+
+    def _connect(self, read_only=False):
+        if not self.db_path.parent.exists():
+            self.db_path.parent.mkdir(parents=True)
+        return open_connection(self.db_path, self.pragmas, read_only=read_only)
+
+    @contextmanager
+    def reader(self):
+        """Borrows a read-only connection, blocking when the pool is exhausted."""
+        with self._swap_cond:
+            self._swap_cond.wait_for(lambda: not self._swapping)
+            self._borrowed += 1
+        try:
+            with self._borrow() as conn:
+                yield conn
+        finally:
+            with self._swap_cond:
+                self._borrowed -= 1
+                self._swap_cond.notify_all()
+
+    @contextmanager
+    def _borrow(self):
+        generation = self._generation
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                create = self._n_readers < self.pool_size
+                if create:
+                    self._n_readers += 1
+            if create:
+                try:
+                    conn = self._connect(read_only=True)
+                except Exception:
+                    with self._lock:
+                        self._n_readers -= 1
+                    raise
+            else:
+                conn = self._idle.get()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            if generation == self._generation:
+                self._idle.put(conn)
+            else:
+                conn.close()
+                with self._lock:
+                    self._n_readers -= 1
+
+    @contextmanager
+    def writer(self):
+        """Holds the single writer connection (re-entrant within a thread)."""
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = self._connect()
+            yield self._writer
+
+    @contextmanager
+    def transaction(self):
+        """Writer connection inside one transaction: committed on success, rolled back on error."""
+        with self.writer() as conn:
+            with conn:
+                yield conn
+
+    @property
+    def version(self):
+        """Changes when connections are recycled (e.g. a file swap) or this process records a build."""
+        return self._generation, self._builds
+
+    def note_build(self):
+        """Marks a new build written through this manager, for readers caching on the build version."""
+        self._builds += 1
+
+    def close_all(self):
+        """Closes the writer and every idle reader (borrowed readers are closed on return)."""
+        self._generation += 1
+        with self._writer_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._n_readers -= 1
+
+    def replace_file(self, new_path):
+        """Atomically swaps `new_path` in as this manager's DB file.
+
+        New readers wait while in-flight ones finish on the old file; then every
+        connection is closed (checkpointing the WAL, whose -wal/-shm files are
+        tied to the file name) and the new file is renamed over the old one.
+        Readers resume on the new file. `new_path` must be closed, out of WAL
+        mode and on the same filesystem.
+        """
+        with self._swap_cond:
+            if self._swapping:
+                raise RuntimeError(f"A swap of {self.db_path} is already in progress")
+            self._swapping = True
+            self._swap_cond.wait_for(lambda: self._borrowed == 0)
+        try:
+            with self._writer_lock:
+                if self.db_path.exists():
+                    with self.writer() as conn:
+                        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                self.close_all()
+                for suffix in ("-wal", "-shm"):
+                    Path(f"{self.db_path}{suffix}").unlink(missing_ok=True)
+                os.replace(new_path, self.db_path)
+        finally:
+            with self._swap_cond:
+                self._swapping = False
+                self._swap_cond.notify_all()
+
+_managers = {}
+_managers_lock = threading.Lock()
+_active_db = contextvars.ContextVar("active_db", default=None)
+
+@contextmanager
+def use_db(db_path):
+    """Points get_manager() (and so the whole pipeline) at another DB file in this context/thread."""
+    token = _active_db.set(db_path)
+    try:
+        yield
+    finally:
+        _active_db.reset(token)
+
+def get_manager(db_path=None):
+    """Process-wide ConnectionManager for a DB file (the use_db() file, else DB_PATH)."""
+    key = str(Path(db_path or _active_db.get() or DB_PATH).resolve())
+    with _managers_lock:
+        if key not in _managers:
+            _managers[key] = ConnectionManager(key)
+        return _managers[key]
+
+def release_db(db_path):
+    """Checkpoints and closes a DB file's connections and leaves it in rollback-journal mode.
+
+    After this the file is self-contained (no -wal/-shm) and safe to move.
+    """
+    key = str(Path(db_path).resolve())
+    with _managers_lock:
+        manager = _managers.pop(key, None)
+    if manager is not None:
+        manager.close_all()
+    if Path(key).exists():
+        # Leaving WAL mode needs the only connection to the file
+        conn = sqlite3.connect(key)
+        try:
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            conn.execute("PRAGMA journal_mode = DELETE")
+        finally:
+            conn.close()
+
+@instrumented
 def init_db():
-    """Drops and recreates the tables using schema.sql."""
-    if not DB_PATH.parent.exists():
-        DB_PATH.parent.mkdir(parents=True)
-        
-    conn = sqlite3.connect(DB_PATH)
+    """Drops and recreates the tables using schema.sql (pipeline metrics are kept) and seeds the dimensions."""
     with open(SCHEMA_PATH, 'r') as f:
         schema_script = f.read()
-    conn.executescript(schema_script)
-    conn.close()
-    print(f"Database initialized at {DB_PATH}")
+    with open(METRICS_SCHEMA_PATH, 'r') as f:
+        metrics_script = f.read()
+    manager = get_manager()
+    with manager.writer() as conn:
+        conn.executescript(schema_script)
+        conn.executescript(metrics_script)
+        with conn:
+            seed_dimensions(conn)
+    print(f"Database initialized at {manager.db_path}")
+
+def enable_change_capture(conn):
+    """Installs the raw-table triggers that feed change_log."""
+    with open(CHANGE_CAPTURE_PATH, 'r') as f:
+        conn.executescript(f.read())
+
+def disable_change_capture(conn):
+    """Drops the change-capture triggers (e.g. before a bulk reload)."""
+    names = [r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'cc\\_%' ESCAPE '\\'")]
+    for name in names:
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+    conn.commit()
 
 def run_query(query, params=None):
-    """Executes a read query and returns a DataFrame."""
-    conn = sqlite3.connect(DB_PATH)
+    """Executes a read query on a pooled connection and returns a DataFrame."""
+    with get_manager().reader() as conn:
+        return pd.read_sql(query, conn, params=params)
+
+_query_executor = None
+_query_executor_lock = threading.Lock()
+
+def get_query_executor():
+    """Process-wide thread pool for concurrent reads, sized to the reader pool."""
+    global _query_executor
+    with _query_executor_lock:
+        if _query_executor is None:
+            _query_executor = ThreadPoolExecutor(max_workers=SQLITE_READ_POOL_SIZE, thread_name_prefix="cqm-query")
+        return _query_executor
+
+def _timed(load):
+    started = time.perf_counter()
+    result = load()
+    return result, time.perf_counter() - started
+
+def run_concurrently(loads):
+    """Runs {name: zero-argument callable} on the query pool; returns ({name: result}, {name: seconds}).
+
+    Meant for a page's independent query set: each load borrows its own
+    pooled reader, and SQLite releases the GIL while it steps a statement, so
+    the set takes about as long as its slowest query rather than the sum.
+    Loads run in a copy of the caller's context (use_db() applies). The first
+    failure is re-raised once every load has finished.
+    """
+    executor = get_query_executor()
+    futures = {name: executor.submit(contextvars.copy_context().run, _timed, load) for name, load in loads.items()}
+    wait(futures.values())
+    results, timings = {}, {}
+    for name, future in futures.items():
+        results[name], timings[name] = future.result()
+    return results, timings
+
+def run_queries(queries):
+    """{name: (query, params)} through run_query, concurrently (see run_concurrently)."""
+    return run_concurrently({name: functools.partial(run_query, *query) for name, query in queries.items()})
+
+def iter_query(query, params=None, chunk_rows=EXPORT_CHUNK_ROWS):
+    """Yields a read query's result as DataFrames of at most `chunk_rows` rows (one pooled connection)."""
+    with get_manager().reader() as conn:
+        yield from pd.read_sql(query, conn, params=params, chunksize=chunk_rows)
+
+def spool_csv(chunks):
+    """Writes DataFrame chunks into one CSV file (header from the first) and returns it rewound.
+
+    The file stays in memory up to EXPORT_SPOOL_BYTES and spills to a temp
+    file beyond that.
+    """
+    out = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_BYTES, mode="w+b")
+    for i, chunk in enumerate(chunks):
+        out.write(chunk.to_csv(index=False, header=i == 0).encode("utf-8"))
+    out.seek(0)
+    return out
+
+def export_csv(query, params=None, chunk_rows=EXPORT_CHUNK_ROWS):
+    """Streams a read query into a CSV file chunk by chunk (only one chunk in memory at a time)."""
+    chunks = iter_query(query, params, chunk_rows)
+    first = next(chunks, None)
+    if first is None:
+        # No rows: still a header
+        first = run_query(f"SELECT * FROM ({query}) LIMIT 0", params)
+    return spool_csv(itertools.chain([first], chunks))
+
+# --- Facility shards (src/facilities.py builds them) ---
+
+# SQLite's default compile-time limit on databases attached to one connection
+SQLITE_MAX_ATTACHED = 10
+
+def facility_db_path(facility):
+    return FACILITY_DB_DIR / f"{facility}.db"
+
+def available_facilities(facilities=None):
+    """The configured facilities (or `facilities`) whose shard has been built."""
+    return [f for f in (FACILITIES if facilities is None else facilities) if facility_db_path(f).exists()]
+
+def shard_versions(facilities):
+    """(facility, inode, mtime, size) per shard; changes whenever a shard is rebuilt or refreshed."""
+    versions = []
+    for facility in facilities:
+        st = facility_db_path(facility).stat()
+        versions.append((facility, st.st_ino, st.st_mtime_ns, st.st_size))
+    return tuple(versions)
+
+def federated_query(query, params=None, facilities=None):
+    """Runs a read query on every built facility shard; returns the union with a leading facility column.
+
+    `query` names the shard's tables as {db}.<table> and takes positional
+    params. Shards are ATTACHed read-only to an in-memory connection,
+    SQLITE_MAX_ATTACHED at a time, and each batch is one UNION ALL statement.
+    Each file is opened per call, so a shard rebuilt by another process is
+    picked up by the next query. Rates don't add up across facilities:
+    re-aggregate the measure columns (src/kpis.py).
+    """
+    facilities = available_facilities(facilities)
+    frames = []
+    conn = sqlite3.connect(":memory:", check_same_thread=False)
     try:
-        df = pd.read_sql(query, conn, params=params)
-        return df
+        for start in range(0, len(facilities), SQLITE_MAX_ATTACHED):
+            batch = facilities[start:start + SQLITE_MAX_ATTACHED]
+            aliases = [f"shard_{i}" for i in range(len(batch))]
+            for alias, facility in zip(aliases, batch):
+                uri = f"{facility_db_path(facility).resolve().as_uri()}?mode=ro"
+                conn.execute(f"ATTACH DATABASE ? AS {alias}", (uri,))
+            try:
+                union = " UNION ALL ".join(f"SELECT ? AS facility, * FROM ({query.format(db=alias)})" for alias in aliases)
+                batch_params = [value for facility in batch for value in (facility, *(params or ()))]
+                frames.append(pd.read_sql(union, conn, params=batch_params))
+            finally:
+                for alias in aliases:
+                    conn.execute(f"DETACH DATABASE {alias}")
     finally:
         conn.close()
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=["facility"])
 
 def execute_statement(statement, params=None):
-    """Executes a write statement (INSERT, UPDATE, DELETE)."""
-    conn = sqlite3.connect(DB_PATH)
-    try:
-        cursor = conn.cursor()
-        if params:
-            cursor.execute(statement, params)
-        else:
-            cursor.execute(statement)
-        conn.commit()
-    finally:
-        conn.close()
+    """Executes a write statement (INSERT, UPDATE, DELETE) in its own transaction."""
+    with get_manager().transaction() as conn:
+        conn.execute(statement, params or ())
+
+def execute_many(statement, rows):
+    """Bulk write: runs one statement over many parameter rows in a single transaction."""
+    with get_manager().transaction() as conn:
+        return conn.executemany(statement, rows).rowcount
+
+def insert_dataframe(conn, table, df):
+    """Bulk-inserts a DataFrame into an existing table with executemany (no commit)."""
+    cols = list(df.columns)
+    placeholders = ", ".join("?" for _ in cols)
+    column_list = ", ".join(f'"{c}"' for c in cols)
+    rows = zip(*(df[c].tolist() for c in cols))
+    conn.executemany(f"INSERT INTO {table} ({column_list}) VALUES ({placeholders})", rows)
+    return len(df)
+
+def drop_secondary_indexes(conn, tables):
+    """Drops the explicit indexes on `tables` and returns their DDL for restore_indexes.
+
+    Primary-key (auto) indexes are kept; rebuilding the others once after a
+    load is much cheaper than maintaining them row by row.
+    """
+    placeholders = ", ".join("?" for _ in tables)
+    ddl = conn.execute(
+        f"SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL AND tbl_name IN ({placeholders})",
+        list(tables),
+    ).fetchall()
+    for name, _ in ddl:
+        conn.execute(f"DROP INDEX {name}")
+    return [sql for _, sql in ddl]
+
+def restore_indexes(conn, ddl):
+    """Recreates the indexes from drop_secondary_indexes (skipping any that were recreated meanwhile)."""
+    for sql in ddl:
+        conn.execute(re.sub(r"^CREATE (UNIQUE )?INDEX (?!IF NOT EXISTS)", r"CREATE \1INDEX IF NOT EXISTS ", sql,
+                            flags=re.IGNORECASE))
+
+def bulk_load(conn, frames):
+    """Truncates and refills declared tables from {table: DataFrame} in a single transaction.
+
+    Unlike to_sql(if_exists="replace") this keeps the declared keys and
+    indexes; secondary indexes are dropped for the load and rebuilt after.
+    """
+    if not conn.in_transaction:
+        conn.execute("BEGIN")
+    with conn:
+        ddl = drop_secondary_indexes(conn, list(frames))
+        rows = {}
+        for table, df in frames.items():
+            conn.execute(f"DELETE FROM {table}")
+            rows[table] = insert_dataframe(conn, table, df)
+        restore_indexes(conn, ddl)
+    return rows
@@ -0,0 +1,28 @@
+import sys
+from pathlib import Path
+# Project root on the path, as the app pages do
+ROOT = str(Path(__file__).resolve().parent.parent)
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import pytest
+from src import sqlite_io
+from src.sqlite_io import init_db, release_db
+
+@pytest.fixture(scope="session")
+def built_db(tmp_path_factory):
+    """A small seeded DB, generated and built once, as the default DB of the session.
+
+    DB_PATH itself is patched (not use_db) so Streamlit AppTest script threads see it too.
+    """
+    from src.generate_data import run_data_generation
+    from src.build_facts_kpis import run_pipeline
+
+    db_path = tmp_path_factory.mktemp("db") / "clinical_ops.db"
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(sqlite_io, "DB_PATH", db_path)
+        init_db()
+        run_data_generation(n_patients=300, n_encounters=800, seed=7)
+        run_pipeline()
+        yield db_path
+        release_db(db_path)
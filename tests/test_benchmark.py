@@ -0,0 +1,22 @@
+import json
+from src.benchmark import compare_to_baseline, missing_from_baseline
+from src.config import BENCHMARK_DIR
+
+def _baseline():
+    with open(BENCHMARK_DIR / "baseline.json") as f:
+        return json.load(f)
+
+def test_committed_baseline_covers_the_1k_scale_and_startup_pages():
+    baseline = _baseline()
+    assert "1k" in baseline["scales"] and baseline["scales"]["1k"]["stages"]
+    assert len(baseline["startup"]["pages"]) == 4
+    assert missing_from_baseline(baseline, baseline) == []
+    assert compare_to_baseline(baseline, baseline) == []
+
+def test_regressions_and_gaps_are_reported():
+    baseline = _baseline()
+    results = json.loads(json.dumps(baseline))
+    results["scales"]["1k"]["stages"]["build_kpis"]["wall_s"] += 10
+    results["scales"]["100k"] = {"stages": {}}
+    assert [line.split(":")[0] for line in compare_to_baseline(results, baseline)] == ["1k build_kpis"]
+    assert missing_from_baseline(results, baseline) == ["100k"]
@@ -0,0 +1,34 @@
+import pytest
+from pandas.testing import assert_frame_equal
+from src.columnar import export_snapshot, read_snapshot
+from src.config import DERIVED_TABLES
+from src.query_cache import current_build_version
+from src.sqlite_io import run_query
+
+pytest.importorskip("pyarrow")
+
+def _sorted(df):
+    keys = [col for col in df.columns if not df[col].map(lambda v: isinstance(v, bytes)).any()]
+    return df.sort_values(keys, ignore_index=True)
+
+@pytest.mark.parametrize("fmt", ["parquet", "arrow"])
+def test_snapshot_round_trips_every_derived_table(built_db, tmp_path, fmt):
+    build_id = current_build_version()
+    manifest = export_snapshot(build_id, fmt, snapshot_dir=tmp_path)
+    assert list(manifest["tables"]) == DERIVED_TABLES
+
+    for table in DERIVED_TABLES:
+        expected = run_query(f"SELECT * FROM {table}")
+        assert not expected.empty, table
+        actual = read_snapshot(table, build_id, snapshot_dir=tmp_path)
+        assert manifest["tables"][table]["rows"] == len(expected)
+        assert_frame_equal(_sorted(actual), _sorted(expected), obj=table)
+
+def test_snapshot_reads_selected_columns_and_rows(built_db, tmp_path):
+    build_id = current_build_version()
+    export_snapshot(build_id, "parquet", snapshot_dir=tmp_path)
+    month = run_query("SELECT MIN(month) AS m FROM kpi_monthly_service")['m'].iloc[0]
+    df = read_snapshot("kpi_monthly_service", build_id, ["service_line", "total_encounters"], tmp_path,
+                       filters=[("month", "=", month)])
+    expected = run_query("SELECT service_line, total_encounters FROM kpi_monthly_service WHERE month = ?", [month])
+    assert_frame_equal(_sorted(df), _sorted(expected))
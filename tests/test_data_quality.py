@@ -0,0 +1,42 @@
+import sqlite3
+from src import data_quality
+from src.data_quality import evaluate_rules
+from src.sqlite_io import get_manager, run_query
+
+EVERY_ROW = {"check": "Every Encounter", "table": "encounters", "when": "1 = 1", "severity": "warning"}
+
+def test_sampled_pass_reads_blocks_and_scales_counts(built_db, monkeypatch):
+    monkeypatch.setattr(data_quality, "DQ_SAMPLE_BLOCK_ROWS", 16)
+    n_rows = int(run_query("SELECT COUNT(*) AS n FROM encounters")['n'].iloc[0])
+    with get_manager().writer() as conn:
+        full = evaluate_rules(conn, [EVERY_ROW], sample=False).iloc[0]
+        sampled = evaluate_rules(conn, [EVERY_ROW], sample=True).iloc[0]
+
+    assert (full['rows_checked'], full['count'], full['sample_rate']) == (n_rows, n_rows, 1.0)
+    # 800 contiguous encounter IDs = 50 blocks of 16, 5 of them sampled
+    assert sampled['sample_rate'] == 0.1
+    assert sampled['rows_checked'] == 80
+    assert sampled['count'] == n_rows
+
+def test_small_tables_are_checked_in_full(built_db):
+    with get_manager().writer() as conn:
+        report = evaluate_rules(conn)
+    assert (report['sample_rate'] == 1.0).all()
+    assert (report.loc[report['severity'] == 'error', 'status'] == 'PASS').all()
+
+def test_unique_rules_see_duplicates_across_sampled_blocks(monkeypatch):
+    monkeypatch.setattr(data_quality, "DQ_SAMPLE_BLOCK_ROWS", 16)
+    monkeypatch.setitem(data_quality.DQ_TABLE_SOURCES, "dq_ids", "{t}")
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE dq_ids (id INTEGER)")
+    conn.execute("CREATE INDEX idx_dq_ids ON dq_ids(id)")
+    # IDs 0..31 twice over: every duplicate pair is 32 rows (two blocks) apart
+    conn.executemany("INSERT INTO dq_ids VALUES (?)", [(i % 32,) for i in range(64)])
+    rules = [{"check": "Duplicate IDs", "table": "dq_ids", "unique": "id", "severity": "error"},
+             {"check": "Every ID", "table": "dq_ids", "when": "1 = 1", "severity": "warning"}]
+    report = evaluate_rules(conn, rules, sample=True).set_index("check")
+
+    assert list(report.index) == ["Duplicate IDs", "Every ID"]
+    assert report.loc["Every ID", "sample_rate"] < 1
+    unique = report.loc["Duplicate IDs"]
+    assert (unique["status"], unique["count"], unique["rows_checked"], unique["sample_rate"]) == ("FAIL", 32, 64, 1.0)
@@ -0,0 +1,73 @@
+import pandas as pd
+import pytest
+from pandas.testing import assert_frame_equal
+from src import sqlite_io
+from src.config import CUBE_ALL, DIMENSIONS, KPI_DEFINITIONS
+from src.dashboard_queries import facility_kpis
+from src.facilities import build_facilities
+from src.kpis import KPI_COUNT_COLUMNS
+from src.sqlite_io import federated_query, release_db, run_query, use_db
+
+FACILITIES = ["north", "south"]
+
+@pytest.fixture(scope="module")
+def shards(tmp_path_factory):
+    """Two facility shards built by spawned workers, which read the config from the environment."""
+    root = tmp_path_factory.mktemp("facilities")
+    with pytest.MonkeyPatch.context() as mp:
+        for name, value in [("CQM_FACILITIES", ",".join(FACILITIES)), ("CQM_FACILITY_DB_DIR", str(root / "shards")),
+                            ("CQM_DB_PATH", str(root / "main.db"))]:
+            mp.setenv(name, value)
+        mp.setitem(DIMENSIONS, "facility", [DIMENSIONS["facility"][0], *FACILITIES])
+        mp.setattr(sqlite_io, "FACILITIES", FACILITIES)
+        mp.setattr(sqlite_io, "FACILITY_DB_DIR", root / "shards")
+        mp.setattr(sqlite_io, "DB_PATH", root / "main.db")
+        results = build_facilities(FACILITIES, n_patients=100, n_encounters=300, seed=1, workers=2)
+        yield root, results
+
+def _shard_query(facility, query):
+    path = sqlite_io.facility_db_path(facility)
+    with use_db(path):
+        df = run_query(query)
+    release_db(path)
+    return df
+
+def test_shards_are_built_and_record_their_own_metrics(shards):
+    root, results = shards
+    assert all(results[f]["passed"] for f in FACILITIES)
+    # The orchestrating process writes to no database
+    assert not (root / "main.db").exists()
+    for key, facility in enumerate(FACILITIES, start=1):
+        runs = _shard_query(facility, "SELECT label FROM pipeline_runs")
+        assert list(runs["label"]) == [f"facility_build:{facility}"]
+        assert set(_shard_query(facility, "SELECT DISTINCT facility_key FROM encounters")["facility_key"]) == {key}
+        assert set(_shard_query(facility, "SELECT DISTINCT facility FROM audit_view")["facility"]) == {facility}
+
+def _common_month():
+    months = [set(_shard_query(f, "SELECT month FROM kpi_monthly_overall")["month"]) for f in FACILITIES]
+    return sorted(set.intersection(*months))[-1]
+
+def test_facility_kpis_union_the_shards_and_add_a_system_row(shards):
+    month = _common_month()
+    kpis = facility_kpis(month).set_index("facility")
+    assert list(kpis.index) == [*FACILITIES, CUBE_ALL]
+    for facility in FACILITIES:
+        own = _shard_query(facility, f"SELECT * FROM kpi_monthly_overall WHERE month = '{month}'").iloc[0]
+        assert (kpis.loc[facility, KPI_COUNT_COLUMNS] == own[KPI_COUNT_COLUMNS]).all(), facility
+
+    system = kpis.loc[CUBE_ALL]
+    assert (system[KPI_COUNT_COLUMNS] == kpis.loc[FACILITIES, KPI_COUNT_COLUMNS].sum()).all()
+    # Rates are re-derived from the summed measures, not averaged
+    for name, kpi in KPI_DEFINITIONS.items():
+        denominator = system[kpi["denominator"]]
+        expected = system[kpi["numerator"]] / denominator * kpi.get("scale", 1) if denominator else 0
+        assert system[name] == pytest.approx(expected), name
+
+def test_federation_batches_attachments(shards, monkeypatch):
+    query = "SELECT month, total_encounters FROM {db}.kpi_monthly_overall"
+    together = federated_query(query)
+    monkeypatch.setattr(sqlite_io, "SQLITE_MAX_ATTACHED", 1)
+    one_at_a_time = federated_query(query)
+    assert set(together["facility"]) == set(FACILITIES)
+    assert_frame_equal(one_at_a_time, together)
+    assert len(together) == sum(len(_shard_query(f, "SELECT month FROM kpi_monthly_overall")) for f in FACILITIES)
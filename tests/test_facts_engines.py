@@ -0,0 +1,79 @@
+import pytest
+from pandas.testing import assert_frame_equal
+from src.build_facts_kpis import build_encounter_facts
+from src.config import DEFAULT_FACILITY
+from src.dimensions import decode, dim_key
+from src.generate_data import run_data_generation
+from src.sqlite_io import use_db, init_db, get_manager, run_query, release_db
+
+ED, INPATIENT = dim_key("admission_type", "ED"), dim_key("admission_type", "Inpatient")
+MEDICINE = dim_key("service_line", "Medicine")
+ADR, SEVERE = dim_key("event_type", "ADR"), dim_key("severity", "Severe")
+
+# (encounter_id, patient_id, service_line_key, admission_type_key, admit_date, discharge_date)
+EDGE_ENCOUNTERS = [
+    # Same-day return: discharged and readmitted (through the ED) on the same day
+    (900001, 900001, MEDICINE, INPATIENT, "2024-03-01", "2024-03-10"),
+    (900002, 900001, MEDICINE, ED, "2024-03-10", "2024-03-10"),
+    # ...then back 30 days later (readmission), and 31 days after that (not), the last encounter
+    (900003, 900001, MEDICINE, INPATIENT, "2024-04-09", "2024-04-12"),
+    (900004, 900001, MEDICINE, INPATIENT, "2024-05-13", "2024-05-15"),
+    # ED next visit at exactly 7 days (revisit) and at 8 days (not)
+    (900005, 900002, MEDICINE, INPATIENT, "2024-06-01", "2024-06-03"),
+    (900006, 900002, MEDICINE, ED, "2024-06-10", "2024-06-10"),
+    (900007, 900002, MEDICINE, ED, "2024-06-18", "2024-06-18"),
+    # Two admissions on the same day: encounter_id orders them
+    (900009, 900003, MEDICINE, ED, "2024-07-01", "2024-07-02"),
+    (900008, 900003, MEDICINE, ED, "2024-07-01", "2024-07-01"),
+    # Next admission before this discharge (overlap): negative gap, no flag
+    (900010, 900004, MEDICINE, INPATIENT, "2024-08-01", "2024-08-20"),
+    (900011, 900004, MEDICINE, ED, "2024-08-10", "2024-08-11"),
+    # A patient's only encounter, with a service line key missing from its dimension
+    (900012, 900005, 99, INPATIENT, "2024-09-01", "2024-09-04"),
+]
+EDGE_EVENTS = [
+    # (event_id, encounter_id, event_type_key, severity_key, report_delay_days, reported_flag, event_date)
+    (900001, 900002, ADR, SEVERE, 7, 1, "2024-03-10"),
+    (900002, 900002, ADR, SEVERE, 8, 1, "2024-03-10"),
+    (900003, 900005, ADR, SEVERE, None, 0, "2024-06-02"),
+]
+
+@pytest.fixture(scope="module")
+def edge_case_db(tmp_path_factory):
+    """A small seeded DB plus hand-written patients covering the readmission edge cases."""
+    db_path = tmp_path_factory.mktemp("facts") / "facts.db"
+    with use_db(db_path):
+        init_db()
+        run_data_generation(n_patients=200, n_encounters=600, seed=11)
+        with get_manager().transaction() as conn:
+            conn.executemany("INSERT INTO patients VALUES (?, 0, 0)", [(p,) for p in range(900001, 900006)])
+            conn.executemany("INSERT INTO encounters VALUES (?, ?, ?, ?, ?, ?, 0)", EDGE_ENCOUNTERS)
+            conn.executemany("INSERT INTO safety_events VALUES (?, ?, ?, ?, ?, ?, ?)", EDGE_EVENTS)
+        yield db_path
+    release_db(db_path)
+
+def _facts(engine):
+    build_encounter_facts(engine)
+    return run_query("SELECT * FROM encounter_facts ORDER BY encounter_id")
+
+def test_engines_build_identical_facts(edge_case_db):
+    with use_db(edge_case_db):
+        pandas_facts, sql_facts = _facts("pandas"), _facts("sql")
+    assert len(pandas_facts) == 600 + len(EDGE_ENCOUNTERS)
+    assert_frame_equal(pandas_facts, sql_facts)
+
+    flags = pandas_facts.set_index('encounter_id').loc[[row[0] for row in EDGE_ENCOUNTERS]]
+    assert flags['readmission_30d_flag'].to_dict() == {
+        900001: 1, 900002: 1, 900003: 0, 900004: 0, 900005: 1, 900006: 1, 900007: 0,
+        900009: 0, 900008: 1, 900010: 0, 900011: 0, 900012: 0,
+    }
+    assert flags['ed_revisit_7d_flag'].to_dict() == {
+        900001: 1, 900002: 0, 900003: 0, 900004: 0, 900005: 1, 900006: 0, 900007: 0,
+        900009: 0, 900008: 1, 900010: 0, 900011: 0, 900012: 0,
+    }
+    on_time_and_late = ['adr_flag', 'severe_event_flag', 'on_time_flag_any', 'late_reporting_flag_any']
+    assert flags.loc[900002, on_time_and_late].tolist() == [1, 1, 1, 1]
+    assert flags.loc[900005, ['adr_flag', 'reported_flag_any', 'on_time_flag_any']].tolist() == [1, 0, 0]
+    assert flags['service_line_key'].isna().tolist() == [False] * 11 + [True]
+    # Every encounter of this (single-facility) DB carries its facility key
+    assert decode(pandas_facts)['facility'].eq(DEFAULT_FACILITY).all()
@@ -0,0 +1,41 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+import pytest
+from pandas.testing import assert_frame_equal
+from src.generate_data import RAW_TABLES, run_data_generation
+from src.sqlite_io import use_db, init_db, run_query, release_db
+
+def _generate(db_path, workers):
+    with use_db(db_path):
+        init_db()
+        run_data_generation(n_patients=300, n_encounters=800, seed=7, chunk_size=40, workers=workers)
+        tables = {t: run_query(f"SELECT * FROM {t} ORDER BY rowid") for t in RAW_TABLES}
+    release_db(db_path)
+    return tables
+
+@pytest.mark.parametrize("workers", [2, 3])
+def test_output_is_identical_across_worker_counts(tmp_path, workers):
+    # 8 chunks of 40 patients, split into contiguous shard ranges of different sizes
+    serial = _generate(tmp_path / "serial.db", 1)
+    sharded = _generate(tmp_path / "sharded.db", workers)
+    for table in RAW_TABLES:
+        assert len(serial[table]) > 0, table
+        assert_frame_equal(sharded[table], serial[table], obj=table)
+    # Shard files live next to the DB being generated and are cleaned up
+    assert sorted(p.name for p in tmp_path.iterdir() if p.name.startswith(".shards-")) == []
+
+def test_unguarded_script_gets_a_clear_error(tmp_path):
+    script = tmp_path / "unguarded.py"
+    script.write_text(
+        "from src.sqlite_io import use_db, init_db\n"
+        "from src.generate_data import run_data_generation\n"
+        f"with use_db({str(tmp_path / 'unguarded.db')!r}):\n"
+        "    init_db()\n"
+        "    run_data_generation(n_patients=100, n_encounters=200, chunk_size=40, workers=2)\n"
+    )
+    env = {**os.environ, "PYTHONPATH": str(Path(__file__).resolve().parent.parent)}
+    result = subprocess.run([sys.executable, str(script)], capture_output=True, text=True, env=env, timeout=300)
+    assert result.returncode != 0
+    assert result.stderr.strip().splitlines()[-1].startswith("RuntimeError: A generation worker died")
@@ -0,0 +1,64 @@
+import pytest
+from pandas.testing import assert_frame_equal
+from src.build_facts_kpis import run_pipeline
+from src.config import DERIVED_TABLES
+from src.dimensions import dim_key
+from src.generate_data import run_data_generation
+from src.sqlite_io import use_db, init_db, get_manager, run_query, release_db
+
+SURGERY, INPATIENT = dim_key("service_line", "Surgery"), dim_key("admission_type", "Inpatient")
+ADR, SEVERE = dim_key("event_type", "ADR"), dim_key("severity", "Severe")
+
+# Inserts, updates and deletes on every captured table; each fires the change_log triggers
+CHANGES = [
+    # Moved to another month and service line, and to another patient
+    ("UPDATE encounters SET admit_date = '2024-03-05', discharge_date = '2024-03-07', service_line_key = ? "
+     "WHERE encounter_id IN (5, 100)", (SURGERY,)),
+    ("UPDATE encounters SET patient_id = 7 WHERE encounter_id = 200", ()),
+    ("UPDATE med_orders SET high_risk_flag = 1 - high_risk_flag WHERE encounter_id = 40", ()),
+    ("UPDATE safety_events SET reported_flag = 0, report_delay_days = NULL "
+     "WHERE event_id = (SELECT MIN(event_id) FROM safety_events)", ()),
+    ("INSERT INTO safety_events VALUES (900001, 11, ?, ?, 12, 1, '2024-05-01')", (ADR, SEVERE)),
+    ("DELETE FROM med_orders WHERE encounter_id = 20", ()),
+    ("DELETE FROM safety_events WHERE event_id IN (SELECT event_id FROM safety_events ORDER BY event_id DESC LIMIT 3)",
+     ()),
+    # A deleted encounter, a new one in a month past the last build, and a readmission for patient 9
+    ("DELETE FROM encounters WHERE encounter_id = 300", ()),
+    ("INSERT INTO encounters VALUES (900002, 9, ?, ?, '2025-12-30', '2026-01-02', 0)", (SURGERY, INPATIENT)),
+    ("INSERT INTO encounters VALUES (900003, 9, ?, ?, '2026-01-10', '2026-01-12', 0)", (SURGERY, INPATIENT)),
+]
+
+def _derived_tables():
+    return {table: run_query(f"SELECT * FROM {table}") for table in DERIVED_TABLES}
+
+def _sorted(df):
+    return df.sort_values(list(df.columns)).reset_index(drop=True)
+
+@pytest.fixture(scope="module")
+def refreshed_and_rebuilt(tmp_path_factory):
+    """Derived tables after an incremental refresh of CHANGES, then after a full rebuild of the same data."""
+    db_path = tmp_path_factory.mktemp("incremental") / "incremental.db"
+    with use_db(db_path):
+        init_db()
+        run_data_generation(n_patients=200, n_encounters=600, seed=5)
+        run_pipeline()
+        with get_manager().transaction() as conn:
+            for statement, params in CHANGES:
+                conn.execute(statement, params)
+        captured = int(run_query("SELECT COUNT(*) AS n FROM change_log")['n'].iloc[0])
+
+        assert run_pipeline(incremental=True) > 0
+        refreshed = _derived_tables()
+        run_pipeline()
+        rebuilt = _derived_tables()
+    release_db(db_path)
+    return captured, refreshed, rebuilt
+
+def test_changes_are_captured(refreshed_and_rebuilt):
+    captured, _, _ = refreshed_and_rebuilt
+    assert captured >= len(CHANGES)
+
+@pytest.mark.parametrize("table", DERIVED_TABLES)
+def test_incremental_refresh_matches_full_rebuild(refreshed_and_rebuilt, table):
+    _, refreshed, rebuilt = refreshed_and_rebuilt
+    assert_frame_equal(_sorted(refreshed[table]), _sorted(rebuilt[table]))
@@ -0,0 +1,29 @@
+from pathlib import Path
+import pytest
+from src.build_facts_kpis import run_pipeline
+from src.instrumentation import pipeline_run, stage
+from src.sqlite_io import run_query
+
+pytestmark = pytest.mark.skipif(not Path("/proc/self/io").exists(), reason="write_bytes needs /proc/self/io")
+
+def _stage_bytes(run_id):
+    return run_query("SELECT stage, db_bytes_written FROM pipeline_stage_metrics WHERE run_id = ?",
+                     params=(run_id,)).set_index('stage')['db_bytes_written']
+
+def _page_count():
+    return int(run_query("PRAGMA page_count").iloc[0, 0])
+
+def test_rebuilding_an_existing_db_counts_rewritten_bytes(built_db):
+    # The tables are already full, so the DB file does not grow; its pages are rewritten
+    pages_before = _page_count()
+    with pipeline_run("rebuild") as run:
+        run_pipeline()
+    written = _stage_bytes(run.run_id)
+    assert _page_count() <= pages_before * 1.1
+    for name in ("build_encounter_facts", "build_encounter_returns", "build_kpis"):
+        assert written[name] > 0, name
+
+def test_idle_stage_writes_nothing(built_db):
+    with pipeline_run("idle_run") as run, stage("idle"):
+        pass
+    assert _stage_bytes(run.run_id)['idle'] == 0
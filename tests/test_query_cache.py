@@ -0,0 +1,67 @@
+import sqlite3
+import pandas as pd
+import pytest
+from src import query_cache
+from src.build_facts_kpis import record_build
+from src.query_cache import QueryCache, cached_query, current_build_version
+from src.sqlite_io import get_manager
+
+def _frame(n):
+    return pd.DataFrame({"x": range(n)})
+
+def _nbytes(df):
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+def test_lru_evicts_least_recently_used_entry():
+    cache = QueryCache(max_entries=2)
+    cache.get_or_load("a", lambda: _frame(1))
+    cache.get_or_load("b", lambda: _frame(2))
+    cache.get_or_load("a", lambda: pytest.fail("a is cached"))
+    cache.get_or_load("c", lambda: _frame(3))
+
+    loads = []
+    cache.get_or_load("a", lambda: loads.append("a") or _frame(1))
+    cache.get_or_load("b", lambda: loads.append("b") or _frame(2))
+    assert loads == ["b"]
+    assert cache.stats()["hits"] == 2
+
+def test_byte_accounting_and_byte_bound():
+    small, large = _frame(10), _frame(1000)
+    cache = QueryCache(max_bytes=_nbytes(large) + _nbytes(small))
+    cache.get_or_load("small", lambda: small)
+    cache.get_or_load("large", lambda: large)
+    assert cache.stats()["bytes"] == _nbytes(small) + _nbytes(large)
+
+    # Over the bound: the least recently used entries go until it fits
+    cache.get_or_load("large2", lambda: _frame(1000))
+    stats = cache.stats()
+    assert (stats["entries"], stats["bytes"], stats["evictions"]) == (1, _nbytes(large), 2)
+
+    # A frame larger than the whole cache is returned but never stored
+    huge = cache.get_or_load("huge", lambda: _frame(100_000))
+    assert len(huge) == 100_000 and cache.stats()["entries"] == 1
+
+def test_cache_hits_do_not_read_the_db(built_db, monkeypatch):
+    query = "SELECT COUNT(*) AS n FROM encounters"
+    expected = cached_query(query)
+    monkeypatch.setattr(type(get_manager()), "reader", lambda self: pytest.fail("cache hit read the DB"))
+    assert cached_query(query) is expected
+
+def test_a_new_build_invalidates_cached_results(built_db):
+    query = "SELECT COUNT(*) AS n FROM build_info"
+    before, version = int(cached_query(query)['n'].iloc[0]), current_build_version()
+    with get_manager().writer() as conn:
+        new_build = record_build(conn, "test")
+    assert current_build_version() == new_build != version
+    assert int(cached_query(query)['n'].iloc[0]) == before + 1
+
+def test_builds_by_other_processes_are_seen_after_the_ttl(built_db, monkeypatch):
+    version = current_build_version()
+    # Written on a connection of its own, as a CLI build in another process would
+    conn = sqlite3.connect(built_db)
+    with conn:
+        conn.execute("INSERT INTO build_info (build_id, built_at, mode) VALUES ('external', '', 'test')")
+    conn.close()
+    assert current_build_version() == version
+    monkeypatch.setattr(query_cache, "BUILD_VERSION_TTL_S", 0)
+    assert current_build_version() == "external"
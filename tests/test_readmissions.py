@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+import pytest
+from src.config import READMISSION_WINDOWS
+from src.readmissions import ENCOUNTER_RETURNS_COLUMNS, compute_encounter_returns
+
+COLUMNS = ["encounter_id", "patient_id", "service_line", "admission_type", "admit_date", "discharge_date"]
+
+def brute_force_returns(encounters, windows=READMISSION_WINDOWS):
+    """encounter_returns by comparing every pair of a patient's encounters."""
+    rows = []
+    df = encounters.assign(admit=pd.to_datetime(encounters["admit_date"]),
+                           discharge=pd.to_datetime(encounters["discharge_date"]))
+    for _, visits in df.groupby("patient_id"):
+        visits = visits.sort_values(["admit", "encounter_id"]).to_dict("records")
+        for i, index in enumerate(visits):
+            for window in windows:
+                gaps = [
+                    (later["admit"] - index["discharge"]).days
+                    for later in visits[i + 1:]
+                    if 0 <= (later["admit"] - index["discharge"]).days <= window["days"]
+                    and (window["scope"] != "same_service" or later["service_line"] == index["service_line"])
+                    and (window["scope"] != "ed" or later["admission_type"] == "ED")
+                ]
+                if gaps:
+                    rows.append((index["encounter_id"], index["patient_id"], window["name"], window["days"],
+                                 len(gaps), gaps[0]))
+    return pd.DataFrame(rows, columns=ENCOUNTER_RETURNS_COLUMNS)
+
+def _canonical(returns):
+    return (returns.astype({c: "int64" for c in ENCOUNTER_RETURNS_COLUMNS if c != "return_window"})
+            .astype({"return_window": str})
+            .sort_values(["encounter_id", "return_window"]).reset_index(drop=True))
+
+def _returns_of(returns, encounter_id):
+    rows = returns[returns["encounter_id"] == encounter_id]
+    return dict(zip(rows["return_window"], zip(rows["return_count"], rows["days_to_first_return"])))
+
+EDGE_ENCOUNTERS = pd.DataFrame([
+    # Readmissions exactly on the 7- and 30-day boundaries, and one day past 90
+    (1, 1, "Medicine", "Inpatient", "2024-01-01", "2024-01-05"),
+    (2, 1, "Surgery", "Inpatient", "2024-01-12", "2024-01-14"),
+    (3, 1, "Medicine", "Inpatient", "2024-02-13", "2024-02-15"),
+    (4, 1, "Medicine", "Inpatient", "2024-05-16", "2024-05-18"),
+    # Several returns by one patient inside every window, two of them through the ED
+    (10, 2, "Cardiology", "Inpatient", "2024-03-01", "2024-03-03"),
+    (11, 2, "Cardiology", "ED", "2024-03-04", "2024-03-04"),
+    (12, 2, "Medicine", "ED", "2024-03-05", "2024-03-05"),
+    (13, 2, "Cardiology", "Inpatient", "2024-03-06", "2024-03-08"),
+    # Same-day transfers: discharged and admitted the same day, and two admits on one day (id breaks the tie)
+    (21, 3, "Medicine", "Inpatient", "2024-04-01", "2024-04-03"),
+    (22, 3, "Surgery", "Inpatient", "2024-04-03", "2024-04-03"),
+    (24, 3, "Medicine", "ED", "2024-04-03", "2024-04-04"),
+    (23, 3, "Surgery", "ED", "2024-04-03", "2024-04-03"),
+    # Overlapping stay: admitted again before the discharge, which is not a return
+    (30, 4, "Medicine", "Inpatient", "2024-06-01", "2024-06-20"),
+    (31, 4, "Medicine", "ED", "2024-06-10", "2024-06-11"),
+], columns=COLUMNS)
+
+def test_edge_cases_match_brute_force():
+    expected = _canonical(brute_force_returns(EDGE_ENCOUNTERS))
+    returns = _canonical(compute_encounter_returns(EDGE_ENCOUNTERS))
+    pd.testing.assert_frame_equal(returns, expected)
+
+    # Boundaries: 7 days is in the 7-day window, 31 is not in the 30-day one, 92 is past 90
+    assert _returns_of(returns, 1) == {"readmit_7d": (1, 7), "readmit_30d": (1, 7), "readmit_90d": (2, 7),
+                                       "same_service_readmit_90d": (1, 39)}
+    assert _returns_of(returns, 2)["readmit_30d"] == (1, 30)
+    assert "readmit_90d" not in _returns_of(returns, 3)
+    # Every later encounter counts, not just the next one
+    assert _returns_of(returns, 10)["readmit_7d"] == (3, 1)
+    assert _returns_of(returns, 10)["ed_revisit_3d"] == (2, 1)
+    assert _returns_of(returns, 10)["same_service_readmit_7d"] == (2, 1)
+    # Same-day transfers return after 0 days; a same-day admit only counts after the lower encounter_id
+    assert _returns_of(returns, 21)["readmit_7d"] == (3, 0)
+    assert _returns_of(returns, 22)["readmit_7d"] == (2, 0)
+    assert _returns_of(returns, 23)["readmit_7d"] == (1, 0)
+    assert 30 not in set(returns["encounter_id"])
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_random_encounters_match_brute_force(seed):
+    rng = np.random.default_rng(seed)
+    n = 400
+    admit = pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 120, n), unit="D")
+    encounters = pd.DataFrame({
+        "encounter_id": rng.permutation(n) + 1,
+        # Few patients over a short span: many returns, ties and boundary gaps
+        "patient_id": rng.integers(1, 30, n),
+        "service_line": rng.choice(["Medicine", "Surgery", "Cardiology"], n),
+        "admission_type": rng.choice(["ED", "Inpatient", "Elective"], n),
+        "admit_date": admit.strftime("%Y-%m-%d"),
+        "discharge_date": (admit + pd.to_timedelta(rng.integers(0, 6, n), unit="D")).strftime("%Y-%m-%d"),
+    })
+    pd.testing.assert_frame_equal(_canonical(compute_encounter_returns(encounters)),
+                                  _canonical(brute_force_returns(encounters)))
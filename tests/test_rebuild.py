@@ -0,0 +1,117 @@
+import sqlite3
+import threading
+import time
+from pathlib import Path
+import pytest
+from streamlit.testing.v1 import AppTest
+from src import quality_checks, rebuild
+from src.build_facts_kpis import run_pipeline
+from src.generate_data import run_data_generation
+from src.query_cache import current_build_version
+from src.sqlite_io import use_db, init_db, get_manager, release_db
+
+def _file_db(path, build_id):
+    """A closed, rollback-journal DB file holding one build_info row."""
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.execute("CREATE TABLE build_info (build_id TEXT, built_at TEXT, mode TEXT)")
+        conn.execute("INSERT INTO build_info VALUES (?, '', 'test')", (build_id,))
+    conn.close()
+
+def test_replace_file_waits_for_in_flight_readers(tmp_path):
+    live, new = tmp_path / "live.db", tmp_path / "new.db"
+    _file_db(live, "old")
+    _file_db(new, "new")
+    manager = get_manager(live)
+    with use_db(live):
+        assert current_build_version() == "old"
+
+    borrowed, release = threading.Event(), threading.Event()
+    seen = []
+    def in_flight_reader():
+        with manager.reader() as conn:
+            borrowed.set()
+            release.wait(5)
+            seen.append(conn.execute("SELECT build_id FROM build_info").fetchone()[0])
+    reader = threading.Thread(target=in_flight_reader)
+    reader.start()
+    borrowed.wait(5)
+    swap = threading.Thread(target=manager.replace_file, args=(new,))
+    swap.start()
+    time.sleep(0.2)
+    assert swap.is_alive()  # held back by the borrowed reader
+    release.set()
+    reader.join(5)
+    swap.join(5)
+
+    assert seen == ["old"]
+    assert not new.exists()
+    with use_db(live):
+        # The swap recycles the manager's connections, so the cached build version is re-read at once
+        assert current_build_version() == "new"
+    release_db(live)
+
+@pytest.fixture
+def live_db(tmp_path, monkeypatch):
+    live = tmp_path / "clinical_ops.db"
+    monkeypatch.setattr(rebuild, "DB_PATH", live)
+    monkeypatch.setattr(rebuild, "REBUILD_DB_PATH", tmp_path / ".clinical_ops.rebuild.db")
+    with use_db(live):
+        init_db()
+        run_data_generation(n_patients=100, n_encounters=300, seed=3)
+        run_pipeline()
+    yield live
+    release_db(live)
+
+def _rebuild_while_reading(live, n_encounters):
+    """Runs a rebuild while a reader keeps counting encounters on the live DB; returns (status, counts)."""
+    counts, errors = set(), []
+    def read_until(done):
+        while not done.is_set():
+            try:
+                with get_manager(live).reader() as conn:
+                    counts.add(conn.execute("SELECT COUNT(*) FROM encounters").fetchone()[0])
+            except Exception as e:
+                errors.append(e)
+    done = threading.Event()
+    reader = threading.Thread(target=read_until, args=(done,))
+    reader.start()
+    assert rebuild.start_rebuild(n_patients=150, n_encounters=n_encounters)
+    while rebuild.rebuild_status()["state"] == "running":
+        time.sleep(0.05)
+    done.set()
+    reader.join(5)
+    assert errors == []
+    return rebuild.rebuild_status(), counts
+
+def test_rebuild_swaps_in_the_new_db_under_live_readers(live_db):
+    status, counts = _rebuild_while_reading(live_db, 400)
+    assert status["state"] == "succeeded", status["message"]
+    # Readers only ever saw the old build or the new one
+    assert counts <= {300, 400}
+    with get_manager(live_db).reader() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM encounters").fetchone()[0] == 400
+        # Metrics history is carried over
+        assert conn.execute("SELECT COUNT(*) FROM pipeline_runs WHERE label = 'background_rebuild'").fetchone()[0] == 1
+    assert not rebuild.REBUILD_DB_PATH.exists()
+
+def test_failed_gates_leave_the_live_db_unchanged(live_db, monkeypatch):
+    monkeypatch.setattr(quality_checks, "run_quality_gates", lambda: False)
+    status, counts = _rebuild_while_reading(live_db, 400)
+    assert status["state"] == "failed"
+    assert counts == {300}
+    with get_manager(live_db).reader() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM encounters").fetchone()[0] == 300
+    assert not rebuild.REBUILD_DB_PATH.exists()
+
+@pytest.mark.parametrize("state", ["running", "succeeded", "failed"])
+def test_app_shows_rebuild_progress(built_db, monkeypatch, state):
+    job = rebuild.RebuildJob()
+    job.state, job.message = state, "rebuild message"
+    monkeypatch.setattr(rebuild, "_job", job)
+    app = Path(__file__).resolve().parent.parent / "app" / "app.py"
+    at = AppTest.from_file(str(app), default_timeout=60).run()
+    assert not at.exception
+    assert bool(at.get("progress")) == (state == "running")
+    shown = [e.value for e in [*at.success, *at.error]]
+    assert any("rebuild message" in text for text in shown) == (state != "running")
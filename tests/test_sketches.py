@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+from src.sketches import HyperLogLog, KLLSketch, hll_by_group, merge_sketches
+
+RNG_SEED = 42
+
+def _hll(values):
+    return HyperLogLog().update(values)
+
+def _rank_error(sorted_values, value, q):
+    """Distance between q and the share of values <= `value` (the sketch's rank error)."""
+    lo = np.searchsorted(sorted_values, value, side="left") / len(sorted_values)
+    hi = np.searchsorted(sorted_values, value, side="right") / len(sorted_values)
+    return 0.0 if lo <= q <= hi else min(abs(q - lo), abs(q - hi))
+
+@pytest.mark.parametrize("n", [100, 5_000, 200_000])
+def test_hll_error_is_within_bounds(n):
+    ids = np.random.default_rng(RNG_SEED).permutation(10 * n)[:n]
+    # Standard error 1.04 / sqrt(2**12) ~ 1.6%; allow 3 sigma
+    assert abs(_hll(np.repeat(ids, 3)).estimate() - n) / n < 0.05
+
+def test_hll_merge_is_associative_and_equals_the_union():
+    rng = np.random.default_rng(RNG_SEED)
+    a, b, c = (rng.integers(0, 100_000, 20_000) for _ in range(3))
+    left = _hll(a).merge(_hll(b)).merge(_hll(c))
+    right = _hll(a).merge(_hll(b).merge(_hll(c)))
+    union = _hll(np.concatenate([a, b, c]))
+    assert np.array_equal(left.registers, right.registers)
+    assert np.array_equal(left.registers, union.registers)
+
+def test_hll_by_group_and_serialization_match_single_sketches():
+    rng = np.random.default_rng(RNG_SEED)
+    codes, values = rng.integers(0, 3, 10_000), rng.integers(0, 50_000, 10_000)
+    for code, hll in enumerate(hll_by_group(codes, values, 3)):
+        assert np.array_equal(hll.registers, _hll(values[codes == code]).registers)
+    merged = merge_sketches([h.to_bytes() for h in hll_by_group(codes, values, 3)], HyperLogLog)
+    assert np.array_equal(merged.registers, _hll(values).registers)
+
+def test_hll_rejects_mixed_precisions():
+    with pytest.raises(ValueError):
+        HyperLogLog(10).merge(HyperLogLog(12))
+
+def test_kll_quantiles_are_within_rank_error():
+    values = np.random.default_rng(RNG_SEED).exponential(5.0, 100_000).round()
+    kll = KLLSketch(seed=RNG_SEED).update(values)
+    truth = np.sort(values)
+    assert kll.n == len(values)
+    for q, estimate in zip([0.5, 0.9, 0.99], kll.quantiles([0.5, 0.9, 0.99])):
+        # ~1.65 / k = 0.8% for the default k of 200
+        assert _rank_error(truth, estimate, q) < 0.02, q
+
+def test_kll_merges_in_any_order_keep_weight_and_accuracy():
+    rng = np.random.default_rng(RNG_SEED)
+    parts = [rng.normal(loc, 3.0, 30_000) for loc in (10, 20, 30)]
+    truth = np.sort(np.concatenate(parts))
+
+    def sketch(i):
+        return KLLSketch(seed=i).update(parts[i])
+    left = sketch(0).merge(sketch(1)).merge(sketch(2))
+    right = sketch(0).merge(sketch(1).merge(sketch(2)))
+    blobs = merge_sketches([sketch(i).to_bytes() for i in (2, 0, 1)], KLLSketch)
+    for merged in (left, right, blobs):
+        assert merged.n == len(truth)
+        for q, estimate in zip([0.1, 0.5, 0.9], merged.quantiles([0.1, 0.5, 0.9])):
+            assert _rank_error(truth, estimate, q) < 0.02, q
+
+def test_kll_serialization_round_trips_and_empty_sketches():
+    kll = KLLSketch().update(np.arange(10_000, dtype=float))
+    restored = KLLSketch.from_bytes(kll.to_bytes())
+    assert restored.n == kll.n and restored.quantiles([0.5]) == kll.quantiles([0.5])
+    assert np.isnan(KLLSketch().update([np.nan]).quantiles([0.5])[0])
+    assert merge_sketches([], KLLSketch) is None
@@ -0,0 +1,27 @@
+from pathlib import Path
+import pandas as pd
+from streamlit.testing.v1 import AppTest
+from src.dashboard_queries import kpi_control_chart, list_service_lines
+from src.spc import SPC_COLUMNS, derive_spc
+
+PAGES_DIR = Path(__file__).resolve().parent.parent / "app" / "pages"
+
+def test_derive_spc_of_no_counts_is_empty_and_typed():
+    # SUMs over no rows come back as object columns
+    counts = pd.DataFrame({'month': [], 'service_line': [], 'kpi': [], 'numerator': [], 'denominator': []},
+                          dtype=object)
+    spc = derive_spc(counts)
+    assert spc.empty
+    assert list(spc.columns) == SPC_COLUMNS
+    assert spc['cum_numerator'].dtype == 'int64' and spc['ucl'].dtype == 'float64'
+
+def test_control_chart_of_no_service_lines_is_empty(built_db):
+    assert kpi_control_chart([]).empty
+    assert not kpi_control_chart(list_service_lines()[:1]).empty
+
+def test_executive_overview_renders_with_no_service_lines(built_db):
+    at = AppTest.from_file(str(PAGES_DIR / "1_Executive_Overview.py"), default_timeout=120).run()
+    assert not at.exception
+    at.sidebar.multiselect[0].set_value([]).run()
+    assert not at.exception and not at.error
+    assert "Control Chart" not in [box.label for box in at.selectbox]